@@ -21,6 +21,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 from accelerate.logging import get_logger
 
+from LHM.utils.compile import compile_hot_path
+
 logger = get_logger(__name__)
 
 
@@ -174,7 +176,7 @@ class Dinov2FusionWrapper(nn.Module):
         model = model_fn(modulation_dim=modulation_dim, pretrained=pretrained)
         return model
 
-    @torch.compile
+    @compile_hot_path("dinov2_fusion")
     def forward(self, image: torch.Tensor, mod: torch.Tensor = None):
         # image: [N, C, H, W]
         # mod: [N, D] or None
@@ -21,6 +21,8 @@ import torchvision
 from accelerate.logging import get_logger
 from tqdm import tqdm
 
+from LHM.utils.compile import compile_hot_path
+
 logger = get_logger(__name__)
 
 timings = {}
@@ -206,7 +208,7 @@ class SapiensWrapper(nn.Module):
         for name, param in self.model.named_parameters():
             param.requires_grad = False
 
-    @torch.compile
+    @compile_hot_path("sapiens")
     def forward(self, image: torch.Tensor, mod: torch.Tensor = None):
         # image: [N, C, H, W]
         # mod: [N, D] or None
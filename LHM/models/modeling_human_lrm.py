@@ -9,6 +9,7 @@ import pdb
 import pickle
 import time
 from collections import defaultdict
+from functools import partial
 
 import numpy as np
 import torch
@@ -21,9 +22,13 @@ from LHM.models.arcface_utils import ResNetArcFace
 from LHM.models.ESRGANer_utils import ESRGANEasyModel
 from LHM.models.rendering.gs_renderer import GS3DRenderer, PointEmbed
 from LHM.models.rendering.gsplat_renderer import GSPlatRenderer
+from LHM.models.rendering.utils.gs_lod import build_gaussian_lod
+from LHM.models.token_select import select_condition_tokens
+from LHM.models.transformer_dit import run_eager
 
 # from openlrm.models.stylegan2_utils import EasyStyleGAN_series_model
 from LHM.models.utils import linear
+from LHM.utils.compile import compile_hot_path
 
 from .embedder import CameraEmbedder
 from .rendering.synthesizer import TriplaneSynthesizer
@@ -147,6 +152,7 @@ class ModelHumanLRM(nn.Module):
             gradient_checkpointing=self.gradient_checkpointing,
             apply_pose_blendshape=kwargs.get("apply_pose_blendshape", False),
             dense_sample_pts=dense_sample_pts,
+            rasterizer=kwargs.get("rasterizer", "auto"),
         )
 
         # face_id
@@ -315,7 +321,7 @@ class ModelHumanLRM(nn.Module):
             image_feats = self.encoder(image)
         return image_feats
 
-    @torch.compile
+    @compile_hot_path("forward_latent_points")
     def forward_latent_points(self, image, camera, query_points=None):
         """
         Forward pass of the latent points generation.
@@ -570,6 +576,12 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
             linear(mid_dim, pcl_dim * 2),
         )
 
+        # mask-aware body token pruning, see select_condition_tokens. None keeps all 4096 tokens
+        self.cond_token_keep = kwargs.get("cond_token_keep", None)
+        self.cond_token_merge = kwargs.get("cond_token_merge", False)
+        # head/body branch overlap of the transformer blocks, see set_branch_overlap
+        self.branch_overlap = False
+
     def build_transformer(
         self,
         transformer_type,
@@ -682,8 +694,10 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
 
         return motion_tokens
 
-    @torch.compile
-    def forward_latent_points(self, image, head_image, camera, query_points=None):
+    @compile_hot_path("forward_latent_points")
+    def forward_latent_points(
+        self, image, head_image, camera, query_points=None, fg_mask=None
+    ):
         """
         Forward pass of the latent points generation.
         Args:
@@ -691,6 +705,8 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
             head_image (torch.Tensor): Input head image tensor of shape [B, C_img, H_img, W_img].
             camera (torch.Tensor): Camera tensor of shape [B, D_cam_raw].
             query_points (torch.Tensor, optional): Query points tensor. for example, smplx surface points, Defaults to None.
+            fg_mask (torch.Tensor, optional): Foreground mask of image [B, 1, H_img, W_img]. With cond_token_keep,
+                only the body tokens covering the most foreground are fed to the transformer. Defaults to None.
         Returns:
             torch.Tensor: Generated tokens tensor.
             torch.Tensor: Encoded image features tensor.
@@ -706,6 +722,14 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
 
         motion_tokens = self.forward_moitonembed(body_feats)
 
+        num_body_tokens = body_feats.shape[1]
+        if fg_mask is not None and self.cond_token_keep is not None:
+            body_feats = select_condition_tokens(
+                body_feats, fg_mask, self.cond_token_keep, merge=self.cond_token_merge
+            )
+            num_body_tokens = body_feats.shape[1]
+            image_feats = torch.cat([body_feats, head_feats], dim=1)
+
         assert (
             image_feats.shape[-1] == self.fine_encoder_feat_dim
         ), f"Feature dimension mismatch: {image_feats.shape[-1]} vs {self.fine_encoder_feat_dim}"
@@ -722,6 +746,7 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
             camera_embeddings=None,
             query_points=query_points,
             motion_embed=motion_tokens,
+            num_body_tokens=num_body_tokens,
         )
 
         return tokens, image_feats
@@ -774,13 +799,17 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
         render_intrs,
         render_bg_colors,
         smplx_params,
+        fg_mask=None,
     ):
+        """fg_mask: optional [B, 1, H_img, W_img] foreground mask of image, see forward_latent_points."""
         assert len(smplx_params["betas"].shape) == 2
 
         if self.facesr:
             head_image = self.obtain_facesr(head_image)
 
-        assert image.shape[0] == 1
+        assert (
+            image.shape[0] == smplx_params["betas"].shape[0]
+        ), "Batch size mismatch for image and smplx_params"
 
         query_points = None
         if self.latent_query_points_type.startswith("e2e_smplx"):
@@ -790,7 +819,11 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
 
         # latent_points是image_feats+transformer
         latent_points, image_feats = self.forward_latent_points(
-            image[:, 0], head_image[:, 0], camera=None, query_points=query_points
+            image[:, 0],
+            head_image[:, 0],
+            camera=None,
+            query_points=query_points,
+            fg_mask=fg_mask,
         )  # [B, N, C]
 
         self.renderer.hyper_step(10000000)  # set to max step
@@ -808,10 +841,62 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
             # query_points: SMPL 体表点坐标（标准姿态下）
             # transform_mat_neutral_pose: 用于从标准姿态映射到当前姿态的变换矩阵
         return gs_model_list, query_points, smplx_params['transform_mat_neutral_pose']
+
+    @torch.no_grad()
+    def infer_batch(self, image, head_image, betas, fg_mask=None):
+        """reconstruct B avatars in a single forward.
+        Args:
+            image: [B, C_img, H_img, W_img], preprocessed reference images of the same size.
+            head_image: [B, C_img, H_head, W_head]
+            betas: [B, 100]
+            fg_mask: optional [B, 1, H_img, W_img] foreground masks of image.
+        Returns:
+            list of B (gs_model_list, query_points [1, N, 3], transform_mat_neutral_pose [1, 55, 4, 4]),
+            each one the same as infer_single_view of that image.
+        """
+        assert (
+            image.shape[0] == head_image.shape[0] == betas.shape[0]
+        ), "Batch size mismatch for image, head_image and betas"
+
+        gs_model_list, query_points, transform_mat_neutral_pose = self.infer_single_view(
+            image.unsqueeze(1),
+            head_image.unsqueeze(1),
+            None,
+            None,
+            None,
+            None,
+            None,
+            smplx_params={"betas": betas},
+            fg_mask=fg_mask,
+        )
+
+        return [
+            (
+                [gs_model_list[b]],
+                query_points[b : b + 1],
+                transform_mat_neutral_pose[b : b + 1],
+            )
+            for b in range(image.shape[0])
+        ]
     
 
-    def animation_infer(self, gs_model_list, query_points, smplx_params, render_c2ws, render_intrs, render_bg_colors):
+    def animation_infer(
+        self,
+        gs_model_list,
+        query_points,
+        smplx_params,
+        render_c2ws,
+        render_intrs,
+        render_bg_colors,
+        view_chunk_size=None,
+        neutral_pose_cache_list=None,
+    ):
         '''Inference code avoid repeat forward.
+
+        The views are animated in chunks of `view_chunk_size` frames: all frames of a chunk
+        are deformed by one SMPL-X/LBS pass and then rasterized view by view.
+        view_chunk_size=None animates every view in one pass, 1 restores the per-frame loop.
+        neutral_pose_cache_list (from build_neutral_pose_cache) skips the pose-independent skinning stage.
         '''
 
         render_h, render_w = int(render_intrs[0, 0, 1, 2] * 2), int(
@@ -820,17 +905,21 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
         # render target views
         render_res_list = []
         num_views = render_c2ws.shape[1]
+        if view_chunk_size is None:
+            view_chunk_size = num_views
 
-        for view_idx in range(num_views):
+        for view_idx in range(0, num_views, view_chunk_size):
+            view_end = min(view_idx + view_chunk_size, num_views)
             render_res = self.renderer.forward_animate_gs(
                 gs_model_list,
                 query_points,
-                self.renderer.get_single_view_smpl_data(smplx_params, view_idx),
-                render_c2ws[:, view_idx : view_idx + 1],
-                render_intrs[:, view_idx : view_idx + 1],
+                self.renderer.get_multi_view_smpl_data(smplx_params, view_idx, view_end),
+                render_c2ws[:, view_idx:view_end],
+                render_intrs[:, view_idx:view_end],
                 render_h,
                 render_w,
-                render_bg_colors[:, view_idx : view_idx + 1],
+                render_bg_colors[:, view_idx:view_end],
+                neutral_pose_cache_list=neutral_pose_cache_list,
             )
             render_res_list.append(render_res)
 
@@ -853,6 +942,40 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
                 out[k] = v
         return out
 
+    @torch.no_grad()
+    def build_neutral_pose_cache(
+        self, gs_model_list, query_points, smplx_params, point_index_list=None
+    ):
+        '''Precompute the pose-independent skinning of the avatars returned by infer_single_view.
+        smplx_params requires betas and transform_mat_neutral_pose.
+        point_index_list is required for avatars compacted by compact_gs_model.
+        '''
+        return self.renderer.build_neutral_pose_cache(
+            gs_model_list, query_points, smplx_params, point_index_list=point_index_list
+        )
+
+    @torch.no_grad()
+    def compact_gs_model(
+        self, gs_model_list, query_points, opacity_threshold=0.005, min_scale=0.0, voxel_size=0.0
+    ):
+        '''Prune near-transparent and sub-pixel gaussians and optionally merge them within voxel_size,
+        so that the skinning and the rasterizer only process the kept subset.
+        Returns the compacted gs_model_list, query_points list and point_index_list.
+        '''
+        compact_gs_list, compact_query_points, point_index_list = [], [], []
+        for b in range(len(gs_model_list)):
+            gs_attr, query_pt, point_index = build_gaussian_lod(
+                gs_model_list[b],
+                query_points[b],
+                voxel_sizes=(voxel_size,),
+                opacity_threshold=opacity_threshold,
+                min_scale=min_scale,
+            )[0]
+            compact_gs_list.append(gs_attr)
+            compact_query_points.append(query_pt)
+            point_index_list.append(point_index)
+        return compact_gs_list, compact_query_points, point_index_list
+
     def animation_infer_gs(self, gs_attr_list, query_points, smplx_params):
         '''Inference code to query gs mesh.
         '''
@@ -872,7 +995,12 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
         return merge_animatable_gs_model_list[0]
 
     def forward_transformer(
-        self, image_feats, camera_embeddings, query_points, motion_embed=None
+        self,
+        image_feats,
+        camera_embeddings,
+        query_points,
+        motion_embed=None,
+        num_body_tokens=None,
     ):
         """
         Applies forward transformation to the input features.
@@ -881,6 +1009,7 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
             camera_embeddings (torch.Tensor): Camera embeddings. Shape [B, D].
             query_points (torch.Tensor): Query points. Shape [B, L, D].
             motion embed(torch.Tensor): Query points. Shape [B, L, D].
+            num_body_tokens (int): leading body tokens of image_feats, the rest are head tokens.
         Returns:
             torch.Tensor: Transformed features. Shape [B, L, D].
         """
@@ -901,11 +1030,18 @@ class ModelHumanLRMSapdinoBodyHeadSD3_5(ModelHumanLRM):
 
             x = self.pcl_embed(query_points)  # [B, L, D]
 
-        x = self.transformer(
+        transformer = self.transformer
+        if self.branch_overlap and not torch.is_grad_enabled():
+            # the side streams of the overlap are eager only, forward_latent_points is compiled:
+            # break its graph around the transformer instead of losing the overlap
+            transformer = partial(run_eager, self.transformer)
+
+        x = transformer(
             x,
             cond=image_feats,
             mod=camera_embeddings,
             temb=motion_embed,
+            num_body_tokens=num_body_tokens,
         )  # [B, L, D]
         return x
 
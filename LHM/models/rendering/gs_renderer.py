@@ -10,17 +10,16 @@ import omegaconf
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from diff_gaussian_rasterization import (
-    GaussianRasterizationSettings,
-    GaussianRasterizer,
-)
+from numpy.lib.recfunctions import structured_to_unstructured
 from plyfile import PlyData, PlyElement
 from pytorch3d.transforms import matrix_to_quaternion
 from pytorch3d.transforms.rotation_conversions import quaternion_multiply
 
+from LHM.models.rendering.rasterizer import RasterSettings, build_rasterizer
 from LHM.models.rendering.smpl_x import SMPLXModel, read_smplx_param
 from LHM.models.rendering.smpl_x_voxel_dense_sampling import SMPLXVoxelMeshModel
 from LHM.models.rendering.utils.sh_utils import RGB2SH, SH2RGB
+from LHM.models.rendering.utils.splat_io import pack_splat, unpack_splat
 from LHM.models.rendering.utils.typing import *
 from LHM.models.rendering.utils.utils import MLP, trunc_exp
 from LHM.models.utils import LinerParameterTuner, StaticParameterTuner
@@ -248,11 +247,11 @@ class GaussianModel:
             (attribute, "f4") for attribute in self.construct_list_of_attributes()
         ]
 
-        elements = np.empty(xyz.shape[0], dtype=dtype_full)
         attributes = np.concatenate(
             (xyz, normals, f_dc, f_rest, opacities, scale, rotation), axis=1
-        )
-        elements[:] = list(map(tuple, attributes))
+        ).astype(np.float32)
+        # every field is f4, so the [N, F] rows are already the packed vertex records
+        elements = np.ascontiguousarray(attributes).view(dtype_full)[:, 0]
         el = PlyElement.describe(elements, "vertex")
         PlyData([el]).write(path)
 
@@ -260,58 +259,34 @@ class GaussianModel:
 
         plydata = PlyData.read(path)
 
-        xyz = np.stack(
-            (
-                np.asarray(plydata.elements[0]["x"]),
-                np.asarray(plydata.elements[0]["y"]),
-                np.asarray(plydata.elements[0]["z"]),
-            ),
-            axis=1,
-        )
-        opacities = np.asarray(plydata.elements[0]["opacity"])[..., np.newaxis]
+        vertex = plydata.elements[0]
+        # all properties as one [N, F] float32 matrix, attributes are column slices of it
+        attributes = structured_to_unstructured(vertex.data, dtype=np.float32)
+        property_idx = {p.name: idx for idx, p in enumerate(vertex.properties)}
 
-        features_dc = np.zeros((xyz.shape[0], 3, 1))
-        features_dc[:, 0, 0] = np.asarray(plydata.elements[0]["f_dc_0"])
-        features_dc[:, 1, 0] = np.asarray(plydata.elements[0]["f_dc_1"])
-        features_dc[:, 2, 0] = np.asarray(plydata.elements[0]["f_dc_2"])
+        def _columns(prefix):
+            names = [name for name in property_idx if name.startswith(prefix)]
+            names = sorted(names, key=lambda x: int(x.split("_")[-1]))
+            return attributes[:, [property_idx[name] for name in names]]
 
-        extra_f_names = [
-            p.name
-            for p in plydata.elements[0].properties
-            if p.name.startswith("f_rest_")
-        ]
+        xyz = attributes[:, [property_idx["x"], property_idx["y"], property_idx["z"]]]
+        opacities = attributes[:, [property_idx["opacity"]]]
+
+        features_dc = _columns("f_dc_")[:, :3, np.newaxis]  # [N, 3, 1]
 
-        extra_f_names = sorted(extra_f_names, key=lambda x: int(x.split("_")[-1]))
-        sh_degree = int(math.sqrt((len(extra_f_names) + 3) / 3)) - 1
+        features_extra = _columns("f_rest_")
+        sh_degree = int(math.sqrt((features_extra.shape[1] + 3) / 3)) - 1
 
         print("load sh degree: ", sh_degree)
 
-        features_extra = np.zeros((xyz.shape[0], len(extra_f_names)))
-        for idx, attr_name in enumerate(extra_f_names):
-            features_extra[:, idx] = np.asarray(plydata.elements[0][attr_name])
         # Reshape (P,F*SH_coeffs) to (P, F, SH_coeffs except DC)
         # 0, 3, 8, 15
         features_extra = features_extra.reshape(
             (features_extra.shape[0], 3, (sh_degree + 1) ** 2 - 1)
         )
 
-        scale_names = [
-            p.name
-            for p in plydata.elements[0].properties
-            if p.name.startswith("scale_")
-        ]
-        scale_names = sorted(scale_names, key=lambda x: int(x.split("_")[-1]))
-        scales = np.zeros((xyz.shape[0], len(scale_names)))
-        for idx, attr_name in enumerate(scale_names):
-            scales[:, idx] = np.asarray(plydata.elements[0][attr_name])
-
-        rot_names = [
-            p.name for p in plydata.elements[0].properties if p.name.startswith("rot")
-        ]
-        rot_names = sorted(rot_names, key=lambda x: int(x.split("_")[-1]))
-        rots = np.zeros((xyz.shape[0], len(rot_names)))
-        for idx, attr_name in enumerate(rot_names):
-            rots[:, idx] = np.asarray(plydata.elements[0][attr_name])
+        scales = _columns("scale_")
+        rots = _columns("rot")
 
         xyz = torch.from_numpy(xyz).to(self.xyz)
         opacities = torch.from_numpy(opacities).to(self.opacity)
@@ -335,6 +310,45 @@ class GaussianModel:
 
         self.active_sh_degree = sh_degree
 
+    def save_splat(self, path, quantize=True):
+        """compact binary export, see LHM.models.rendering.utils.splat_io.
+        quantize: 8-bit rotation, opacity and colour, otherwise float16.
+        """
+
+        def _numpy(x):
+            return x.detach().float().cpu().numpy()
+
+        buffer = pack_splat(
+            _numpy(self.xyz),
+            _numpy(self.opacity),
+            _numpy(self.rotation),
+            _numpy(self.scaling),
+            _numpy(self.shs),
+            self.use_rgb,
+            quantize=quantize,
+        )
+        with open(path, "wb") as f:
+            f.write(buffer)
+
+    def load_splat(self, path):
+
+        with open(path, "rb") as f:
+            gs = unpack_splat(f.read())
+
+        shs = torch.from_numpy(gs["shs"]).to(self.shs)
+        if gs["use_rgb"] != self.use_rgb:
+            shs = SH2RGB(shs) if self.use_rgb else RGB2SH(shs)
+
+        self.xyz: Tensor = torch.from_numpy(gs["xyz"]).to(self.xyz)
+        self.opacity: Tensor = torch.from_numpy(gs["opacity"]).to(self.opacity)
+        self.rotation: Tensor = self.rotation_activation(
+            torch.from_numpy(gs["rotation"]).to(self.rotation)
+        )
+        self.scaling: Tensor = torch.from_numpy(gs["scaling"]).to(self.scaling)
+        self.shs: Tensor = shs
+
+        self.active_sh_degree = int(math.sqrt(shs.shape[1])) - 1
+
     def clone(self):
         xyz = self.xyz.clone()
         opacity = self.opacity.clone()
@@ -781,6 +795,7 @@ class GS3DRenderer(nn.Module):
         gradient_checkpointing=False,
         apply_pose_blendshape=False,
         dense_sample_pts=40000,  # only use for dense_smaple_smplx
+        rasterizer="auto",  # auto, cuda or torch, see rendering/rasterizer.py
     ):
 
         super().__init__()
@@ -791,6 +806,7 @@ class GS3DRenderer(nn.Module):
 
         self.scaling_modifier = 1.0
         self.sh_degree = sh_degree
+        self.rasterizer = build_rasterizer(rasterizer)
 
         if self.smpl_type == "smplx_0" or self.smpl_type == "smplx":
             # Using pytorch3d dense sampling
@@ -865,24 +881,12 @@ class GS3DRenderer(nn.Module):
         background_color: Optional[Float[Tensor, "3"]],
         ret_mask: bool = True,
     ):
-        # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-        screenspace_points = (
-            torch.zeros_like(
-                gs.xyz, dtype=gs.xyz.dtype, requires_grad=True, device=self.device
-            )
-            + 0
-        )
-        try:
-            screenspace_points.retain_grad()
-        except:
-            pass
-
         bg_color = background_color
         # Set up rasterization configuration
         tanfovx = math.tan(viewpoint_camera.FoVx * 0.5)
         tanfovy = math.tan(viewpoint_camera.FoVy * 0.5)
 
-        raster_settings = GaussianRasterizationSettings(
+        raster_settings = RasterSettings(
             image_height=int(viewpoint_camera.height),
             image_width=int(viewpoint_camera.width),
             tanfovx=tanfovx,
@@ -893,14 +897,9 @@ class GS3DRenderer(nn.Module):
             projmatrix=viewpoint_camera.full_proj_transform.float(),
             sh_degree=self.sh_degree,
             campos=viewpoint_camera.camera_center,
-            prefiltered=False,
-            debug=False,
         )
 
-        rasterizer = GaussianRasterizer(raster_settings=raster_settings)
-
         means3D = gs.xyz
-        means2D = screenspace_points
         opacity = gs.opacity
 
         # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
@@ -925,15 +924,14 @@ class GS3DRenderer(nn.Module):
         # Rasterize visible Gaussians to image, obtain their radii (on screen).
         # NOTE that dadong tries to regress rgb not shs
         with torch.autocast(device_type=self.device.type, dtype=torch.float32):
-            rendered_image, radii, rendered_depth, rendered_alpha = rasterizer(
+            rendered_image, radii, rendered_depth, rendered_alpha = self.rasterizer(
+                raster_settings,
                 means3D=means3D.float(),
-                means2D=means2D.float(),
                 shs=shs,
                 colors_precomp=colors_precomp,
                 opacities=opacity.float(),
                 scales=scales.float(),
                 rotations=rotations.float(),
-                cov3D_precomp=cov3D_precomp,
             )
 
         ret = {
@@ -985,13 +983,28 @@ class GS3DRenderer(nn.Module):
 # debug：是否启用 debug 分支。
 
     def animate_gs_model(
-        self, gs_attr: GaussianAppOutput, query_points, smplx_data, debug=False
+        self,
+        gs_attr: GaussianAppOutput,
+        query_points,
+        smplx_data,
+        debug=False,
+        neutral_pose_cache=None,
     ):
         """
         query_points: [N, 3]
+        neutral_pose_cache: optional output of build_neutral_pose_cache, skips the pose-independent skinning stage.
+            Required for a compacted (pruned / LOD) avatar, whose N gaussians map to the dense sample points
+            through neutral_pose_cache.point_index.
         """
 
         device = gs_attr.offset_xyz.device
+        point_index = (
+            neutral_pose_cache.point_index if neutral_pose_cache is not None else None
+        )
+        num_dense_points = self.smplx_model.smpl_x.vertex_num_upsampled
+        assert (
+            point_index is not None or gs_attr.offset_xyz.shape[0] == num_dense_points
+        ), "a compacted avatar needs the neutral pose cache built with its point_index"
         
 # Debug 模式下，覆盖属性为固定值，用于检查流程。
         # 作用：构造包含每个视角 pose 和 canonical pose 的变换参数集合，特别是 body_pose 包含两个姿态：当前视角（动画帧）和 neutral pose。
@@ -1076,15 +1089,24 @@ class GS3DRenderer(nn.Module):
         # 所以：
         # query_points 决定“怎么变”
         # mean_3d 决定“变什么”
-            mean_3d, transform_matrix = (
-                self.smplx_model.transform_to_posed_verts_from_neutral_pose(
-                    mean_3d, # 当前点坐标（canonical）
-                    merge_smplx_data,  # 当前帧的 SMPL-X 参数（pose、trans 等） 
-                    query_points,    # 原始顶点位置（skin weight 索引用） 
-                    transform_mat_neutral_pose=transform_mat_neutral_pose,  # from predefined pose to zero-pose matrix  # canonical 的骨架变换
-                    device=device,
-                )
-            )  # [B, N, 3]
+            if neutral_pose_cache is not None:
+                mean_3d, transform_matrix = (
+                    self.smplx_model.transform_to_posed_verts_from_neutral_pose_cache(
+                        neutral_pose_cache,
+                        merge_smplx_data,
+                        device=device,
+                    )
+                )  # [B, N, 3]
+            else:
+                mean_3d, transform_matrix = (
+                    self.smplx_model.transform_to_posed_verts_from_neutral_pose(
+                        mean_3d, # 当前点坐标（canonical）
+                        merge_smplx_data,  # 当前帧的 SMPL-X 参数（pose、trans 等） 
+                        query_points,    # 原始顶点位置（skin weight 索引用） 
+                        transform_mat_neutral_pose=transform_mat_neutral_pose,  # from predefined pose to zero-pose matrix  # canonical 的骨架变换
+                        device=device,
+                    )
+                )  # [B, N, 3]
 
             # rotation appearance from canonical space to view_posed
             num_view, N, _, _ = transform_matrix.shape
@@ -1098,6 +1120,8 @@ class GS3DRenderer(nn.Module):
 
             # inference constrain
             is_constrain_body = self.smplx_model.is_constrain_body
+            if point_index is not None:
+                is_constrain_body = is_constrain_body[point_index]
             rigid_rotation_matrix[:, is_constrain_body] = I
             # 🌀 原始旋转（canonical）：
             rotation_neutral_pose = gs_attr.rotation.unsqueeze(0).repeat(num_view, 1, 1)
@@ -1174,6 +1198,51 @@ class GS3DRenderer(nn.Module):
 
         return gs_attr
 
+    def forward_gs_attr_batch(self, x, query_points, x_fine=None):
+        """batched forward_gs_attr, the MLP and GSLayer run once over all B*N points.
+        x: [B, N, C] Float[Tensor, "B Np Cp"],
+        query_points: [B, N, 3] Float[Tensor, "B Np 3"]
+        return: list of B GaussianAppOutput, each the same as forward_gs_attr(x[b], query_points[b])
+        """
+        batch_size, num_points = x.shape[:2]
+
+        x = x.reshape(batch_size * num_points, -1)
+        if x_fine is not None:
+            x_fine = x_fine.reshape(batch_size * num_points, -1)
+        if self.mlp_network_config is not None:
+            x = self.mlp_net(x)
+            if x_fine is not None:
+                x_fine = self.mlp_net(x_fine)
+
+        # region masks are per point, tile them over the flattened batch
+        constrain_dict = dict(
+            is_constrain_body=self.smplx_model.is_constrain_body.repeat(batch_size),
+            is_hands=(self.smplx_model.is_rhand + self.smplx_model.is_lhand).repeat(
+                batch_size
+            ),
+            is_upper_body=self.smplx_model.is_upper_body.repeat(batch_size),
+        )
+
+        gs_attr: GaussianAppOutput = self.gs_net(
+            x, query_points.reshape(batch_size * num_points, 3), x_fine, constrain_dict
+        )
+
+        gs_attr_list = []
+        for b in range(batch_size):
+            gs_attr_list.append(
+                GaussianAppOutput(
+                    **{
+                        k: (
+                            v[b * num_points : (b + 1) * num_points]
+                            if isinstance(v, Tensor)
+                            else v
+                        )
+                        for k, v in gs_attr.items()
+                    }
+                )
+            )
+        return gs_attr_list
+
     def get_query_points(self, smplx_data, device):
         with torch.no_grad():
             with torch.autocast(device_type=device.type, dtype=torch.float32):
@@ -1364,7 +1433,11 @@ class GS3DRenderer(nn.Module):
         return smpl_data_single_batch
 
     def get_single_view_smpl_data(self, smpl_data, vidx):
-        smpl_data_single_view = {}
+        return self.get_multi_view_smpl_data(smpl_data, vidx, vidx + 1)
+
+    def get_multi_view_smpl_data(self, smpl_data, vidx_start, vidx_end):
+        """slice views [vidx_start, vidx_end) so that they can be animated by a single LBS pass."""
+        smpl_data_multi_view = {}
         for k, v in smpl_data.items():
             assert v.shape[0] == 1
             if (
@@ -1373,12 +1446,12 @@ class GS3DRenderer(nn.Module):
                 or (k == "face_offset")
                 or (k == "transform_mat_neutral_pose")
             ):
-                smpl_data_single_view[k] = v  # e.g. betas: [1, 100] -> [1, 100]
+                smpl_data_multi_view[k] = v  # e.g. betas: [1, 100] -> [1, 100]
             else:
-                smpl_data_single_view[k] = v[
-                    :, vidx : vidx + 1
-                ]  # e.g. body_pose: [1, N_v, 21, 3] -> [1, 1, 21, 3]
-        return smpl_data_single_view
+                smpl_data_multi_view[k] = v[
+                    :, vidx_start:vidx_end
+                ]  # e.g. body_pose: [1, N_v, 21, 3] -> [1, N_chunk, 21, 3]
+        return smpl_data_multi_view
         
     # 输入：
     #     gs_hidden_features: Transformer 或 MLP 输出的点云特征张量，形状 [batch, num_points, feat_dim]。
@@ -1412,27 +1485,62 @@ class GS3DRenderer(nn.Module):
 
         # 初始化输出容器
         # 用于存储每个 batch element 的 Gaussian 属性（如坐标偏移、透明度、颜色等）。
-        # 按 batch 逐项处理：
+        # 整个 batch 一次处理：
         #     若使用 decoder 输出字典结构（如 coarse + fine），则将它们输入 forward_gs_attr()；
         #     forward_gs_attr() 调用内部 GSLayer，计算Gaussian属性，返回 GaussianAppOutput（封装属性）。
-        gs_attr_list = []
-        for b in range(batch_size):
-            if isinstance(query_gs_features, dict):
-                gs_attr = self.forward_gs_attr(
-                    query_gs_features["coarse"][b],
-                    query_points[b],
-                    None,
-                    debug,
-                    x_fine=query_gs_features["fine"][b],
-                )
-            else:
-                gs_attr = self.forward_gs_attr(
-                    query_gs_features[b], query_points[b], None, debug
-                )
-            gs_attr_list.append(gs_attr)
+        # the whole batch goes through the GSLayer at once, then is split per element.
+        if isinstance(query_gs_features, dict):
+            gs_attr_list = self.forward_gs_attr_batch(
+                query_gs_features["coarse"],
+                query_points,
+                x_fine=query_gs_features["fine"],
+            )
+        else:
+            gs_attr_list = self.forward_gs_attr_batch(query_gs_features, query_points)
+        assert len(gs_attr_list) == batch_size
 
         return gs_attr_list, query_points, smplx_data
 
+    @torch.no_grad()
+    def build_neutral_pose_cache(
+        self, gs_attr_list, query_points, smplx_data, point_index_list=None
+    ):
+        """precompute the pose-independent skinning stage for each avatar of the batch.
+        smplx_data: betas [B, 100] and transform_mat_neutral_pose [B, 55, 4, 4] are required.
+        point_index_list: optional, for compacted avatars (see utils.gs_lod) the [N_b] dense sample point
+            of each gaussian, query_points[b] being the matching [N_b, 3] points.
+        """
+        if not hasattr(self.smplx_model, "build_neutral_pose_cache"):
+            return None
+
+        neutral_pose_cache_list = []
+        for b in range(len(gs_attr_list)):
+            gs_attr = gs_attr_list[b]
+            device = gs_attr.offset_xyz.device
+            single_smplx_data = self.get_single_batch_smpl_data(
+                {
+                    k: smplx_data[k]
+                    for k in ["betas", "face_offset", "joint_offset", "transform_mat_neutral_pose"]
+                    if k in smplx_data
+                },
+                b,
+            )
+
+            with torch.autocast(device_type=device.type, dtype=torch.float32):
+                mean_3d = query_points[b] + gs_attr.offset_xyz  # [N, 3]
+                neutral_pose_cache_list.append(
+                    self.smplx_model.build_neutral_pose_cache(
+                        mean_3d.unsqueeze(0),
+                        single_smplx_data,
+                        single_smplx_data["transform_mat_neutral_pose"].unsqueeze(0),
+                        device=device,
+                        point_index=(
+                            point_index_list[b] if point_index_list is not None else None
+                        ),
+                    )
+                )
+        return neutral_pose_cache_list
+
     def forward_animate_gs(
         self,
         gs_attr_list,
@@ -1445,6 +1553,7 @@ class GS3DRenderer(nn.Module):
         background_color,
         debug=False,
         df_data=None,  # deepfashion-style dataset
+        neutral_pose_cache_list=None,
     ):
         batch_size = len(gs_attr_list)
         out_list = []
@@ -1469,6 +1578,11 @@ class GS3DRenderer(nn.Module):
                 query_pt,
                 self.get_single_batch_smpl_data(smplx_data, b),
                 debug=debug,
+                neutral_pose_cache=(
+                    neutral_pose_cache_list[b]
+                    if neutral_pose_cache_list is not None
+                    else None
+                ),
             )
             
             animatable_gs_model_list = merge_animatable_gs_model_list[:N_view]
@@ -0,0 +1,480 @@
+import math
+from abc import ABC, abstractmethod
+from typing import NamedTuple
+
+import torch
+
+try:
+    from diff_gaussian_rasterization import (
+        GaussianRasterizationSettings,
+        GaussianRasterizer,
+    )
+
+    diff_gaussian_rasterization_enable = True
+except:
+    diff_gaussian_rasterization_enable = False
+
+from LHM.models.rendering.utils.sh_utils import eval_sh
+from LHM.models.rendering.utils.typing import *
+
+
+class RasterSettings(NamedTuple):
+    """same fields as diff_gaussian_rasterization.GaussianRasterizationSettings"""
+
+    image_height: int
+    image_width: int
+    tanfovx: float
+    tanfovy: float
+    bg: Tensor
+    scale_modifier: float
+    viewmatrix: Tensor  # w2c.T
+    projmatrix: Tensor  # (proj @ w2c).T
+    sh_degree: int
+    campos: Tensor
+
+
+class BaseRasterizer(ABC):
+    """Rasterize one view of gaussians.
+
+    Returns:
+        rendered_image [3, H, W], radii [N], rendered_depth [1, H, W], rendered_alpha [1, H, W]
+    """
+
+    @abstractmethod
+    def __call__(
+        self,
+        raster_settings: RasterSettings,
+        means3D,
+        opacities,
+        scales,
+        rotations,
+        shs=None,
+        colors_precomp=None,
+    ):
+        pass
+
+
+class CUDARasterizer(BaseRasterizer):
+    """diff_gaussian_rasterization backend."""
+
+    def __init__(self):
+        if not diff_gaussian_rasterization_enable:
+            raise ImportError(
+                "diff_gaussian_rasterization is not installed, please install it first."
+            )
+
+    def __call__(
+        self,
+        raster_settings: RasterSettings,
+        means3D,
+        opacities,
+        scales,
+        rotations,
+        shs=None,
+        colors_precomp=None,
+    ):
+        rasterizer = GaussianRasterizer(
+            raster_settings=GaussianRasterizationSettings(
+                **raster_settings._asdict(), prefiltered=False, debug=False
+            )
+        )
+
+        # We will use it to make pytorch return gradients of the 2D (screen-space) means
+        screenspace_points = torch.zeros_like(means3D, requires_grad=True) + 0
+        try:
+            screenspace_points.retain_grad()
+        except:
+            pass
+
+        return rasterizer(
+            means3D=means3D,
+            means2D=screenspace_points,
+            shs=shs,
+            colors_precomp=colors_precomp,
+            opacities=opacities,
+            scales=scales,
+            rotations=rotations,
+            cov3D_precomp=None,
+        )
+
+
+def build_covariance_3d(scales, rotations):
+    """Sigma = R S S^T R^T, rotations are (w, x, y, z) quaternions. [N, 3, 3]"""
+    q = torch.nn.functional.normalize(rotations, dim=-1)
+    r, x, y, z = q.unbind(-1)
+    R = torch.stack(
+        [
+            1 - 2 * (y * y + z * z),
+            2 * (x * y - r * z),
+            2 * (x * z + r * y),
+            2 * (x * y + r * z),
+            1 - 2 * (x * x + z * z),
+            2 * (y * z - r * x),
+            2 * (x * z - r * y),
+            2 * (y * z + r * x),
+            1 - 2 * (x * x + y * y),
+        ],
+        dim=-1,
+    ).view(-1, 3, 3)
+    M = R * scales.unsqueeze(1)
+    return M @ M.transpose(1, 2)
+
+
+class TorchTileRasterizer(BaseRasterizer):
+    """Tile-based rasterizer written in pure PyTorch, follows the forward pass of
+    diff_gaussian_rasterization: projection, 3D covariance -> 2D conic, tile binning,
+    per-tile depth sort and front-to-back alpha compositing. Runs on any device.
+
+    tile_size: tile edge in pixels.
+    max_chunk_elements: upper bound of the [tiles, gaussians, pixels] block evaluated at once.
+    """
+
+    def __init__(self, tile_size=16, max_chunk_elements=2**24):
+        self.tile_size = tile_size
+        self.max_chunk_elements = max_chunk_elements
+
+    def preprocess(self, raster_settings: RasterSettings, means3D, scales, rotations):
+        H, W = raster_settings.image_height, raster_settings.image_width
+        N = means3D.shape[0]
+
+        means_hom = torch.cat([means3D, torch.ones_like(means3D[:, :1])], dim=-1)
+        p_view = means_hom @ raster_settings.viewmatrix
+        p_hom = means_hom @ raster_settings.projmatrix
+        p_proj = p_hom[:, :3] / (p_hom[:, 3:] + 1e-7)
+        depths = p_view[:, 2]
+
+        # EWA splatting, see computeCov2D in diff_gaussian_rasterization
+        cov3D = build_covariance_3d(
+            scales * raster_settings.scale_modifier, rotations
+        )
+        focal_x = W / (2.0 * raster_settings.tanfovx)
+        focal_y = H / (2.0 * raster_settings.tanfovy)
+        limx = 1.3 * raster_settings.tanfovx
+        limy = 1.3 * raster_settings.tanfovy
+        tz = depths
+        tx = (p_view[:, 0] / tz).clamp(-limx, limx) * tz
+        ty = (p_view[:, 1] / tz).clamp(-limy, limy) * tz
+
+        J = torch.zeros((N, 2, 3), dtype=means3D.dtype, device=means3D.device)
+        J[:, 0, 0] = focal_x / tz
+        J[:, 0, 2] = -(focal_x * tx) / (tz * tz)
+        J[:, 1, 1] = focal_y / tz
+        J[:, 1, 2] = -(focal_y * ty) / (tz * tz)
+        T = J @ raster_settings.viewmatrix[:3, :3].T.unsqueeze(0)
+        cov2D = T @ cov3D @ T.transpose(1, 2)
+        a = cov2D[:, 0, 0] + 0.3
+        b = cov2D[:, 0, 1]
+        c = cov2D[:, 1, 1] + 0.3
+
+        det = a * c - b * b
+        det_inv = 1.0 / det.clamp_min(1e-12)
+        conic = torch.stack([c * det_inv, -b * det_inv, a * det_inv], dim=-1)
+
+        mid = 0.5 * (a + c)
+        lambda1 = mid + torch.sqrt((mid * mid - det).clamp_min(0.1))
+        radii = torch.ceil(3.0 * torch.sqrt(lambda1))
+
+        # ndc2Pix
+        means2D = torch.stack(
+            [
+                ((p_proj[:, 0] + 1.0) * W - 1.0) * 0.5,
+                ((p_proj[:, 1] + 1.0) * H - 1.0) * 0.5,
+            ],
+            dim=-1,
+        )
+
+        visible = (depths > 0.2) & (det > 0)
+        radii = torch.where(visible, radii, torch.zeros_like(radii))
+        return means2D, depths, conic, radii
+
+    def bin_tiles(self, means2D, depths, radii, H, W):
+        """duplicate each gaussian for every tile it touches, then sort by (tile, depth).
+
+        Returns:
+            gaussian ids [M] sorted by (tile, depth), tile ids [M], ranges [num_tiles + 1]
+        """
+        tile = self.tile_size
+        grid_x = (W + tile - 1) // tile
+        grid_y = (H + tile - 1) // tile
+
+        rect_min_x = ((means2D[:, 0] - radii) / tile).floor().clamp(0, grid_x).long()
+        rect_max_x = ((means2D[:, 0] + radii + tile - 1) / tile).floor().clamp(0, grid_x).long()
+        rect_min_y = ((means2D[:, 1] - radii) / tile).floor().clamp(0, grid_y).long()
+        rect_max_y = ((means2D[:, 1] + radii + tile - 1) / tile).floor().clamp(0, grid_y).long()
+
+        rect_w = rect_max_x - rect_min_x
+        tiles_touched = rect_w * (rect_max_y - rect_min_y)
+        tiles_touched = torch.where(radii > 0, tiles_touched, torch.zeros_like(tiles_touched))
+
+        # front-to-back order inside each tile: sort by depth first, then stably by tile
+        depth_order = torch.argsort(depths)
+        tiles_touched = tiles_touched[depth_order]
+        gaussian_ids = torch.repeat_interleave(depth_order, tiles_touched)
+        offsets = torch.cumsum(tiles_touched, dim=0) - tiles_touched
+        local = torch.arange(gaussian_ids.shape[0], device=depths.device)
+        local = local - torch.repeat_interleave(offsets, tiles_touched)
+
+        local_w = rect_w[gaussian_ids]
+        tile_x = rect_min_x[gaussian_ids] + local % local_w.clamp_min(1)
+        tile_y = rect_min_y[gaussian_ids] + local // local_w.clamp_min(1)
+        tile_ids = tile_y * grid_x + tile_x
+
+        tile_ids, order = torch.sort(tile_ids, stable=True)
+        gaussian_ids = gaussian_ids[order]
+
+        ranges = torch.searchsorted(
+            tile_ids,
+            torch.arange(grid_x * grid_y + 1, device=depths.device),
+        )
+        return gaussian_ids, tile_ids, ranges
+
+    def composite(
+        self, means2D, depths, conic, opacities, colors, bg, gaussian_ids, ranges, H, W
+    ):
+        tile = self.tile_size
+        grid_x = (W + tile - 1) // tile
+        num_tiles = ranges.shape[0] - 1
+        device = means2D.device
+        dtype = means2D.dtype
+
+        out_color = torch.zeros((num_tiles, tile * tile, 3), dtype=dtype, device=device)
+        out_depth = torch.zeros((num_tiles, tile * tile), dtype=dtype, device=device)
+        out_alpha = torch.zeros((num_tiles, tile * tile), dtype=dtype, device=device)
+
+        counts = ranges[1:] - ranges[:-1]
+        active_tiles = torch.nonzero(counts > 0).squeeze(-1)
+        # similar gaussian counts share one padded block
+        active_tiles = active_tiles[torch.argsort(counts[active_tiles])]
+
+        py, px = torch.meshgrid(
+            torch.arange(tile, device=device),
+            torch.arange(tile, device=device),
+            indexing="ij",
+        )
+        pix_local = torch.stack([px.reshape(-1), py.reshape(-1)], dim=-1).to(dtype)
+
+        counts_cpu = counts[active_tiles].tolist()
+        active_tiles_cpu = active_tiles.tolist()
+        ranges_cpu = ranges.tolist()
+
+        start = 0
+        while start < len(active_tiles_cpu):
+            # grow the chunk until the padded block hits the element budget
+            end = start + 1
+            while (
+                end < len(active_tiles_cpu)
+                and (end + 1 - start) * counts_cpu[end] * tile * tile
+                <= self.max_chunk_elements
+            ):
+                end += 1
+            chunk_tiles = active_tiles[start:end]
+            max_count = counts_cpu[end - 1]
+
+            # [T, G] gaussian index per tile, padded with -1
+            slot = torch.arange(max_count, device=device)
+            tile_start = torch.tensor(
+                [ranges_cpu[t] for t in active_tiles_cpu[start:end]], device=device
+            )
+            valid = slot.unsqueeze(0) < counts[chunk_tiles].unsqueeze(1)
+            index = (tile_start.unsqueeze(1) + slot.unsqueeze(0)).clamp_max(
+                gaussian_ids.shape[0] - 1
+            )
+            gids = gaussian_ids[index]
+
+            # pixel coordinates of each tile, [T, P, 2]
+            origin = torch.stack(
+                [(chunk_tiles % grid_x) * tile, (chunk_tiles // grid_x) * tile], dim=-1
+            ).to(dtype)
+            pix = origin.unsqueeze(1) + pix_local.unsqueeze(0)
+
+            d = means2D[gids].unsqueeze(2) - pix.unsqueeze(1)  # [T, G, P, 2]
+            con = conic[gids].unsqueeze(2)
+            power = (
+                -0.5 * (con[..., 0] * d[..., 0] ** 2 + con[..., 2] * d[..., 1] ** 2)
+                - con[..., 1] * d[..., 0] * d[..., 1]
+            )
+            alpha = (opacities[gids].unsqueeze(2) * torch.exp(power)).clamp_max(0.99)
+            alpha = torch.where(
+                (power <= 0) & (alpha >= 1.0 / 255.0) & valid.unsqueeze(-1),
+                alpha,
+                torch.zeros_like(alpha),
+            )
+
+            # front-to-back, stop once transmittance drops below 1e-4
+            one_minus_alpha = 1.0 - alpha
+            T_inclusive = torch.cumprod(one_minus_alpha, dim=1)
+            T_exclusive = torch.cat(
+                [torch.ones_like(T_inclusive[:, :1]), T_inclusive[:, :-1]], dim=1
+            )
+            weights = alpha * T_exclusive * (T_inclusive >= 1e-4)  # [T, G, P]
+
+            out_color[chunk_tiles] = torch.einsum("tgp,tgc->tpc", weights, colors[gids])
+            out_depth[chunk_tiles] = torch.einsum("tgp,tg->tp", weights, depths[gids])
+            out_alpha[chunk_tiles] = weights.sum(dim=1)
+
+            start = end
+
+        out_color = out_color + (1.0 - out_alpha).unsqueeze(-1) * bg.view(1, 1, 3)
+
+        def untile(x):
+            grid_y = num_tiles // grid_x
+            C = x.shape[-1]
+            x = x.view(grid_y, grid_x, tile, tile, C).permute(4, 0, 2, 1, 3)
+            return x.reshape(C, grid_y * tile, grid_x * tile)[:, :H, :W]
+
+        return (
+            untile(out_color),
+            untile(out_depth.unsqueeze(-1)),
+            untile(out_alpha.unsqueeze(-1)),
+        )
+
+    def __call__(
+        self,
+        raster_settings: RasterSettings,
+        means3D,
+        opacities,
+        scales,
+        rotations,
+        shs=None,
+        colors_precomp=None,
+    ):
+        H = int(raster_settings.image_height)
+        W = int(raster_settings.image_width)
+
+        means2D, depths, conic, radii = self.preprocess(
+            raster_settings, means3D, scales, rotations
+        )
+
+        if colors_precomp is None:
+            # shs: [N, (deg + 1) ** 2, 3]
+            dirs = means3D - raster_settings.campos.unsqueeze(0)
+            dirs = dirs / dirs.norm(dim=1, keepdim=True)
+            colors = eval_sh(raster_settings.sh_degree, shs.transpose(1, 2), dirs)
+            colors = (colors + 0.5).clamp_min(0.0)
+        else:
+            colors = colors_precomp
+
+        gaussian_ids, _, ranges = self.bin_tiles(means2D, depths, radii, H, W)
+        rendered_image, rendered_depth, rendered_alpha = self.composite(
+            means2D,
+            depths,
+            conic,
+            opacities.view(-1),
+            colors,
+            raster_settings.bg.to(means3D),
+            gaussian_ids,
+            ranges,
+            H,
+            W,
+        )
+        return rendered_image, radii.int(), rendered_depth, rendered_alpha
+
+
+class AutoRasterizer(BaseRasterizer):
+    """CUDA rasterizer for gaussians living on a GPU when it is installed, otherwise the torch one."""
+
+    def __init__(self, **kwargs):
+        self.cuda_rasterizer = (
+            CUDARasterizer() if diff_gaussian_rasterization_enable else None
+        )
+        self.torch_rasterizer = TorchTileRasterizer(**kwargs)
+
+    def __call__(self, raster_settings: RasterSettings, means3D, *args, **kwargs):
+        if means3D.is_cuda and self.cuda_rasterizer is not None:
+            return self.cuda_rasterizer(raster_settings, means3D, *args, **kwargs)
+        return self.torch_rasterizer(raster_settings, means3D, *args, **kwargs)
+
+
+RASTERIZER_BACKENDS = {
+    "auto": AutoRasterizer,
+    "cuda": CUDARasterizer,
+    "torch": TorchTileRasterizer,
+}
+
+
+def build_rasterizer(backend="auto", **kwargs):
+    """backend: "auto", "cuda" (diff_gaussian_rasterization) or "torch" (pure PyTorch, CPU capable).
+    kwargs are forwarded to TorchTileRasterizer.
+    """
+    if backend == "cuda":
+        return CUDARasterizer()
+    if backend not in RASTERIZER_BACKENDS:
+        raise NotImplementedError(f"unknown rasterizer backend: {backend}")
+    return RASTERIZER_BACKENDS[backend](**kwargs)
+
+
+def benchmark(num_points=40000, height=1024, width=640, repeat=5):
+    """compare the torch rasterizer with the CUDA one on random gaussians.
+    python -m LHM.models.rendering.rasterizer
+    """
+    import time
+
+    from LHM.models.rendering.gs_renderer import Camera
+
+    torch.manual_seed(0)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    means3D = (torch.rand(num_points, 3, device=device) - 0.5) * torch.tensor(
+        [0.6, 1.6, 0.3], device=device
+    )
+    scales = torch.rand(num_points, 3, device=device) * 0.01 + 0.002
+    rotations = torch.nn.functional.normalize(
+        torch.randn(num_points, 4, device=device), dim=-1
+    )
+    opacities = torch.rand(num_points, 1, device=device)
+    colors = torch.rand(num_points, 3, device=device)
+
+    c2w = torch.eye(4, device=device)
+    c2w[1, 1] = c2w[2, 2] = -1  # opencv camera looking at the origin
+    c2w[2, 3] = 2.5
+    focal = 1.2 * height
+    intrinsic = torch.eye(4, device=device)
+    intrinsic[0, 0] = intrinsic[1, 1] = focal
+    intrinsic[0, 2], intrinsic[1, 2] = width / 2, height / 2
+    camera = Camera.from_c2w(c2w, intrinsic, height, width)
+
+    raster_settings = RasterSettings(
+        image_height=height,
+        image_width=width,
+        tanfovx=math.tan(camera.FoVx * 0.5),
+        tanfovy=math.tan(camera.FoVy * 0.5),
+        bg=torch.ones(3, device=device),
+        scale_modifier=1.0,
+        viewmatrix=camera.world_view_transform,
+        projmatrix=camera.full_proj_transform.float(),
+        sh_degree=0,
+        campos=camera.camera_center,
+    )
+
+    backends = {"torch": TorchTileRasterizer()}
+    if diff_gaussian_rasterization_enable and device == "cuda":
+        backends["cuda"] = CUDARasterizer()
+
+    outputs = dict()
+    for name, rasterizer in backends.items():
+        with torch.no_grad():
+            for i in range(repeat + 1):
+                if i == 1:  # skip warmup
+                    if device == "cuda":
+                        torch.cuda.synchronize()
+                    start = time.time()
+                outputs[name] = rasterizer(
+                    raster_settings,
+                    means3D=means3D,
+                    opacities=opacities,
+                    scales=scales,
+                    rotations=rotations,
+                    colors_precomp=colors,
+                )
+            if device == "cuda":
+                torch.cuda.synchronize()
+        print(f"{name}: {(time.time() - start) / repeat * 1000:.1f} ms / view")
+
+    if "cuda" in outputs:
+        for i, k in [(0, "comp_rgb"), (3, "comp_mask")]:
+            diff = (outputs["torch"][i] - outputs["cuda"][i]).abs()
+            print(f"{k}: max abs diff {diff.max().item():.4f}, mean {diff.mean().item():.6f}")
+
+
+if __name__ == "__main__":
+    benchmark()
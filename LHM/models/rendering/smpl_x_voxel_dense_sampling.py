@@ -6,6 +6,8 @@
 # @Description   : 1.canonical query, 2.offset, 3.blendshape -> 4.posed-view
 
 import copy
+import hashlib
+import json
 import math
 import os
 import os.path as osp
@@ -31,6 +33,11 @@ from LHM.models.rendering.mesh_utils import Mesh
 from LHM.models.rendering.smplx import smplx
 from LHM.models.rendering.smplx.smplx.lbs import blend_shapes
 from LHM.models.rendering.smplx.vis_utils import render_mesh
+from LHM.models.rendering.utils.skinning_field import (
+    SKINNING_FIELD_VERSION,
+    build_skinning_field,
+    load_or_build_skinning_field,
+)
 
 """
 Subdivide a triangle mesh by adding a new vertex at the center of each edge and dividing each face into four new faces.
@@ -42,6 +49,25 @@ This one-time computation can be reused for all meshes with the same face topolo
 """
 
 
+SMPLX_BUNDLE_VERSION = 2
+SMPLX_BUNDLE_DIR = "./pretrained_models/smplx_bundle"
+SMPLX_VOXEL_SIZE = 192
+
+
+def file_fingerprint(path):
+    """size and modification time of a file, a stat instead of a read."""
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()[:16]
+
+
 def avaliable_device():
 
     import torch
@@ -55,7 +81,35 @@ def avaliable_device():
     return device
 
 
+class _LazyLayerDict(dict):
+    """gender -> smplx layer, a layer is only unpickled when its gender is first used."""
+
+    def __init__(self, create_layer, layers=None):
+        super().__init__(layers or {})
+        self.create_layer = create_layer
+
+    def __missing__(self, gender):
+        layer = self.create_layer(gender)
+        self[gender] = layer
+        return layer
+
+
 class SMPLX_Mesh(object):
+    # derived arrays kept in the model bundle, see SMPLXVoxelMeshModel.save_bundle
+    bundle_keys = (
+        "face_vertex_idx",
+        "face_orig",
+        "is_cavity",
+        "face",
+        "rhand_vertex_idx",
+        "lhand_vertex_idx",
+        "expr_vertex_idx",
+        "lower_body_vertex_idx",
+        "upper_body_vertex_idx",
+        "body_head_mapping",
+        "constrain_body_vertex_idx",
+    )
+
     def __init__(
         self,
         human_model_path,
@@ -63,87 +117,51 @@ class SMPLX_Mesh(object):
         expr_param_dim=50,
         subdivide_num=2,
         cano_pose_type=0,
+        layers=None,
+        bundle_state=None,
     ):
-        """SMPLX using dense sampling"""
+        """SMPLX using dense sampling
+        layers: optional dict gender -> prebuilt smplx layer, other genders are loaded on first use.
+        bundle_state: optional derived arrays (see bundle_keys) restored instead of recomputed.
+        """
         super().__init__()
         self.human_model_path = human_model_path
         self.shape_param_dim = shape_param_dim
         self.expr_param_dim = expr_param_dim
-        if shape_param_dim == 10 and expr_param_dim == 10:
-            self.layer_arg = {
-                "create_global_orient": False,
-                "create_body_pose": False,
-                "create_left_hand_pose": False,
-                "create_right_hand_pose": False,
-                "create_jaw_pose": False,
-                "create_leye_pose": False,
-                "create_reye_pose": False,
-                "create_betas": False,
-                "create_expression": False,
-                "create_transl": False,
-            }
-            self.layer = {
-                gender: smplx.create(
-                    human_model_path,
-                    "smplx",
-                    gender=gender,
-                    num_betas=self.shape_param_dim,
-                    num_expression_coeffs=self.expr_param_dim,
-                    use_pca=False,
-                    use_face_contour=False,
-                    flat_hand_mean=True,
-                    **self.layer_arg,
-                )
-                for gender in ["neutral", "male", "female"]
-            }
-        else:
-            self.layer_arg = {
-                "create_global_orient": False,
-                "create_body_pose": False,
-                "create_left_hand_pose": False,
-                "create_right_hand_pose": False,
-                "create_jaw_pose": False,
-                "create_leye_pose": False,
-                "create_reye_pose": False,
-                "create_betas": False,
-                "create_expression": False,
-                "create_transl": False,
-            }
-            self.layer = {
-                gender: smplx.create(
-                    human_model_path,
-                    "smplx",
-                    gender=gender,
-                    num_betas=self.shape_param_dim,
-                    num_expression_coeffs=self.expr_param_dim,
-                    use_pca=False,
-                    use_face_contour=True,
-                    flat_hand_mean=True,
-                    **self.layer_arg,
-                )
-                for gender in ["neutral", "male", "female"]
-            }
-
-        self.face_vertex_idx = np.load(
-            osp.join(human_model_path, "smplx", "SMPL-X__FLAME_vertex_ids.npy")
-        )
-        if shape_param_dim == 10 and expr_param_dim == 10:
+        self.layer_arg = {
+            "create_global_orient": False,
+            "create_body_pose": False,
+            "create_left_hand_pose": False,
+            "create_right_hand_pose": False,
+            "create_jaw_pose": False,
+            "create_leye_pose": False,
+            "create_reye_pose": False,
+            "create_betas": False,
+            "create_expression": False,
+            "create_transl": False,
+        }
+        self.use_flame_expr = not (shape_param_dim == 10 and expr_param_dim == 10)
+        if not self.use_flame_expr:
             print("not using flame expr")
-        else:
-            self.layer = {
-                gender: self.get_expr_from_flame(self.layer[gender])
-                for gender in ["neutral", "male", "female"]
-            }
+        self.layer = _LazyLayerDict(self.create_layer, layers)
+
         self.vertex_num = 10475
-        self.face_orig = self.layer["neutral"].faces.astype(np.int64)
-        self.is_cavity, self.face = self.add_cavity()
-        with open(
-            osp.join(human_model_path, "smplx", "MANO_SMPLX_vertex_ids.pkl"), "rb"
-        ) as f:
-            hand_vertex_idx = pickle.load(f, encoding="latin1")
-        self.rhand_vertex_idx = hand_vertex_idx["right_hand"]
-        self.lhand_vertex_idx = hand_vertex_idx["left_hand"]
-        self.expr_vertex_idx = self.get_expr_vertex_idx()
+        if bundle_state is not None:
+            for key in self.bundle_keys:
+                setattr(self, key, bundle_state[key])
+        else:
+            self.face_vertex_idx = np.load(
+                osp.join(human_model_path, "smplx", "SMPL-X__FLAME_vertex_ids.npy")
+            )
+            self.face_orig = self.layer["neutral"].faces.astype(np.int64)
+            self.is_cavity, self.face = self.add_cavity()
+            with open(
+                osp.join(human_model_path, "smplx", "MANO_SMPLX_vertex_ids.pkl"), "rb"
+            ) as f:
+                hand_vertex_idx = pickle.load(f, encoding="latin1")
+            self.rhand_vertex_idx = hand_vertex_idx["right_hand"]
+            self.lhand_vertex_idx = hand_vertex_idx["left_hand"]
+            self.expr_vertex_idx = self.get_expr_vertex_idx()
 
         # SMPLX joint set
         self.joint_num = (
@@ -238,9 +256,9 @@ class SMPLX_Mesh(object):
 
         self.joint_part['upper_body']= self.upper_body_label()
 
-
-        self.lower_body_vertex_idx = self.get_body("lower_body")
-        self.upper_body_vertex_idx = self.get_body("upper_body")
+        if bundle_state is None:
+            self.lower_body_vertex_idx = self.get_body("lower_body")
+            self.upper_body_vertex_idx = self.get_body("upper_body")
 
         self.neutral_body_pose = torch.zeros(
             (len(self.joint_part["body"]) - 1, 3)
@@ -254,11 +272,31 @@ class SMPLX_Mesh(object):
 
         self.neutral_jaw_pose = torch.FloatTensor([1 / 3, 0, 0])
 
-        # subdivider
-        self.body_head_mapping = self.get_body_face_mapping()
+        if bundle_state is None:
+            # subdivider
+            self.body_head_mapping = self.get_body_face_mapping()
+
+            self.register_constrain_prior()
+
+    def create_layer(self, gender):
+        layer = smplx.create(
+            self.human_model_path,
+            "smplx",
+            gender=gender,
+            num_betas=self.shape_param_dim,
+            num_expression_coeffs=self.expr_param_dim,
+            use_pca=False,
+            use_face_contour=self.use_flame_expr,
+            flat_hand_mean=True,
+            **self.layer_arg,
+        )
+        if self.use_flame_expr:
+            layer = self.get_expr_from_flame(layer)
+        return layer
+
+    def bundle_state(self):
+        return {key: getattr(self, key) for key in self.bundle_keys}
 
-        self.register_constrain_prior()
-    
     def upper_body_label(self):
 
         upper_body_name = [
@@ -363,8 +401,8 @@ class SMPLX_Mesh(object):
         return joint_offset
 
     def get_subdivider(self, subdivide_num):
-        vert = self.layer["neutral"].v_template.float().cuda()
-        face = torch.LongTensor(self.face).cuda()
+        vert = self.layer["neutral"].v_template.float().to(avaliable_device())
+        face = torch.LongTensor(self.face).to(avaliable_device())
         mesh = Meshes(vert[None, :, :], face[None, :, :])
 
         if subdivide_num > 0:
@@ -464,7 +502,7 @@ class SMPLX_Mesh(object):
         normal = (
             Meshes(
                 verts=mesh_neutral_pose[None, :, :],
-                faces=torch.LongTensor(self.face_upsampled).cuda()[None, :, :],
+                faces=torch.LongTensor(self.face_upsampled).to(mesh_neutral_pose.device)[None, :, :],
             )
             .verts_normals_packed()
             .reshape(self.vertex_num_upsampled, 3)
@@ -492,9 +530,51 @@ class SMPLXVoxelMeshModel(nn.Module):
         body_face_ratio=3,
         dense_sample_points=40000,
         apply_pose_blendshape=False,
+        bundle_dir=SMPLX_BUNDLE_DIR,
     ) -> None:
+        """
+        bundle_dir: directory of the precompiled bundles (see save_bundle). When a bundle matching
+            the arguments and the SMPL-X / FLAME files (see bundle_meta) exists, the
+            layer, the derived buffers and the voxel field are loaded from it instead of being rebuilt
+            from those files. None always rebuilds.
+        """
         super().__init__()
 
+        # register
+        self.apply_pose_blendshape = apply_pose_blendshape
+        self.cano_pose_type = cano_pose_type
+        self.bundle_args = dict(
+            version=SMPLX_BUNDLE_VERSION,
+            human_model_path=human_model_path,
+            gender=gender,
+            subdivide_num=subdivide_num,
+            expr_param_dim=expr_param_dim,
+            shape_param_dim=shape_param_dim,
+            cano_pose_type=cano_pose_type,
+            body_face_ratio=body_face_ratio,
+            dense_sample_points=dense_sample_points,
+        )
+
+        bundle = self.load_bundle(bundle_dir) if bundle_dir is not None else None
+        if bundle is not None:
+            self.smpl_x = SMPLX_Mesh(
+                human_model_path=human_model_path,
+                shape_param_dim=shape_param_dim,
+                expr_param_dim=expr_param_dim,
+                subdivide_num=subdivide_num,
+                cano_pose_type=cano_pose_type,
+                layers={gender: bundle["layer"]},
+                bundle_state=bundle["smpl_x"],
+            )
+            self.smplx_layer = bundle["layer"]
+            self.dense_pts = bundle["dense_pts"]
+            self.is_body = bundle["is_body"]
+            for name, buffer in bundle["buffers"].items():
+                self.register_buffer(name, buffer)
+            self.vertex_num_upsampled = self.dense_pts.shape[0]
+            self.smpl_x.vertex_num_upsampled = self.vertex_num_upsampled
+            return
+
         self.smpl_x = SMPLX_Mesh(
             human_model_path=human_model_path,
             shape_param_dim=shape_param_dim,
@@ -504,12 +584,98 @@ class SMPLXVoxelMeshModel(nn.Module):
         )
         self.smplx_layer = copy.deepcopy(self.smpl_x.layer[gender])
 
-        # register
-        self.apply_pose_blendshape = apply_pose_blendshape
-        self.cano_pose_type = cano_pose_type
         self.dense_sample(body_face_ratio, dense_sample_points)
         self.smplx_init()
 
+    def dense_sample_path(self, dense_sample_points):
+        return f"./pretrained_models/dense_sample_points/{self.cano_pose_type}_{dense_sample_points}.ply"
+
+    def bundle_inputs(self):
+        """name -> path of every file the model is built from."""
+        human_model_path = self.bundle_args["human_model_path"]
+        inputs = dict()
+        for subdir in ("smplx", "flame"):
+            for root, _, files in os.walk(osp.join(human_model_path, subdir)):
+                for name in files:
+                    path = osp.join(root, name)
+                    inputs[osp.relpath(path, human_model_path)] = path
+
+        dense_sample_path = self.dense_sample_path(self.bundle_args["dense_sample_points"])
+        if os.path.exists(dense_sample_path):
+            inputs["dense_sample_points"] = dense_sample_path
+        return inputs
+
+    @property
+    def bundle_meta(self):
+        """the constructor arguments, the size and mtime of every file the model is built from, and
+        the key of the voxel skinning field: a bundle only loads while none of them changed.
+        Only stats, so that a cold start does not read the model files of every gender. The content
+        hashes of the inputs are kept in the bundle, see save_bundle."""
+        inputs = {
+            name: file_fingerprint(path) for name, path in self.bundle_inputs().items()
+        }
+
+        # the released grid, or the field built from the template by the versioned builder
+        voxel_path = f"./pretrained_models/voxel_grid/voxel_{SMPLX_VOXEL_SIZE}.pth"
+        if os.path.exists(voxel_path):
+            skinning_field = file_fingerprint(voxel_path)
+        else:
+            skinning_field = f"build_v{SKINNING_FIELD_VERSION}"
+
+        return dict(self.bundle_args, inputs=inputs, skinning_field=skinning_field)
+
+    def bundle_path(self, bundle_dir, bundle_meta=None):
+        if bundle_meta is None:
+            bundle_meta = self.bundle_meta
+        key = hashlib.sha256(
+            json.dumps(bundle_meta, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        return osp.join(bundle_dir, f"smplx_{self.bundle_args['gender']}_{key}.pt")
+
+    def load_bundle(self, bundle_dir):
+        bundle_meta = self.bundle_meta
+        bundle_path = self.bundle_path(bundle_dir, bundle_meta)
+        if not os.path.exists(bundle_path):
+            return None
+
+        print(f"load smplx bundle {bundle_path}")
+        # tensors stay memory-mapped until the model is moved to its device
+        bundle = torch.load(
+            bundle_path, map_location="cpu", mmap=True, weights_only=False
+        )
+        assert (
+            bundle["meta"] == bundle_meta
+        ), f"smplx bundle {bundle_path} does not match the model arguments"
+        return bundle
+
+    def save_bundle(self, bundle_dir=SMPLX_BUNDLE_DIR):
+        """serialize the selected gender's layer, the derived SMPL-X arrays, the dense points and all
+        the registered buffers (skinning, blendshape dirs, part masks, voxel field) into one file,
+        with the sha256 of the files it was built from."""
+        # taken now, the dense sample points may have been written by this build
+        bundle_meta = self.bundle_meta
+        bundle_path = self.bundle_path(bundle_dir, bundle_meta)
+        bundle = dict(
+            meta=bundle_meta,
+            input_digests={
+                name: file_digest(path) for name, path in self.bundle_inputs().items()
+            },
+            smpl_x=self.smpl_x.bundle_state(),
+            layer=copy.deepcopy(self.smplx_layer).cpu(),
+            dense_pts=self.dense_pts.detach().cpu(),
+            is_body=self.is_body.detach().cpu(),
+            buffers={
+                name: buffer.detach().cpu().contiguous()
+                for name, buffer in self.named_buffers(recurse=False)
+            },
+        )
+
+        os.makedirs(bundle_dir, exist_ok=True)
+        tmp_path = f"{bundle_path}.{os.getpid()}.tmp"
+        torch.save(bundle, tmp_path)
+        os.replace(tmp_path, bundle_path)
+        return bundle_path
+
     def rebuild_mesh(self, v, vertices_id, faces_id, num_dense_samples):
         choice_vertices = v[vertices_id]
 
@@ -533,7 +699,7 @@ class SMPLXVoxelMeshModel(nn.Module):
 
     def dense_sample(self, body_face_ratio, dense_sample_points):
 
-        buff_path = f"./pretrained_models/dense_sample_points/{self.cano_pose_type}_{dense_sample_points}.ply"
+        buff_path = self.dense_sample_path(dense_sample_points)
 
         if os.path.exists(buff_path):
             dense_sample_pts, _ = load_ply(buff_path)
@@ -582,79 +748,14 @@ class SMPLXVoxelMeshModel(nn.Module):
     ):
         """Smooth KNN to handle skirt deformation."""
 
-        lbs_weights = lbs_weights.cuda()
-
-        dist = knn_points(
-            voxel_v.unsqueeze(0).cuda(),
-            template_v.unsqueeze(0).cuda(),
-            K=1,
-            return_nn=True,
+        return build_skinning_field(
+            voxel_v,
+            template_v,
+            lbs_weights,
+            smooth_k=smooth_k,
+            smooth_n=smooth_n,
+            device=avaliable_device(),
         )
-        mesh_dis = torch.sqrt(dist.dists)
-        mesh_indices = dist.idx.squeeze(0, -1)
-        knn_lbs_weights = lbs_weights[mesh_indices]
-
-        mesh_dis = mesh_dis.squeeze()
-
-        print(f"Using k = {smooth_k}, N={smooth_n} for LBS smoothing")
-        # Smooth Skinning
-
-        knn_dis = knn_points(
-            voxel_v.unsqueeze(0).cuda(),
-            voxel_v.unsqueeze(0).cuda(),
-            K=smooth_k + 1,
-            return_nn=True,
-        )
-        voxel_dis = torch.sqrt(knn_dis.dists)
-        voxel_indices = knn_dis.idx
-        voxel_indices = voxel_indices.squeeze()[:, 1:]
-        voxel_dis = voxel_dis.squeeze()[:, 1:]
-
-        knn_weights = 1.0 / (mesh_dis[voxel_indices] * voxel_dis)
-        knn_weights = knn_weights / knn_weights.sum(-1, keepdim=True)  # [N, K]
-
-        def dists_to_weights(
-            dists: torch.Tensor, low: float = None, high: float = None
-        ):
-            if low is None:
-                low = high
-            if high is None:
-                high = low
-            assert high >= low
-            weights = dists.clone()
-            weights[dists <= low] = 0.0
-            weights[dists >= high] = 1.0
-            indices = (dists > low) & (dists < high)
-            weights[indices] = (dists[indices] - low) / (high - low)
-            return weights
-
-        update_weights = dists_to_weights(mesh_dis, low=0.01).unsqueeze(-1)  # [N, 1]
-
-        from tqdm import tqdm
-
-        for _ in tqdm(range(smooth_n)):
-            N, _ = update_weights.shape
-            new_lbs_weights_chunk_list = []
-            for chunk_i in range(0, N, 1000000):
-
-                knn_weights_chunk = knn_weights[chunk_i : chunk_i + 1000000]
-                voxel_indices_chunk = voxel_indices[chunk_i : chunk_i + 1000000]
-
-                new_lbs_weights_chunk = torch.einsum(
-                    "nk,nkj->nj",
-                    knn_weights_chunk,
-                    knn_lbs_weights[voxel_indices_chunk],
-                )
-                new_lbs_weights_chunk_list.append(new_lbs_weights_chunk)
-            new_lbs_weights = torch.cat(new_lbs_weights_chunk_list, dim=0)
-            if update_weights is None:
-                knn_lbs_weights = new_lbs_weights
-            else:
-                knn_lbs_weights = (
-                    1.0 - update_weights
-                ) * knn_lbs_weights + update_weights * new_lbs_weights
-
-        return knn_lbs_weights
 
     def voxel_skinning_init(self, scale_ratio=1.05, voxel_size=256):
 
@@ -712,8 +813,9 @@ class SMPLXVoxelMeshModel(nn.Module):
         )
 
         coordinates = coordinates.view(-1, 3).float()
-        coordinates = coordinates.cuda()
+        coordinates = coordinates.to(avaliable_device())
 
+        # released grid of the default template, otherwise built once per template / voxel layout
         if os.path.exists(f"./pretrained_models/voxel_grid/voxel_{voxel_size}.pth"):
             print(f"load voxel_grid voxel_{voxel_size}.pth")
             voxel_flat = torch.load(
@@ -721,13 +823,14 @@ class SMPLXVoxelMeshModel(nn.Module):
                 map_location=avaliable_device(),
             )
         else:
-            voxel_flat = self.voxel_smooth_register(
-                coordinates, template_verts, skinning_weight, k=1, smooth_n=3000
-            )
-
-            torch.save(
-                voxel_flat,
-                os.path.join(f"pretrained_models/voxel_grid/voxel_{voxel_size}.pth"),
+            voxel_flat = load_or_build_skinning_field(
+                coordinates,
+                template_verts,
+                skinning_weight,
+                cache_dir="./pretrained_models/voxel_grid",
+                prefix=f"voxel_{voxel_size}",
+                smooth_n=3000,
+                device=avaliable_device(),
             )
 
         N, LBS_F = voxel_flat.shape
@@ -767,12 +870,12 @@ class SMPLXVoxelMeshModel(nn.Module):
         smpl_x = self.smpl_x
 
         # using KNN to query subdivided mesh
-        dense_pts = self.dense_pts.cuda()
+        dense_pts = self.dense_pts.to(avaliable_device())
         template_verts = self.smplx_layer.v_template
 
         nn_vertex_idxs = knn_points(
-            dense_pts.unsqueeze(0).cuda(),
-            template_verts.unsqueeze(0).cuda(),
+            dense_pts.unsqueeze(0).to(avaliable_device()),
+            template_verts.unsqueeze(0).to(avaliable_device()),
             K=1,
             return_nn=True,
         ).idx
@@ -878,7 +981,9 @@ class SMPLXVoxelMeshModel(nn.Module):
         self.vertex_num_upsampled = vertex_num_upsampled
         self.smpl_x.vertex_num_upsampled = vertex_num_upsampled  # compatible with SMPLX
 
-        voxel_skinning_weight, voxel_bbox = self.voxel_skinning_init(voxel_size=192)
+        voxel_skinning_weight, voxel_bbox = self.voxel_skinning_init(
+            voxel_size=SMPLX_VOXEL_SIZE
+        )
         self.register_buffer("voxel_ws", voxel_skinning_weight)
         self.register_buffer("voxel_bbox", voxel_bbox)
 
@@ -1091,7 +1196,7 @@ class SMPLXVoxelMeshModel(nn.Module):
         )  # [B, 54, 3]
         # smplx pose-dependent vertex offset
         pose = (
-            axis_angle_to_matrix(pose) - torch.eye(3)[None, None, :, :].float().cuda()
+            axis_angle_to_matrix(pose) - torch.eye(3)[None, None, :, :].float().to(pose.device)
         ).view(batch_size, (self.smpl_x.joint_num - 1) * 9)
         # (B, 54 * 9) x (54*9, V)
 
@@ -1106,7 +1211,7 @@ class SMPLXVoxelMeshModel(nn.Module):
             (xyz, torch.ones_like(xyz[:, :, :1])), dim=-1
         )  # 大 pose. xyz1 [B, N, 4]
         xyz = torch.matmul(transform_mat_vertex, xyz[:, :, :, None]).view(
-            batch_size, self.vertex_num_upsampled, 4
+            batch_size, xyz.shape[1], 4
         )[
             :, :, :3
         ]  # [B, N, 3]
@@ -1226,6 +1331,118 @@ class SMPLXVoxelMeshModel(nn.Module):
 
         return posed_mean_3d, neutral_to_posed_vertex
 
+    @torch.no_grad()
+    def build_neutral_pose_cache(
+        self, mean_3d, smplx_data, transform_mat_neutral_pose, device, point_index=None
+    ):
+        """
+        Precompute the pose-independent stage of transform_to_posed_verts_from_neutral_pose for one avatar.
+
+            mean_3d (torch.Tensor): canonical gaussian centers with shape [1, N, 3] + offset.
+            smplx_data (dict): SMPL-X data containing betas with shape [1, 100] (face_offset, joint_offset optional).
+            transform_mat_neutral_pose (torch.Tensor): Transformation matrix of the neutral pose with shape [1, 55, 4, 4].
+            device (torch.device): Device to perform the computation.
+            point_index (torch.Tensor, optional): [N] dense sample point of each gaussian, for a compacted (LOD) avatar.
+
+        Returns:
+           NeutralPoseCacheOutput: tensors consumed by transform_to_posed_verts_from_neutral_pose_cache.
+        """
+        from LHM.outputs.output import NeutralPoseCacheOutput
+
+        assert mean_3d.shape[0] == 1, "neutral pose cache is built per avatar"
+        shape_param = smplx_data["betas"]
+
+        skinning_weight = self.skinning_weight
+        shape_dirs = self.shape_dirs
+        expr_dirs = self.expr_dirs
+        if point_index is not None:
+            skinning_weight = skinning_weight[point_index]
+            shape_dirs = shape_dirs[point_index]
+            expr_dirs = expr_dirs[point_index]
+        num_points = skinning_weight.shape[0]
+        assert mean_3d.shape[1] == num_points, f"{mean_3d.shape[1]} gaussians, {num_points} points"
+
+        # the skinning of hands and face is fixed, others share the same weights. see get_transform_mat_vertex
+        transform_mat_null_vertex = torch.matmul(
+            skinning_weight,
+            transform_mat_neutral_pose.view(1, self.smpl_x.joint_num, 16),
+        ).view(1, num_points, 4, 4)
+
+        null_mean_3d = self.lbs(mean_3d, transform_mat_null_vertex, None)
+        blend_shape_offset = blend_shapes(shape_param, shape_dirs)
+        null_mean_3d_blendshape = null_mean_3d + blend_shape_offset
+
+        # lbs is affine, so expression offsets only need the rotation part of the null transform
+        null_expr_dirs = torch.matmul(
+            transform_mat_null_vertex[0, :, :3, :3], expr_dirs
+        )  # [N, 3, 3] x [N, 3, E] -> [N, 3, E]
+
+        joint_null_pose = self.get_zero_pose_human(
+            shape_param=shape_param,
+            device=device,
+            face_offset=smplx_data.get("face_offset", None),
+            joint_offset=smplx_data.get("joint_offset", None),
+        )
+
+        return NeutralPoseCacheOutput(
+            transform_mat_null_vertex=transform_mat_null_vertex,
+            null_mean_3d_blendshape=null_mean_3d_blendshape,
+            null_expr_dirs=null_expr_dirs,
+            joint_null_pose=joint_null_pose,
+            point_index=point_index,
+            skinning_weight=skinning_weight if point_index is not None else None,
+        )
+
+    def transform_to_posed_verts_from_neutral_pose_cache(
+        self, neutral_pose_cache, smplx_data, device
+    ):
+        """
+        Same as transform_to_posed_verts_from_neutral_pose, but reuses the per-avatar precompute of
+        build_neutral_pose_cache, so that each frame only runs forward kinematics and the skinning matmul.
+
+            neutral_pose_cache (NeutralPoseCacheOutput): output of build_neutral_pose_cache.
+            smplx_data (dict): SMPL-X data containing body_pose with shape [Nv, 21, 3].
+            device (torch.device): Device to perform the computation.
+
+        Returns:
+           torch.Tensor: Posed vertices with shape [Nv, N, 3] + offset.
+        """
+
+        batch_size = smplx_data["root_pose"].shape[0]
+
+        null_mean3d_blendshape = neutral_pose_cache.null_mean_3d_blendshape
+        if "expr" in smplx_data:
+            null_expr_offset = torch.einsum(
+                "be,nje->bnj", smplx_data["expr"], neutral_pose_cache.null_expr_dirs
+            )  # [B, 50] x [N_v, 3, 50] -> [B, N_v, 3]
+            null_mean3d_blendshape = null_mean3d_blendshape + null_expr_offset
+        else:
+            null_mean3d_blendshape = null_mean3d_blendshape.repeat(batch_size, 1, 1)
+
+        joint_null_pose = neutral_pose_cache.joint_null_pose.repeat(batch_size, 1, 1)
+        transform_mat_joint, j3d = self.get_transform_mat_joint(
+            None, joint_null_pose, smplx_data
+        )
+
+        skinning_weight = neutral_pose_cache.skinning_weight
+        if skinning_weight is None:
+            skinning_weight = self.skinning_weight
+
+        transform_mat_vertex = torch.matmul(
+            skinning_weight,
+            transform_mat_joint.view(batch_size, self.smpl_x.joint_num, 16),
+        ).view(batch_size, skinning_weight.shape[0], 4, 4)
+
+        posed_mean_3d = self.lbs(
+            null_mean3d_blendshape, transform_mat_vertex, smplx_data["trans"]
+        )  # posed with smplx_param
+
+        neutral_to_posed_vertex = torch.matmul(
+            transform_mat_vertex, neutral_pose_cache.transform_mat_null_vertex
+        )  # [B, N, 4, 4]
+
+        return posed_mean_3d, neutral_to_posed_vertex
+
     def get_query_points(self, smplx_data, device):
         """transform_mat_neutral_pose is function to warp pre-defined posed to zero-pose"""
 
@@ -359,8 +359,92 @@ def transform_mat(R: Tensor, t: Tensor) -> Tensor:
     return torch.cat([F.pad(R, [0, 0, 0, 1]), F.pad(t, [0, 0, 0, 1], value=1)], dim=2)
 
 
+class KinematicTree(object):
+    """Depth levels of a kinematic tree.
+
+    Joints of the same depth only depend on the previous level, so forward kinematics
+    composes a whole level with one batched matmul: the 55 SMPL-X joints take one
+    launch per depth level instead of one per joint.
+    """
+
+    def __init__(self, parents: List[int]) -> None:
+        num_joints = len(parents)
+        depth = [0] * num_joints
+        for i in range(1, num_joints):
+            assert 0 <= parents[i] < i, "parents must be topologically sorted"
+            depth[i] = depth[parents[i]] + 1
+
+        # joint 0 is the root, parents[0] is ignored as in the sequential chain
+        levels = [[] for _ in range(max(depth) + 1)]
+        for i in range(num_joints):
+            levels[depth[i]].append(i)
+
+        # position of every joint inside its level, to gather parents from the previous level
+        position = [0] * num_joints
+        for level in levels:
+            for pos, i in enumerate(level):
+                position[i] = pos
+
+        self.num_joints = num_joints
+        self.levels = [torch.tensor(level, dtype=torch.long) for level in levels]
+        self.parent_positions = [
+            torch.tensor([position[parents[i]] for i in level], dtype=torch.long)
+            for level in levels[1:]
+        ]
+        # levels are concatenated in order, this puts the joints back in index order
+        self.inverse_order = torch.argsort(torch.cat(self.levels))
+        self._device_cache = {}
+
+    def _on(self, device: torch.device):
+        if device not in self._device_cache:
+            self._device_cache[device] = (
+                [level.to(device) for level in self.levels],
+                [pos.to(device) for pos in self.parent_positions],
+                self.inverse_order.to(device),
+            )
+        return self._device_cache[device]
+
+    def compose(self, transforms_mat: Tensor) -> Tensor:
+        """
+        Args:
+            transforms_mat: BxNx4x4 local transformations, relative to the parent joint
+        Returns:
+            BxNx4x4 global transformations
+        """
+        levels, parent_positions, inverse_order = self._on(transforms_mat.device)
+
+        chain = [transforms_mat[:, levels[0]]]
+        for level, parent_pos in zip(levels[1:], parent_positions):
+            chain.append(torch.matmul(chain[-1][:, parent_pos], transforms_mat[:, level]))
+
+        return torch.cat(chain, dim=1)[:, inverse_order]
+
+
+_KINEMATIC_TREES = {}
+_KINEMATIC_TREES_MAX_SIZE = 32
+
+
+def get_kinematic_tree(parents: Tensor) -> KinematicTree:
+    """KinematicTree of parents, built once per parents tensor (usually a model buffer).
+    Lookups are keyed by the storage of parents to avoid a device sync on every call,
+    the cache holds parents so that its storage is not reused while the entry lives.
+    """
+    key = (parents.data_ptr(), parents.device, parents.shape[0], parents._version)
+    entry = _KINEMATIC_TREES.get(key)
+    if entry is None:
+        if len(_KINEMATIC_TREES) >= _KINEMATIC_TREES_MAX_SIZE:
+            _KINEMATIC_TREES.pop(next(iter(_KINEMATIC_TREES)))
+        entry = (parents, KinematicTree(parents.tolist()))
+        _KINEMATIC_TREES[key] = entry
+    return entry[1]
+
+
 def batch_rigid_transform(
-    rot_mats: Tensor, joints: Tensor, parents: Tensor, dtype=torch.float32
+    rot_mats: Tensor,
+    joints: Tensor,
+    parents: Tensor,
+    dtype=torch.float32,
+    accumulate_dtype=None,
 ) -> Tensor:
     """
     Applies a batch of rigid transformations to the joints
@@ -375,6 +459,10 @@ def batch_rigid_transform(
         The kinematic tree of each object
     dtype : torch.dtype, optional:
         The data type of the created tensors, the default is torch.float32
+    accumulate_dtype : torch.dtype, optional:
+        Compose the kinematic chain in this data type, e.g. torch.float64 to avoid
+        the error accumulated along long chains such as the fingers. The outputs keep
+        the data type of rot_mats.
 
     Returns
     -------
@@ -385,6 +473,11 @@ def batch_rigid_transform(
         for all the joints
     """
 
+    out_dtype = rot_mats.dtype
+    if accumulate_dtype is not None:
+        rot_mats = rot_mats.to(accumulate_dtype)
+        joints = joints.to(accumulate_dtype)
+
     joints = torch.unsqueeze(joints, dim=-1)
 
     rel_joints = joints.clone()
@@ -394,14 +487,9 @@ def batch_rigid_transform(
         rot_mats.reshape(-1, 3, 3), rel_joints.reshape(-1, 3, 1)
     ).reshape(-1, joints.shape[1], 4, 4)
 
-    transform_chain = [transforms_mat[:, 0]]
-    for i in range(1, parents.shape[0]):
-        # Subtract the joint location at the rest pose
-        # No need for rotation, since it's identity when at rest
-        curr_res = torch.matmul(transform_chain[parents[i]], transforms_mat[:, i])
-        transform_chain.append(curr_res)
-
-    transforms = torch.stack(transform_chain, dim=1)
+    # Subtract the joint location at the rest pose
+    # No need for rotation, since it's identity when at rest
+    transforms = get_kinematic_tree(parents).compose(transforms_mat)
 
     # The last column of the transformations contains the posed joints
     posed_joints = transforms[:, :, :3, 3]
@@ -412,4 +500,8 @@ def batch_rigid_transform(
         torch.matmul(transforms, joints_homogen), [3, 0, 0, 0, 0, 0, 0, 0]
     )
 
+    if accumulate_dtype is not None:
+        posed_joints = posed_joints.to(out_dtype)
+        rel_transforms = rel_transforms.to(out_dtype)
+
     return posed_joints, rel_transforms
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# @Function      : post-reconstruction gaussian pruning and level-of-detail
+
+import torch
+
+from LHM.outputs.output import GaussianAppOutput
+
+
+@torch.no_grad()
+def prune_gaussians(gs_attr, opacity_threshold=0.005, min_scale=0.0):
+    """
+    Args:
+        gs_attr (GaussianAppOutput): canonical gaussians of one avatar, N points.
+        opacity_threshold (float): drop gaussians whose activated opacity is below.
+        min_scale (float): drop gaussians whose largest axis is below, e.g. sub-pixel at the render resolution.
+    Returns:
+        torch.LongTensor [M]: kept point index.
+    """
+    keep = gs_attr.opacity[:, 0] >= opacity_threshold
+    if min_scale > 0:
+        keep = keep & (gs_attr.scaling.max(dim=1)[0] >= min_scale)
+    return torch.nonzero(keep, as_tuple=False)[:, 0]
+
+
+def _scatter_sum(src, inverse, num_clusters):
+    out = torch.zeros((num_clusters,) + src.shape[1:], dtype=src.dtype, device=src.device)
+    return out.index_add_(0, inverse, src)
+
+
+@torch.no_grad()
+def merge_gaussians(gs_attr, query_points, point_index, voxel_size):
+    """merge the gaussians falling into the same voxel of the canonical space.
+
+    The most opaque gaussian of a voxel is its representative: the merged gaussian keeps its
+    dense sample point (thus its skinning) and rotation. Position and colour are opacity-weighted
+    means, opacity is the union alpha, scale covers the spread of the members.
+    A voxel holding a single gaussian is left unchanged.
+
+    Args:
+        gs_attr (GaussianAppOutput): canonical gaussians, N points.
+        query_points (torch.Tensor): [N, 3] dense sample points.
+        point_index (torch.LongTensor): [M] gaussians to merge, e.g. from prune_gaussians.
+        voxel_size (float): merge radius.
+    Returns:
+        gs_attr (GaussianAppOutput): merged gaussians, K points.
+        point_index (torch.LongTensor): [K] representative dense sample point of each.
+    """
+    offset_xyz = gs_attr.offset_xyz[point_index]
+    opacity = gs_attr.opacity[point_index]
+    scaling = gs_attr.scaling[point_index]
+    shs = gs_attr.shs[point_index]
+    mean_3d = query_points[point_index] + offset_xyz
+
+    voxel = torch.floor(mean_3d / voxel_size).long()
+    _, inverse = torch.unique(voxel, dim=0, return_inverse=True)
+    num_clusters = int(inverse.max()) + 1 if inverse.numel() > 0 else 0
+
+    # representative: the most opaque member, ties broken by the lowest index
+    weight = opacity[:, 0].float().clamp(min=1e-6)
+    max_weight = torch.zeros(num_clusters, device=weight.device).scatter_reduce(
+        0, inverse, weight, reduce="amax", include_self=False
+    )
+    member = torch.arange(len(weight), device=weight.device)
+    candidate = torch.where(
+        weight == max_weight[inverse], member, torch.full_like(member, len(weight))
+    )
+    rep = torch.full(
+        (num_clusters,), len(weight), dtype=torch.long, device=weight.device
+    ).scatter_reduce(
+        0, inverse, candidate, reduce="amin", include_self=True
+    )
+
+    weight_sum = _scatter_sum(weight, inverse, num_clusters)
+    norm_weight = (weight / weight_sum[inverse])[:, None]
+
+    merged_mean = _scatter_sum(mean_3d.float() * norm_weight, inverse, num_clusters)
+    spread = _scatter_sum(
+        (mean_3d.float() - merged_mean[inverse]) ** 2 * norm_weight, inverse, num_clusters
+    )
+    merged_scaling = torch.sqrt(
+        _scatter_sum(scaling.float() ** 2 * norm_weight, inverse, num_clusters) + spread
+    )
+    merged_shs = _scatter_sum(
+        shs.float() * norm_weight[:, :, None], inverse, num_clusters
+    )
+    # union alpha: 1 - prod(1 - alpha)
+    log_transmittance = _scatter_sum(
+        torch.log1p(-opacity.float().clamp(max=1 - 1e-6)), inverse, num_clusters
+    )
+    merged_opacity = 1 - torch.exp(log_transmittance)
+
+    merged_index = point_index[rep]
+    dtype = gs_attr.offset_xyz.dtype
+    merged = GaussianAppOutput(
+        offset_xyz=(merged_mean - query_points[merged_index].float()).to(dtype),
+        opacity=merged_opacity.to(dtype),
+        rotation=gs_attr.rotation[merged_index],
+        scaling=merged_scaling.to(dtype),
+        shs=merged_shs.to(dtype),
+        use_rgb=gs_attr.use_rgb,
+    )
+    return merged, merged_index
+
+
+@torch.no_grad()
+def build_gaussian_lod(
+    gs_attr, query_points, voxel_sizes=(0.0,), opacity_threshold=0.005, min_scale=0.0
+):
+    """
+    Args:
+        gs_attr (GaussianAppOutput): canonical gaussians of one avatar, N points.
+        query_points (torch.Tensor): [N, 3] dense sample points.
+        voxel_sizes (list[float]): one level per entry, 0 only prunes, > 0 also merges within that radius.
+        opacity_threshold, min_scale: see prune_gaussians.
+    Returns:
+        list of (gs_attr, query_points [K, 3], point_index [K]), coarser levels for larger voxel sizes.
+    """
+    point_index = prune_gaussians(gs_attr, opacity_threshold, min_scale)
+
+    levels = []
+    for voxel_size in voxel_sizes:
+        if voxel_size > 0:
+            level_attr, level_index = merge_gaussians(
+                gs_attr, query_points, point_index, voxel_size
+            )
+        else:
+            level_index = point_index
+            level_attr = GaussianAppOutput(
+                offset_xyz=gs_attr.offset_xyz[level_index],
+                opacity=gs_attr.opacity[level_index],
+                rotation=gs_attr.rotation[level_index],
+                scaling=gs_attr.scaling[level_index],
+                shs=gs_attr.shs[level_index],
+                use_rgb=gs_attr.use_rgb,
+            )
+        levels.append((level_attr, query_points[level_index], level_index))
+    return levels
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# @Function      : device-agnostic, cached builder of the voxel skinning field
+
+import hashlib
+import os
+
+import numpy as np
+import torch
+from scipy.spatial import cKDTree
+
+SKINNING_FIELD_VERSION = 1
+
+
+def _as_numpy(x):
+    if isinstance(x, torch.Tensor):
+        x = x.detach().cpu().numpy()
+    return np.ascontiguousarray(x, dtype=np.float32)
+
+
+def skinning_field_key(voxel_v, template_v, lbs_weights, **params):
+    """hash of everything the field depends on: voxel centres, template (thus betas and cano pose),
+    skinning weights and smoothing parameters."""
+    sha = hashlib.sha256()
+    sha.update(f"v{SKINNING_FIELD_VERSION}".encode())
+    for array in (voxel_v, template_v, lbs_weights):
+        array = _as_numpy(array)
+        sha.update(str(array.shape).encode())
+        sha.update(array.tobytes())
+    for name in sorted(params):
+        sha.update(f"{name}={params[name]!r}".encode())
+    return sha.hexdigest()[:16]
+
+
+@torch.no_grad()
+def build_skinning_field(
+    voxel_v,
+    template_v,
+    lbs_weights,
+    smooth_k=30,
+    smooth_n=3000,
+    tol=1e-6,
+    check_every=100,
+    device="cpu",
+):
+    """Diffuse the skinning weights of the template into the voxel grid, handles skirt deformation.
+
+    Each voxel starts from the weights of its nearest template vertex, then voxels farther than 1cm
+    from the mesh repeatedly take the inverse-distance weighted mean of their smooth_k voxel neighbours.
+    Neighbours come from a KD-tree and the smoothing is a sparse matrix product, so it runs on CPU
+    as well as on GPU, and stops early once no weight moves by more than tol.
+
+    Args:
+        voxel_v: [N, 3] voxel centres.
+        template_v: [V, 3] template vertices.
+        lbs_weights: [V, J] template skinning weights.
+        smooth_k (int): voxel neighbours of the smoothing.
+        smooth_n (int): maximum smoothing iterations.
+        tol (float): convergence threshold, checked every check_every iterations.
+        device: device of the smoothing iterations.
+    Returns:
+        torch.Tensor: [N, J] float32 voxel skinning weights, on device.
+    """
+    voxel_np = _as_numpy(voxel_v)
+    template_np = _as_numpy(template_v)
+    num_voxels = voxel_np.shape[0]
+
+    mesh_dis, mesh_indices = cKDTree(template_np).query(voxel_np, k=1, workers=-1)
+
+    print(f"Using k = {smooth_k}, N={smooth_n} for LBS smoothing")
+    voxel_dis, voxel_indices = cKDTree(voxel_np).query(
+        voxel_np, k=smooth_k + 1, workers=-1
+    )
+    # drop the voxel itself
+    voxel_dis = voxel_dis[:, 1:].astype(np.float32)
+    voxel_indices = voxel_indices[:, 1:].astype(np.int64)
+    mesh_dis = mesh_dis.astype(np.float32)
+
+    knn_weights = 1.0 / np.maximum(mesh_dis[voxel_indices] * voxel_dis, 1e-12)
+    knn_weights = knn_weights / knn_weights.sum(-1, keepdims=True)  # [N, K]
+
+    smooth_matrix = torch.sparse_csr_tensor(
+        torch.arange(0, num_voxels * smooth_k + 1, smooth_k, dtype=torch.int64),
+        torch.from_numpy(voxel_indices.reshape(-1)),
+        torch.from_numpy(knn_weights.reshape(-1)),
+        size=(num_voxels, num_voxels),
+    ).to(device)
+
+    # voxels on the surface keep the weights of their nearest vertex
+    update_mask = torch.from_numpy(mesh_dis >= 0.01).to(device)[:, None]
+    weights = torch.as_tensor(lbs_weights).float().to(device)[
+        torch.from_numpy(mesh_indices.astype(np.int64)).to(device)
+    ]
+
+    from tqdm import tqdm
+
+    for step in tqdm(range(smooth_n)):
+        new_weights = torch.where(update_mask, smooth_matrix @ weights, weights)
+        if (step + 1) % check_every == 0:
+            delta = (new_weights - weights).abs().max().item()
+            if delta < tol:
+                weights = new_weights
+                print(f"LBS smoothing converged after {step + 1} iterations")
+                break
+        weights = new_weights
+
+    return weights
+
+
+def load_or_build_skinning_field(
+    voxel_v,
+    template_v,
+    lbs_weights,
+    cache_dir,
+    prefix="voxel",
+    smooth_k=30,
+    smooth_n=3000,
+    tol=1e-6,
+    device="cpu",
+):
+    """build_skinning_field cached under cache_dir/{prefix}_{skinning_field_key}.pth."""
+    key = skinning_field_key(
+        voxel_v, template_v, lbs_weights, smooth_k=smooth_k, smooth_n=smooth_n, tol=tol
+    )
+    cache_path = os.path.join(cache_dir, f"{prefix}_{key}.pth")
+
+    if os.path.exists(cache_path):
+        print(f"load voxel skinning field {cache_path}")
+        return torch.load(cache_path, map_location=device)
+
+    voxel_skinning = build_skinning_field(
+        voxel_v,
+        template_v,
+        lbs_weights,
+        smooth_k=smooth_k,
+        smooth_n=smooth_n,
+        tol=tol,
+        device=device,
+    )
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # write then rename, so that concurrent builders never read a partial file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    torch.save(voxel_skinning.cpu(), tmp_path)
+    os.replace(tmp_path, cache_path)
+    return voxel_skinning
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# @Function      : compact binary export of gaussian avatars
+
+import numpy as np
+
+from LHM.models.rendering.utils.sh_utils import RGB2SH, SH2RGB
+
+SPLAT_MAGIC = b"LHMSPLAT"
+SPLAT_VERSION = 1
+SPLAT_SUFFIX = ".lhmsplat"
+
+FLAG_USE_RGB = 1
+FLAG_QUANTIZED = 2
+
+# fixed-size little-endian header, followed by num_points records of splat_dtype()
+SPLAT_HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("num_points", "<u4"),
+        ("sh_coeffs", "<u4"),
+        ("flags", "<u4"),
+        ("xyz_min", "<f4", (3,)),
+        ("xyz_max", "<f4", (3,)),
+    ]
+)
+
+
+def splat_dtype(sh_coeffs, quantized):
+    """per-gaussian record.
+    xyz: uint16 over the bounding box of the avatar, scale: float16 log scale.
+    quantized: rotation int8, opacity and colour uint8 (20 bytes / gaussian without sh_rest),
+        otherwise float16 (28 bytes / gaussian without sh_rest).
+    """
+    if quantized:
+        fields = [
+            ("xyz", "<u2", (3,)),
+            ("scale", "<f2", (3,)),
+            ("rotation", "i1", (4,)),
+            ("opacity", "u1"),
+            ("color", "u1", (3,)),
+        ]
+    else:
+        fields = [
+            ("xyz", "<u2", (3,)),
+            ("scale", "<f2", (3,)),
+            ("rotation", "<f2", (4,)),
+            ("opacity", "<f2"),
+            ("color", "<f2", (3,)),
+        ]
+    if sh_coeffs > 1:
+        fields.append(("sh_rest", "<f2", (sh_coeffs - 1, 3)))
+    return np.dtype(fields)
+
+
+def pack_splat(xyz, opacity, rotation, scaling, shs, use_rgb, quantize=True):
+    """
+    Args:
+        xyz: [N, 3], opacity: [N, 1] (activated), rotation: [N, 4], scaling: [N, 3] (activated),
+        shs: [N, K, 3], rgb 0-1 if use_rgb else sh coefficients. numpy float arrays.
+        quantize: 8-bit rotation, opacity and colour, otherwise float16.
+    Returns:
+        bytes
+    """
+    num_points, sh_coeffs = shs.shape[:2]
+
+    header = np.zeros((), dtype=SPLAT_HEADER_DTYPE)
+    header["magic"] = SPLAT_MAGIC
+    header["version"] = SPLAT_VERSION
+    header["num_points"] = num_points
+    header["sh_coeffs"] = sh_coeffs
+    header["flags"] = (FLAG_USE_RGB if use_rgb else 0) | (
+        FLAG_QUANTIZED if quantize else 0
+    )
+    xyz_min = xyz.min(axis=0) if num_points > 0 else np.zeros(3)
+    xyz_max = xyz.max(axis=0) if num_points > 0 else np.zeros(3)
+    header["xyz_min"] = xyz_min
+    header["xyz_max"] = xyz_max
+
+    records = np.empty(num_points, dtype=splat_dtype(sh_coeffs, quantize))
+
+    extent = np.maximum(xyz_max - xyz_min, 1e-8)
+    records["xyz"] = np.rint((xyz - xyz_min) / extent * 65535).clip(0, 65535)
+    records["scale"] = np.log(np.maximum(scaling, 1e-12))
+
+    rotation = rotation / np.maximum(
+        np.linalg.norm(rotation, axis=1, keepdims=True), 1e-12
+    )
+    if quantize:
+        # q and -q are the same rotation, keep w >= 0 so that w never wraps
+        rotation = np.where(rotation[:, :1] < 0, -rotation, rotation)
+        records["rotation"] = np.rint(rotation * 127)
+        records["opacity"] = np.rint(opacity[:, 0].clip(0, 1) * 255)
+        rgb = shs[:, 0] if use_rgb else SH2RGB(shs[:, 0])
+        records["color"] = np.rint(rgb.clip(0, 1) * 255)
+    else:
+        records["rotation"] = rotation
+        records["opacity"] = opacity[:, 0]
+        records["color"] = shs[:, 0]
+
+    if sh_coeffs > 1:
+        records["sh_rest"] = shs[:, 1:]
+
+    return header.tobytes() + records.tobytes()
+
+
+def unpack_splat(buffer):
+    """inverse of pack_splat, returns a dict of float32 arrays (and use_rgb)."""
+    header = np.frombuffer(buffer, dtype=SPLAT_HEADER_DTYPE, count=1)[0]
+    assert header["magic"] == SPLAT_MAGIC, "not a splat file"
+    assert (
+        header["version"] <= SPLAT_VERSION
+    ), f"unsupported splat version {header['version']}"
+
+    num_points = int(header["num_points"])
+    sh_coeffs = int(header["sh_coeffs"])
+    use_rgb = bool(header["flags"] & FLAG_USE_RGB)
+    quantized = bool(header["flags"] & FLAG_QUANTIZED)
+
+    records = np.frombuffer(
+        buffer,
+        dtype=splat_dtype(sh_coeffs, quantized),
+        count=num_points,
+        offset=SPLAT_HEADER_DTYPE.itemsize,
+    )
+
+    xyz_min = header["xyz_min"]
+    extent = np.maximum(header["xyz_max"] - xyz_min, 1e-8)
+    xyz = records["xyz"].astype(np.float32) / 65535 * extent + xyz_min
+    scaling = np.exp(records["scale"].astype(np.float32))
+    rotation = records["rotation"].astype(np.float32)
+
+    shs = np.empty((num_points, sh_coeffs, 3), dtype=np.float32)
+    if quantized:
+        rotation = rotation / 127
+        opacity = records["opacity"].astype(np.float32) / 255
+        rgb = records["color"].astype(np.float32) / 255
+        shs[:, 0] = rgb if use_rgb else RGB2SH(rgb)
+    else:
+        opacity = records["opacity"].astype(np.float32)
+        shs[:, 0] = records["color"]
+    if sh_coeffs > 1:
+        shs[:, 1:] = records["sh_rest"]
+
+    return dict(
+        xyz=xyz.astype(np.float32),
+        opacity=opacity[:, None],
+        rotation=rotation,
+        scaling=scaling,
+        shs=shs,
+        use_rgb=use_rgb,
+    )
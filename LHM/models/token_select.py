@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# @Function      : mask-aware selection of the condition tokens fed to the transformer
+
+import torch
+import torch.nn.functional as F
+
+
+def foreground_token_coverage(fg_mask, grid_size):
+    """
+    Args:
+        fg_mask (torch.Tensor): [B, 1, H, W] foreground mask of the reference image, 0-1.
+        grid_size (int): side of the square token grid of the encoder.
+    Returns:
+        torch.Tensor: [B, grid_size * grid_size] foreground fraction under each token,
+            dilated by one token so that the silhouette boundary is kept.
+    """
+    _, _, H, W = fg_mask.shape
+
+    # the same square padding as SapiensWrapper._preprocess_image, padded area is background
+    max_size = max(H, W)
+    H_pad = max_size - H
+    W_pad = max_size - W
+    fg_mask = F.pad(
+        fg_mask.float(),
+        (W_pad // 2, W_pad - W_pad // 2, H_pad // 2, H_pad - H_pad // 2),
+        value=0,
+    )
+
+    coverage = F.interpolate(fg_mask, size=(grid_size, grid_size), mode="area")
+    coverage = F.max_pool2d(coverage, kernel_size=3, stride=1, padding=1)
+    return coverage.flatten(1)
+
+
+def select_condition_tokens(tokens, fg_mask, num_keep, merge=False):
+    """keep the num_keep condition tokens covering the most foreground, in their original order.
+
+    The joint attention of the transformer uses no positional encoding on the condition tokens
+    (the encoder already embedded it), so dropping background tokens only shortens the sequence.
+
+    Args:
+        tokens (torch.Tensor): [B, N, C] tokens of a square grid, e.g. the 64x64 Sapiens body tokens.
+        fg_mask (torch.Tensor): [B, 1, H, W] foreground mask of the encoded image, 0-1.
+        num_keep (int): kept tokens, the same for the whole batch.
+        merge (bool): append the mean of the dropped tokens as a single background token.
+    Returns:
+        torch.Tensor: [B, num_keep (+1 if merge), C] selected tokens.
+    """
+    B, N, C = tokens.shape
+    if num_keep is None or num_keep >= N:
+        return tokens
+
+    grid_size = int(round(N**0.5))
+    assert grid_size * grid_size == N, f"tokens of a square grid are expected, got {N}"
+
+    coverage = foreground_token_coverage(fg_mask.to(tokens.device), grid_size)
+    index = coverage.topk(num_keep, dim=1).indices.sort(dim=1).values  # [B, K]
+    selected = tokens.gather(1, index[..., None].expand(-1, -1, C))
+
+    if merge:
+        dropped = torch.ones(B, N, device=tokens.device, dtype=tokens.dtype)
+        dropped.scatter_(1, index, 0)
+        background = (tokens * dropped[..., None]).sum(dim=1) / dropped.sum(
+            dim=1, keepdim=True
+        ).clamp(min=1)
+        selected = torch.cat([selected, background[:, None]], dim=1)
+
+    return selected
@@ -206,6 +206,7 @@ class TransformerDecoder(nn.Module):
         cond: torch.Tensor = None,
         mod: torch.Tensor = None,
         temb: torch.Tensor = None,
+        num_body_tokens: int = None,
     ) -> torch.Tensor:
         """
         Forward pass of the transformer model.
@@ -214,6 +215,7 @@ class TransformerDecoder(nn.Module):
             cond (torch.Tensor, optional): Conditional tensor of shape [N, L_cond, D_cond] or None. Defaults to None.
             mod (torch.Tensor, optional): Modulation tensor of shape [N, D_mod] or None. Defaults to None.
             temb (torch.Tensor, optional): Modulation tensor of shape [N, D_mod] or None. Defaults to None.  # For SD3_MM_Cond, temb means MotionCLIP
+            num_body_tokens (int, optional): For SD3_MM_BH_Cond, leading body tokens of cond, the rest are head tokens. Defaults to None, 4096.
         Returns:
             torch.Tensor: Output tensor of shape [N, L, D].
         """
@@ -230,12 +232,17 @@ class TransformerDecoder(nn.Module):
             "sd3_mm_bh_cond",
         ]:
             cond = self.linear_cond_proj(cond)
+            layer_kwargs = (
+                {"num_body_tokens": num_body_tokens}
+                if self.block_type == "sd3_mm_bh_cond" and num_body_tokens is not None
+                else {}
+            )
             for layer in self.layers:
                 if self.training and self.gradient_checkpointing:
 
                     def create_custom_forward(module):
                         def custom_forward(*inputs):
-                            return module(*inputs)
+                            return module(*inputs, **layer_kwargs)
 
                         return custom_forward
 
@@ -266,6 +273,7 @@ class TransformerDecoder(nn.Module):
                         encoder_hidden_states=cond,
                         temb=temb,
                         # image_rotary_emb=None,
+                        **layer_kwargs,
                     )
 
             x = self.norm(x)
@@ -543,11 +543,100 @@ class SD3MMJointTransformerBlock(nn.Module):
         self._chunk_size = chunk_size
         self._chunk_dim = dim
 
+    def forward_context(
+        self,
+        encoder_hidden_states: torch.FloatTensor,
+        temb: torch.FloatTensor,
+    ):
+        """
+        The part of the block which only depends on the context: its modulation and its attention
+        projections, the same ops as JointAttnProcessor2_0. It can run ahead of, or next to, the work
+        on the query points, see SD3BodyHeadMMJointTransformerBlock.
+        Args:
+            encoder_hidden_states (torch.FloatTensor): Encoder hidden states. Context features
+            temb (torch.FloatTensor): motion embed.
+        Returns:
+            Dict: query, key, value [B, num_head, L_cond, D/num_head] and the modulation of the context.
+        """
+        attn = self.attn
+
+        if self.context_pre_only:
+            norm_encoder_hidden_states = self.norm1_context(encoder_hidden_states, temb)
+            modulation = None
+        else:
+            norm_encoder_hidden_states, *modulation = self.norm1_context(
+                encoder_hidden_states, emb=temb
+            )
+
+        batch_size = encoder_hidden_states.shape[0]
+        query = attn.add_q_proj(norm_encoder_hidden_states)
+        key = attn.add_k_proj(norm_encoder_hidden_states)
+        value = attn.add_v_proj(norm_encoder_hidden_states)
+
+        head_dim = key.shape[-1] // attn.heads
+        query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        if attn.norm_added_q is not None:
+            query = attn.norm_added_q(query)
+        if attn.norm_added_k is not None:
+            key = attn.norm_added_k(key)
+
+        return dict(query=query, key=key, value=value, modulation=modulation)
+
+    def joint_attention(self, norm_hidden_states, context):
+        """JointAttnProcessor2_0 of self.attn, with the context projections from forward_context."""
+        attn = self.attn
+        batch_size, num_points, _ = norm_hidden_states.shape
+
+        query = attn.to_q(norm_hidden_states)
+        key = attn.to_k(norm_hidden_states)
+        value = attn.to_v(norm_hidden_states)
+
+        head_dim = key.shape[-1] // attn.heads
+        query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        if attn.norm_q is not None:
+            query = attn.norm_q(query)
+        if attn.norm_k is not None:
+            key = attn.norm_k(key)
+
+        query = torch.cat([query, context["query"]], dim=2)
+        key = torch.cat([key, context["key"]], dim=2)
+        value = torch.cat([value, context["value"]], dim=2)
+
+        hidden_states = F.scaled_dot_product_attention(
+            query, key, value, dropout_p=0.0, is_causal=False
+        )
+        hidden_states = hidden_states.transpose(1, 2).reshape(
+            batch_size, -1, attn.heads * head_dim
+        )
+        hidden_states = hidden_states.to(query.dtype)
+
+        # Split the attention outputs.
+        hidden_states, encoder_hidden_states = (
+            hidden_states[:, :num_points],
+            hidden_states[:, num_points:],
+        )
+        if not attn.context_pre_only:
+            encoder_hidden_states = attn.to_add_out(encoder_hidden_states)
+
+        # linear proj
+        hidden_states = attn.to_out[0](hidden_states)
+        # dropout
+        hidden_states = attn.to_out[1](hidden_states)
+
+        return hidden_states, encoder_hidden_states
+
     def forward(
         self,
         hidden_states: torch.FloatTensor,
         encoder_hidden_states: torch.FloatTensor,
         temb: torch.FloatTensor = None,
+        context: Optional[Dict[str, Any]] = None,
     ):
         """
         Forward pass of the transformer_dit model.
@@ -555,6 +644,7 @@ class SD3MMJointTransformerBlock(nn.Module):
             hidden_states (torch.FloatTensor): Input hidden states. Query Points features
             encoder_hidden_states (torch.FloatTensor): Encoder hidden states. Context features
             motion embed:(torch.FloatTensor, optional): Optional tensor for embedding. Defaults to None.
+            context (Dict, optional): forward_context of encoder_hidden_states and temb, computed ahead. Defaults to None.
         Returns:
             Tuple[torch.FloatTensor, torch.FloatTensor]: Tuple containing the updated hidden states and encoder hidden states.
         """
@@ -566,23 +656,32 @@ class SD3MMJointTransformerBlock(nn.Module):
             hidden_states, emb=temb
         )
 
-        if self.context_pre_only:
-            norm_encoder_hidden_states = self.norm1_context(encoder_hidden_states, temb)
+        if context is not None:
+            if not self.context_pre_only:
+                c_gate_msa, c_shift_mlp, c_scale_mlp, c_gate_mlp = context["modulation"]
+            attn_output, context_attn_output = self.joint_attention(
+                norm_hidden_states, context
+            )
         else:
-            (
-                norm_encoder_hidden_states,
-                c_gate_msa,
-                c_shift_mlp,
-                c_scale_mlp,
-                c_gate_mlp,
-            ) = self.norm1_context(encoder_hidden_states, emb=temb)
-
-        # Attention.
-        # norma hidden states [B, L, D] - > multi-head atten [B, num_head, L, D/num_head]
-        attn_output, context_attn_output = self.attn(
-            hidden_states=norm_hidden_states,
-            encoder_hidden_states=norm_encoder_hidden_states,
-        )
+            if self.context_pre_only:
+                norm_encoder_hidden_states = self.norm1_context(
+                    encoder_hidden_states, temb
+                )
+            else:
+                (
+                    norm_encoder_hidden_states,
+                    c_gate_msa,
+                    c_shift_mlp,
+                    c_scale_mlp,
+                    c_gate_mlp,
+                ) = self.norm1_context(encoder_hidden_states, emb=temb)
+
+            # Attention.
+            # norma hidden states [B, L, D] - > multi-head atten [B, num_head, L, D/num_head]
+            attn_output, context_attn_output = self.attn(
+                hidden_states=norm_hidden_states,
+                encoder_hidden_states=norm_encoder_hidden_states,
+            )
 
         # Process attention outputs for the `hidden_states`.
         attn_output = gate_msa.unsqueeze(1) * attn_output
@@ -678,13 +777,63 @@ class SD3BodyHeadMMJointTransformerBlock(nn.Module):
             use_dual_attention=use_dual_attention,
         )
 
+        # run the context half of body_dit on a side stream while head_dit runs, see set_branch_overlap
+        self.branch_overlap = False
+        self._side_streams = {}
+
+    def _side_stream(self, device):
+        if device not in self._side_streams:
+            self._side_streams[device] = torch.cuda.Stream(device=device)
+        return self._side_streams[device]
+
+    def forward_overlap(
+        self,
+        head_hidden_states,
+        head_encoder_hidden_states,
+        head_temb,
+        body_encoder_hidden_states,
+        body_temb,
+    ):
+        """head_dit, and next to it on a side stream, the context half of body_dit.
+
+        body_dit attends over the head states written by head_dit, so only its context modulation and
+        projections (the body tokens) are independent of the head branch. They are the same ops
+        in the same order as the sequential path, so the outputs are identical.
+        """
+        main_stream = torch.cuda.current_stream(body_encoder_hidden_states.device)
+        side_stream = self._side_stream(body_encoder_hidden_states.device)
+
+        side_stream.wait_stream(main_stream)
+        with torch.cuda.stream(side_stream):
+            body_context = self.body_dit.forward_context(
+                body_encoder_hidden_states, body_temb
+            )
+
+        head_states, head_encoder_hidden_states = self.head_dit(
+            head_hidden_states, head_encoder_hidden_states, head_temb
+        )
+
+        main_stream.wait_stream(side_stream)
+        for tensor in (
+            body_context["query"],
+            body_context["key"],
+            body_context["value"],
+            *(body_context["modulation"] or ()),
+        ):
+            tensor.record_stream(main_stream)
+
+        return head_states, head_encoder_hidden_states, body_context
+
     def forward(
         self,
         hidden_states: torch.FloatTensor,
         encoder_hidden_states: torch.FloatTensor,
         temb: torch.FloatTensor = None,
+        num_body_tokens: int = 4096,
     ):
-        """Default, last 1 / 4 is head"""
+        """Default, last 1 / 4 is head.
+        num_body_tokens: leading body tokens of encoder_hidden_states, the rest are head tokens.
+        """
 
         _, N, _ = hidden_states.shape
         body_size = int(N * 0.75)
@@ -698,18 +847,38 @@ class SD3BodyHeadMMJointTransformerBlock(nn.Module):
         temb_size = temb_N // 2
         body_temb, head_temb = temb[:, :temb_size], temb[:, temb_size:]
 
-        # body: 4096, head 1024, Sapiens & DINO
+        # body: 4096, head 1024, Sapiens & DINO. fewer body tokens once pruned by the foreground mask
         body_encoder_hidden_states, head_encoder_hidden_states = (
-            encoder_hidden_states[:, :4096],
-            encoder_hidden_states[:, 4096:],
+            encoder_hidden_states[:, :num_body_tokens],
+            encoder_hidden_states[:, num_body_tokens:],
         )
 
-        head_states, head_encoder_hidden_states = self.head_dit(
-            head_hidden_states, head_encoder_hidden_states, head_temb
+        # streams are for inference only and invisible to torch.compile, a compiled caller runs the
+        # transformer through run_eager to keep the overlap
+        overlap = (
+            self.branch_overlap
+            and hidden_states.is_cuda
+            and not torch.is_grad_enabled()
+            and not torch._dynamo.is_compiling()
         )
+
+        if overlap:
+            head_states, head_encoder_hidden_states, body_context = self.forward_overlap(
+                head_hidden_states,
+                head_encoder_hidden_states,
+                head_temb,
+                body_encoder_hidden_states,
+                body_temb,
+            )
+        else:
+            head_states, head_encoder_hidden_states = self.head_dit(
+                head_hidden_states, head_encoder_hidden_states, head_temb
+            )
+            body_context = None
+
         hidden_states = torch.cat([body_hidden_states, head_states], dim=1)
         hidden_states, body_encoder_hidden_states = self.body_dit(
-            hidden_states, body_encoder_hidden_states, body_temb
+            hidden_states, body_encoder_hidden_states, body_temb, context=body_context
         )
 
         if body_encoder_hidden_states is not None:
@@ -720,3 +889,18 @@ class SD3BodyHeadMMJointTransformerBlock(nn.Module):
             encoder_hidden_states = None
 
         return hidden_states, encoder_hidden_states
+
+
+def set_branch_overlap(model: nn.Module, enabled: bool = True):
+    """toggle the head/body branch overlap of every SD3BodyHeadMMJointTransformerBlock in model,
+    and of the modules running them (with a branch_overlap switch, e.g. ModelHumanLRMSapdinoBodyHeadSD3_5).
+    """
+    for module in model.modules():
+        if hasattr(module, "branch_overlap"):
+            module.branch_overlap = enabled
+
+
+@torch._dynamo.disable
+def run_eager(fn, *args, **kwargs):
+    """call fn outside of torch.compile: a graph break when traced, a plain call otherwise."""
+    return fn(*args, **kwargs)
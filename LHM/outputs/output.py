@@ -2,6 +2,7 @@
 """
 
 from dataclasses import dataclass
+from typing import Optional
 
 import numpy as np
 from torch import Tensor
@@ -24,3 +25,25 @@ class GaussianAppOutput(BaseOutput):
     scaling: Tensor
     shs: Tensor
     use_rgb: bool
+
+
+@dataclass
+class NeutralPoseCacheOutput(BaseOutput):
+    """
+    Pose-independent part of the neutral pose -> posed skinning of one avatar.
+
+    Attributes:
+        transform_mat_null_vertex: [1, N, 4, 4], per-point transform from the predefined (大) pose to zero pose.
+        null_mean_3d_blendshape: [1, N, 3], gaussian centers warped to zero pose with the shape blendshape applied.
+        null_expr_dirs: [N, 3, E], expression basis rotated into zero pose.
+        joint_null_pose: [1, 55, 3], zero-pose joints of the avatar's betas.
+        point_index: optional [N] indices into the dense sample points, set for a compacted (LOD) avatar.
+        skinning_weight: optional [N, 55] skinning weights of point_index.
+    """
+
+    transform_mat_null_vertex: Tensor
+    null_mean_3d_blendshape: Tensor
+    null_expr_dirs: Tensor
+    joint_null_pose: Tensor
+    point_index: Optional[Tensor] = None
+    skinning_weight: Optional[Tensor] = None
@@ -8,6 +8,7 @@
 import argparse
 import os
 import pdb
+import threading
 import time
 
 import cv2
@@ -19,7 +20,6 @@ from PIL import Image
 from tqdm.auto import tqdm
 
 from engine.pose_estimation.pose_estimator import PoseEstimator
-from engine.SegmentAPI.base import Bbox
 
 # from LHM.utils.model_download_utils import AutoModelQuery
 from LHM.utils.model_download_utils import AutoModelQuery
@@ -37,21 +37,28 @@ from LHM.datasets.cam_utils import (
     surrounding_views_linspace,
 )
 from LHM.models.modeling_human_lrm import ModelHumanLRM
+from LHM.models.rendering.utils.splat_io import SPLAT_SUFFIX
+from LHM.models.transformer_dit import set_branch_overlap
 from LHM.runners import REGISTRY_RUNNERS
 from LHM.runners.infer.utils import (
+    MotionSeqCache,
     calc_new_tgt_size_by_aspect,
-    center_crop_according_to_mask,
     prepare_motion_seqs,
-    resize_image_keepaspect_np,
+    preprocess_reference_image,
 )
+from LHM.utils.avatar_cache import AvatarCache
+from LHM.utils.compile import configure_compile, is_compile_enabled, warmup
 from LHM.utils.download_utils import download_extract_tar_from_url, download_from_url
 from LHM.utils.face_detector import FaceDetector
 
 # from LHM.utils.video import images_to_video
-from LHM.utils.ffmpeg_utils import images_to_video
+from LHM.utils.ffmpeg_utils import VideoWriter, images_to_video
 from LHM.utils.hf_hub import wrap_model_hub
+from LHM.utils.image_context import ImageContext
 from LHM.utils.logging import configure_logger
 from LHM.utils.model_card import MODEL_CARD, MODEL_CONFIG
+from LHM.utils.pipeline import Stage, StagedPipeline
+from LHM.utils.render_memory import RENDER_MEMORY_DIR, RenderMemoryModel
 
 
 def download_geo_files():
@@ -108,27 +115,6 @@ def resize_with_padding(img, target_size, padding_color=(255, 255, 255)):
     return padded
 
 
-def get_bbox(mask):
-    height, width = mask.shape
-    pha = mask / 255.0
-    pha[pha < 0.5] = 0.0
-    pha[pha >= 0.5] = 1.0
-
-    # obtain bbox
-    _h, _w = np.where(pha == 1)
-
-    whwh = [
-        _w.min().item(),
-        _h.min().item(),
-        _w.max().item(),
-        _h.max().item(),
-    ]
-
-    box = Bbox(whwh)
-    # scale box to 1.05
-    scale_box = box.scale(1.1, width=width, height=height)
-    return scale_box
-
 def query_model_name(model_name):
     if model_name in MODEL_PATH:
         model_path = MODEL_PATH[model_name]
@@ -192,129 +178,23 @@ def infer_preprocess_image(
     """
 
     
-    # 1. 读取图像与备份原图
-    rgb = np.array(Image.open(rgb_path))
-    rgb_raw = rgb.copy()
-
-    # 2. 计算裁剪 BBox
-        # 对输入的 mask 提取前景区域的最小外接矩形（非零区域）。
-        # 返回四个值 [x_min, y_min, x_max, y_max]。
-    bbox = get_bbox(mask)
-    bbox_list = bbox.get_box()
-
-    # 3. 裁剪 RGB 图像与遮罩
-    # 按照 BBox 裁剪图像与 mask，只保留人物区域，减少背景干扰。
-    rgb = rgb[bbox_list[1] : bbox_list[3], bbox_list[0] : bbox_list[2]]
-    mask = mask[bbox_list[1] : bbox_list[3], bbox_list[0] : bbox_list[2]]
-
-    # 4. 获取高宽比例并计算缩放尺度
-    h, w, _ = rgb.shape
-    assert w < h
-    cur_ratio = h / w
-    scale_ratio = cur_ratio / aspect_standard
-
-    # 5. 添加 Padding 补足长宽比
-    target_w = int(min(w * scale_ratio, h))
-    if target_w - w >0:
-        offset_w = (target_w - w) // 2
-
-        rgb = np.pad(
-            rgb,
-            ((0, 0), (offset_w, offset_w), (0, 0)),
-            mode="constant",
-            constant_values=255,
-        )
-
-        mask = np.pad(
-            mask,
-            ((0, 0), (offset_w, offset_w)),
-            mode="constant",
-            constant_values=0,
-        )
-    else:
-        target_h = w * aspect_standard
-        offset_h = int(target_h - h)
-
-        rgb = np.pad(
-            rgb,
-            ((offset_h, 0), (0, 0), (0, 0)),
-            mode="constant",
-            constant_values=255,
-        )
-
-        mask = np.pad(
-            mask,
-            ((offset_h, 0), (0, 0)),
-            mode="constant",
-            constant_values=0,
-        )
-
-    # 6. 归一化图像到 [0, 1]
-    rgb = rgb / 255.0  # normalize to [0, 1]
-    mask = mask / 255.0
-
-    # 7. 掩膜融合背景色
-    mask = (mask > 0.5).astype(np.float32)
-    rgb = rgb[:, :, :3] * mask[:, :, None] + bg_color * (1 - mask[:, :, None])
-
-    # 8. 缩放图像到最大输入尺寸
-    # resize to specific size require by preprocessor of smplx-estimator.
-    rgb = resize_image_keepaspect_np(rgb, max_tgt_size)
-    mask = resize_image_keepaspect_np(mask, max_tgt_size)
-
-    # 9. 根据 mask 居中裁剪以放大人物
-    # crop image to enlarge human area.
-
-    rgb, mask, offset_x, offset_y = center_crop_according_to_mask(
-        rgb, mask, aspect_standard, enlarge_ratio
-    )
-    if intr is not None:
-        intr[0, 2] -= offset_x
-        intr[1, 2] -= offset_y
-
-    # resize to render_tgt_size for training
-    # 11. 根据最终训练输入尺寸缩放
-    # 最终将图像缩放至 render_tgt_size，乘以 multiply 保证对齐。
-    # 计算出目标的渲染输入尺寸（H, W），并输出缩放比率 ratio_y, ratio_x，以便后续：
-    #     对图像和 mask 一起缩放
-    #     对相机内参进行等比例缩放（防止变形）
-    #     保证尺寸对齐网络要求（如 UNet、Transformer 等需要 16、32 倍数尺寸）
-    tgt_hw_size, ratio_y, ratio_x = calc_new_tgt_size_by_aspect(
-        cur_hw=rgb.shape[:2],  # 当前图像的高宽
-        aspect_standard=aspect_standard, # 标准长宽比，比如 5/3
-        tgt_size=render_tgt_size, # 最终目标尺寸（短边或长边的目标值
-        multiply=multiply, # 要对齐的倍数，例如 16 或 32
-    )
-
-    
-    rgb = cv2.resize(
-        rgb, dsize=(tgt_hw_size[1], tgt_hw_size[0]), interpolation=cv2.INTER_AREA
+    # 1. 读取图像
+    # rgb_path: image path, uint8 array or ImageContext, decoded once per request
+    rgb = ImageContext.wrap(rgb_path).raw
+
+    # crop, pad to aspect_standard, mask compositing and resize are fused into a single
+    # float32 pass over the final crop window, see preprocess_reference_image.
+    return preprocess_reference_image(
+        rgb,
+        mask,
+        intr,
+        bg_color=bg_color,
+        max_tgt_size=max_tgt_size,
+        aspect_standard=aspect_standard,
+        enlarge_ratio=enlarge_ratio,
+        render_tgt_size=render_tgt_size,
+        multiply=multiply,
     )
-    mask = cv2.resize(
-        mask, dsize=(tgt_hw_size[1], tgt_hw_size[0]), interpolation=cv2.INTER_AREA
-    )
-
-    # 12. 如果有内参，继续更新缩放与中心
-    if intr is not None:
-
-        # ******************** Merge *********************** #
-        intr = scale_intrs(intr, ratio_x=ratio_x, ratio_y=ratio_y)
-        assert (
-            abs(intr[0, 2] * 2 - rgb.shape[1]) < 2.5
-        ), f"{intr[0, 2] * 2}, {rgb.shape[1]}"
-        assert (
-            abs(intr[1, 2] * 2 - rgb.shape[0]) < 2.5
-        ), f"{intr[1, 2] * 2}, {rgb.shape[0]}"
-
-        # ******************** Merge *********************** #
-        intr[0, 2] = rgb.shape[1] // 2
-        intr[1, 2] = rgb.shape[0] // 2
-
-    rgb = torch.from_numpy(rgb).float().permute(2, 0, 1).unsqueeze(0)  # [1, 3, H, W]
-    mask = (
-        torch.from_numpy(mask[:, :, None]).float().permute(2, 0, 1).unsqueeze(0)
-    )  # [1, 1, H, W]
-    return rgb, mask, intr
 
 
 def parse_configs():
@@ -399,7 +279,7 @@ class HumanLRMInferrer(Inferrer):
     def __init__(self):
         super().__init__()
 
-        self.cfg, cfg_train = parse_configs()
+        self.cfg, self.cfg_train = parse_configs()
 
         configure_logger(
             stream_level=self.cfg.logger,
@@ -421,9 +301,116 @@ class HumanLRMInferrer(Inferrer):
         except:
             self.parsingnet = None 
 
+        configure_compile(
+            enabled=self.cfg.get("compile", True),
+            modules=self.cfg.get("compile_modules", None),
+            cache_dir=self.cfg.get("compile_cache_dir", None),
+        )
         self.model: ModelHumanLRM = self._build_model(self.cfg).to(self.device)
+        # keep only the cond_token_keep body tokens covering the most foreground, None keeps all
+        self.model.cond_token_keep = self.cfg.get("cond_token_keep", None)
+        self.model.cond_token_merge = self.cfg.get("cond_token_merge", False)
+        # overlap the head and body branches of the transformer blocks, same outputs as sequential.
+        # by default only when forward_latent_points runs eagerly: forced on with compile, the
+        # transformer leaves the compiled graph to keep the overlap
+        branch_overlap = self.cfg.get("transformer_branch_overlap", None)
+        if branch_overlap is None:
+            branch_overlap = not is_compile_enabled("forward_latent_points")
+        set_branch_overlap(self.model, branch_overlap)
+
+        # held by every GPU stage of infer_pipelined, one of them runs at a time
+        self.gpu_lock = threading.RLock()
+
+        self.motion_cache = MotionSeqCache(
+            max_bytes=self.cfg.get("motion_cache_bytes", 2 * 1024**3)
+        )
+
+        avatar_cache_dir = self.cfg.get("avatar_cache_dir", None)
+        self.avatar_cache = (
+            AvatarCache(avatar_cache_dir) if avatar_cache_dir is not None else None
+        )
+
+        # animation frames rendered at once, None picks the largest chunk fitting into the free memory
+        self.render_batch_size = self.cfg.get("render_batch_size", None)
+        self.render_memory = RenderMemoryModel(
+            self.device,
+            cache_dir=self.cfg.get("render_memory_dir", RENDER_MEMORY_DIR),
+            safety=self.cfg.get("render_memory_safety", 0.8),
+            max_chunk=self.cfg.get("render_max_chunk", 256),
+            # pose estimation and parsing of infer_pipelined share the device
+            lock=self.gpu_lock,
+        )
+
+        if self.cfg.get("compile", True) and self.cfg.get("compile_warmup", True):
+            self.warmup_compile()
+
+    def warmup_compile(self):
+        """compile the hot paths at startup instead of inside the first request.
+        compile_warmup_shapes: [[H, W], ...] reference resolutions, defaults to the one of source_size.
+        """
+        shapes = self.cfg.get("compile_warmup_shapes", None)
+        if shapes is None:
+            shapes = [
+                calc_new_tgt_size_by_aspect(
+                    cur_hw=(5, 3),
+                    aspect_standard=5.0 / 3,
+                    tgt_size=self.cfg.source_size,
+                    multiply=14,
+                )[0]
+            ]
+        # a second batch size lets dynamo mark the batch dimension as dynamic
+        batch_sizes = sorted({1, self.cfg.get("reconstruct_batch_size", 1)})
+        shape_param_dim = self.model.renderer.smplx_model.smpl_x.shape_param_dim
+
+        def run(shape):
+            batch_size, height, width, with_mask = shape
+            self.model.to(torch.float32)
+            self.model.infer_batch(
+                torch.ones(batch_size, 3, height, width, device=self.device),
+                torch.ones(
+                    batch_size,
+                    3,
+                    self.cfg.src_head_size,
+                    self.cfg.src_head_size,
+                    device=self.device,
+                ),
+                torch.zeros(batch_size, shape_param_dim, device=self.device),
+                fg_mask=(
+                    torch.ones(batch_size, 1, height, width, device=self.device)
+                    if with_mask
+                    else None
+                ),
+            )
+
+        # sapiens and dinov2_fusion are traced inline by a compiled forward_latent_points,
+        # they are graphs of their own only when it is not compiled
+        if is_compile_enabled("forward_latent_points"):
+            names = ("forward_latent_points",)
+        else:
+            names = ("sapiens", "dinov2_fusion")
+
+        # with and without a foreground mask: dynamo guards on fg_mask being None
+        warmup(
+            run,
+            [
+                (batch_size, height, width, with_mask)
+                for height, width in shapes
+                for batch_size in batch_sizes
+                for with_mask in (True, False)
+            ],
+            names=names,
+        )
 
-        self.motion_dict = dict()
+    def _avatar_cache_key(self, image_path):
+        config = dict(
+            model=self.cfg_train.get("model", None),
+            source_size=self.cfg.get("source_size", None),
+            src_head_size=self.cfg.get("src_head_size", None),
+            # pruned background tokens change the reconstruction
+            cond_token_keep=self.model.cond_token_keep,
+            cond_token_merge=self.model.cond_token_merge,
+        )
+        return self.avatar_cache.make_key(image_path, self.cfg.model_name, config)
 
     def _build_model(self, cfg):
         from LHM.models import model_dict
@@ -534,19 +521,22 @@ class HumanLRMInferrer(Inferrer):
                     gradio_codec=self.cfg.app_enabled,
                 )
 
-    def crop_face_image(self, image_path):
-        rgb = np.array(Image.open(image_path))
-        rgb = torch.from_numpy(rgb).permute(2, 0, 1)
+    def crop_face_image(self, image):
+        # image: path, uint8 array or ImageContext
+        rgb = ImageContext.wrap(image).chw
         bbox = self.facedetect(rgb)
         head_rgb = rgb[:, int(bbox[1]) : int(bbox[3]), int(bbox[0]) : int(bbox[2])]
         head_rgb = head_rgb.permute(1, 2, 0)
-        head_rgb = head_rgb.cpu().numpy()
+        head_rgb = np.ascontiguousarray(head_rgb.cpu().numpy())
         return head_rgb
 
     @torch.no_grad()
-    def parsing(self, img_path):
+    def parsing(self, image):
+        # image: path, uint8 RGB array or ImageContext
+        if isinstance(image, ImageContext):
+            image = image.rgb
 
-        parsing_out = self.parsingnet(img_path=img_path, bbox=None)
+        parsing_out = self.parsingnet(img_path=image, bbox=None)
 
         alpha = (parsing_out.masks * 255).astype(np.uint8)
 
@@ -558,16 +548,21 @@ class HumanLRMInferrer(Inferrer):
         dump_tmp_dir: str,  
         dump_mesh_dir: str,
         shape_param=None,
+        image_ctx=None,
     ):
 
         source_size = self.cfg.source_size
         aspect_standard = 5.0 / 3
 
-        parsing_mask = self.parsing(image_path)
+        # decode the reference image once for all the preprocessing stages
+        if image_ctx is None:
+            image_ctx = ImageContext(image_path)
+
+        parsing_mask = self.parsing(image_ctx)
 
         # prepare reference image
-        image, _, _ = infer_preprocess_image(
-            image_path,
+        image, mask, _ = infer_preprocess_image(
+            image_ctx,
             mask=parsing_mask,
             intr=None,
             pad_ratio=0,
@@ -581,7 +576,7 @@ class HumanLRMInferrer(Inferrer):
         )
         try:
             # 🧑‍🦱 4. 获取人脸图像
-            src_head_rgb = self.crop_face_image(image_path)
+            src_head_rgb = self.crop_face_image(image_ctx)
         except:
             print("w/o head input!")
             src_head_rgb = np.zeros((112, 112, 3), dtype=np.uint8)
@@ -612,7 +607,7 @@ class HumanLRMInferrer(Inferrer):
         )
         Image.fromarray(vis_ref_img).save(save_ref_img_path)
 
-        device = "cuda"
+        device = self.device
         dtype = torch.float32
         shape_param = torch.tensor(shape_param, dtype=dtype).unsqueeze(0)
 
@@ -643,68 +638,58 @@ class HumanLRMInferrer(Inferrer):
             smplx_params={
                 k: v.to(device) for k, v in smplx_params.items()
             },
+            fg_mask=mask.to(device, dtype),
         )
         smplx_params['transform_mat_neutral_pose'] = transform_mat_neutral_pose
 
         output_gs = self.model.animation_infer_gs(gs_app_model_list, query_points, smplx_params)
 
-        output_gs_path = '_'.join(os.path.basename(image_path).split('.')[:-1])+'.ply'
-
-        print(f"save mesh to {os.path.join(dump_mesh_dir, output_gs_path)}")
-        output_gs.save_ply(os.path.join(dump_mesh_dir, output_gs_path))
-
-
-    def infer_single(
-        self,
-        image_path: str,
-        motion_seqs_dir,
-        motion_img_dir,
-        motion_video_read_fps,
-        export_video: bool,
-        export_mesh: bool,
-        dump_tmp_dir: str,  # require by extracting motion seq from video, to save some results
-        dump_image_dir: str,
-        dump_video_path: str,
-        shape_param=None,
-    ):
-
-        source_size = self.cfg.source_size
-        render_size = self.cfg.render_size
-        # render_views = self.cfg.render_views
-        render_fps = self.cfg.render_fps
-        # mesh_size = self.cfg.mesh_size
-        # mesh_thres = self.cfg.mesh_thres
-        # frame_size = self.cfg.frame_size
-        # source_cam_dist = self.cfg.source_cam_dist if source_cam_dist is None else source_cam_dist
-        aspect_standard = 5.0 / 3
-        motion_img_need_mask = self.cfg.get("motion_img_need_mask", False)  # False
-        vis_motion = self.cfg.get("vis_motion", False)  # False
-
+        # ply, or the compact splat export (float16 / 8-bit quantized, see splat_io)
+        export_gs_format = self.cfg.get("export_gs_format", "ply")
+        output_gs_name = '_'.join(os.path.basename(image_path).split('.')[:-1])
 
+        if export_gs_format == "splat":
+            output_gs_path = os.path.join(dump_mesh_dir, output_gs_name + SPLAT_SUFFIX)
+            print(f"save mesh to {output_gs_path}")
+            output_gs.save_splat(
+                output_gs_path, quantize=self.cfg.get("export_gs_quantize", True)
+            )
+        else:
+            output_gs_path = os.path.join(dump_mesh_dir, output_gs_name + ".ply")
+            print(f"save mesh to {output_gs_path}")
+            output_gs.save_ply(output_gs_path)
+
+
+    def prepare_reference(self, image_ctx):
+        """
+        Returns:
+            image: [1, 3, H, W] preprocessed reference image, 0-1
+            src_head_rgb: [1, 3, src_head_size, src_head_size], 0-1
+            vis_ref_img: uint8 [H, W, 3] preview of image
+            mask: [1, 1, H, W] foreground mask of image, 0-1
+        """
         if self.parsingnet is not None:
-            parsing_mask = self.parsing(image_path)
+            parsing_mask = self.parsing(image_ctx)
         else:
-            img_np = cv2.imread(image_path)
-            remove_np = remove(img_np)
+            remove_np = remove(image_ctx.bgr)
             parsing_mask = remove_np[...,3]
-        
 
         # prepare reference image
-        image, _, _ = infer_preprocess_image(
-            image_path,
+        image, mask, _ = infer_preprocess_image(
+            image_ctx,
             mask=parsing_mask,
             intr=None,
             pad_ratio=0,
             bg_color=1.0,
             max_tgt_size=896,
-            aspect_standard=aspect_standard,
+            aspect_standard=5.0 / 3,
             enlarge_ratio=[1.0, 1.0],
-            render_tgt_size=source_size,
+            render_tgt_size=self.cfg.source_size,
             multiply=14,
             need_mask=True,
         )
         try:
-            src_head_rgb = self.crop_face_image(image_path)
+            src_head_rgb = self.crop_face_image(image_ctx)
         except:
             print("w/o head input!")
             src_head_rgb = np.zeros((112, 112, 3), dtype=np.uint8)
@@ -726,46 +711,136 @@ class HumanLRMInferrer(Inferrer):
             torch.from_numpy(src_head_rgb / 255.0).float().permute(2, 0, 1).unsqueeze(0)
         )  # [1, 3, H, W]
 
-        # save masked image for vis
-        save_ref_img_path = os.path.join(
-            dump_tmp_dir, "refer_" + os.path.basename(image_path)
-        )
         vis_ref_img = (image[0].permute(1, 2, 0).cpu().detach().numpy() * 255).astype(
             np.uint8
         )
-        Image.fromarray(vis_ref_img).save(save_ref_img_path)
+        return image, src_head_rgb, vis_ref_img, mask
 
-        # read motion seq
+    def load_cached_avatar(self, image_path):
+        if self.avatar_cache is None:
+            return None
+        return self.avatar_cache.load(
+            self._avatar_cache_key(image_path), device=self.device
+        )
 
-        motion_name = os.path.dirname(
-            motion_seqs_dir[:-1] if motion_seqs_dir[-1] == "/" else motion_seqs_dir
+    def reconstruct_references(self, image_paths, references, shape_param_list):
+        """reconstruct a group of references (from prepare_reference) with one forward of the model.
+        Returns:
+            list of avatar dicts, the same layout as AvatarCache.load.
+        """
+        device = self.device
+        dtype = torch.float32
+
+        betas = torch.stack(
+            [torch.as_tensor(shape_param, dtype=dtype) for shape_param in shape_param_list]
+        ).to(device)
+
+        self.model.to(dtype)
+        results = self.model.infer_batch(
+            torch.cat([image for image, _, _, _ in references]).to(device, dtype),
+            torch.cat([src_head_rgb for _, src_head_rgb, _, _ in references]).to(
+                device, dtype
+            ),
+            betas,
+            fg_mask=torch.cat([mask for _, _, _, mask in references]).to(device, dtype),
         )
-        motion_name = os.path.basename(motion_name)
 
-        if motion_name in self.motion_dict:
-            motion_seq = self.motion_dict[motion_name]
-        else:
-            # 🧪 5. 构建 SMPL 参数与运动序列
-                # 加载 SMPL 动作序列和相机轨迹（如某段视频对应的SMPL参数）；
-                # 每一帧动作都包含 smplx_params、render_c2ws（外参）、render_intrs（内参）等。
-            motion_seq = prepare_motion_seqs(
-                motion_seqs_dir,
-                motion_img_dir,
-                save_root=dump_tmp_dir,
-                fps=motion_video_read_fps,
-                bg_color=1.0,
-                aspect_standard=aspect_standard,
-                enlarge_ratio=[1.0, 1, 0],
-                render_image_res=render_size,
-                multiply=16,
-                need_mask=motion_img_need_mask,
-                vis_motion=vis_motion,
+        avatars = []
+        for image_path, (_, _, vis_ref_img, _), result, beta in zip(
+            image_paths, references, results, betas
+        ):
+            gs_model_list, query_points, transform_mat_neutral_pose = result
+            if self.avatar_cache is not None:
+                self.avatar_cache.save(
+                    self._avatar_cache_key(image_path),
+                    gs_model_list,
+                    query_points,
+                    transform_mat_neutral_pose,
+                    beta.unsqueeze(0),
+                    ref_image=vis_ref_img,
+                )
+            avatars.append(
+                dict(
+                    gs_model_list=gs_model_list,
+                    query_points=query_points,
+                    transform_mat_neutral_pose=transform_mat_neutral_pose,
+                    betas=beta.unsqueeze(0),
+                    ref_image=vis_ref_img,
+                )
+            )
+        return avatars
+
+    def reconstruct_batch(self, image_paths, image_ctx_list, shape_param_list):
+        """reconstruct a group of reference images with one forward of the model.
+        cached avatars are reused, only the misses are preprocessed and reconstructed.
+        """
+        avatars = [self.load_cached_avatar(image_path) for image_path in image_paths]
+
+        todo = [i for i, avatar in enumerate(avatars) if avatar is None]
+        if len(todo) > 0:
+            results = self.reconstruct_references(
+                [image_paths[i] for i in todo],
+                [self.prepare_reference(image_ctx_list[i]) for i in todo],
+                [shape_param_list[i] for i in todo],
             )
-            self.motion_dict[motion_name] = motion_seq
+            for i, avatar in zip(todo, results):
+                avatars[i] = avatar
+        return avatars
 
-        camera_size = len(motion_seq["motion_seqs"])
+    def infer_single(
+        self,
+        image_path: str,
+        motion_seqs_dir,
+        motion_img_dir,
+        motion_video_read_fps,
+        export_video: bool,
+        export_mesh: bool,
+        dump_tmp_dir: str,  # require by extracting motion seq from video, to save some results
+        dump_image_dir: str,
+        dump_video_path: str,
+        shape_param=None,
+        image_ctx=None,
+        avatar=None,
+    ):
+        """avatar: optional avatar from reconstruct_batch, only the animation is run then."""
+
+        # render_views = self.cfg.render_views
+        render_fps = self.cfg.render_fps
+        # mesh_size = self.cfg.mesh_size
+        # mesh_thres = self.cfg.mesh_thres
+        # frame_size = self.cfg.frame_size
+        # source_cam_dist = self.cfg.source_cam_dist if source_cam_dist is None else source_cam_dist
+
+        # re-animating a cached avatar skips parsing, preprocessing and reconstruction
+        if avatar is None and self.avatar_cache is not None:
+            avatar_key = self._avatar_cache_key(image_path)
+            avatar = self.avatar_cache.load(avatar_key, device=self.device)
+
+        if avatar is None:
+            # decode the reference image once for all the preprocessing stages
+            if image_ctx is None:
+                image_ctx = ImageContext(image_path)
+            image, src_head_rgb, vis_ref_img, mask = self.prepare_reference(image_ctx)
+        else:
+            vis_ref_img = avatar["ref_image"]
+
+        # save masked image for vis
+        save_ref_img_path = os.path.join(
+            dump_tmp_dir, "refer_" + os.path.basename(image_path)
+        )
+        if vis_ref_img is not None:
+            Image.fromarray(vis_ref_img).save(save_ref_img_path)
+
+        # read motion seq
 
-        device = "cuda"
+        # 🧪 5. 构建 SMPL 参数与运动序列
+            # 加载 SMPL 动作序列和相机轨迹（如某段视频对应的SMPL参数）；
+            # 每一帧动作都包含 smplx_params、render_c2ws（外参）、render_intrs（内参）等。
+        motion_seq = self.load_motion_seq(
+            motion_seqs_dir, motion_img_dir, motion_video_read_fps, dump_tmp_dir
+        )
+
+        device = self.device
         dtype = torch.float32
         shape_param = torch.tensor(shape_param, dtype=dtype).unsqueeze(0)
 
@@ -778,71 +853,173 @@ class HumanLRMInferrer(Inferrer):
         # 模型从单张图像中构建高斯人像模型（可变形 3D Gaussian Splatting）；
         # 同时获取与SMPL对齐的查询点和标准姿态转换矩阵。
         # LHM/models/modeling_human_lrm.py
-        gs_model_list, query_points, transform_mat_neutral_pose = self.model.infer_single_view(
-            image.unsqueeze(0).to(device, dtype),
-            src_head_rgb.unsqueeze(0).to(device, dtype),
-            None,
-            None,
-            render_c2ws=motion_seq["render_c2ws"].to(device),
-            render_intrs=motion_seq["render_intrs"].to(device),
-            render_bg_colors=motion_seq["render_bg_colors"].to(device),
-            smplx_params={
-                k: v.to(device) for k, v in smplx_params.items()
+        if avatar is None:
+            gs_model_list, query_points, transform_mat_neutral_pose = self.model.infer_single_view(
+                image.unsqueeze(0).to(device, dtype),
+                src_head_rgb.unsqueeze(0).to(device, dtype),
+                None,
+                None,
+                render_c2ws=motion_seq["render_c2ws"].to(device),
+                render_intrs=motion_seq["render_intrs"].to(device),
+                render_bg_colors=motion_seq["render_bg_colors"].to(device),
+                smplx_params={
+                    k: v.to(device) for k, v in smplx_params.items()
+                },
+                fg_mask=mask.to(device, dtype),
+            )
+            if self.avatar_cache is not None:
+                self.avatar_cache.save(
+                    avatar_key,
+                    gs_model_list,
+                    query_points,
+                    transform_mat_neutral_pose,
+                    shape_param,
+                    ref_image=vis_ref_img,
+                )
+            avatar = dict(
+                gs_model_list=gs_model_list,
+                query_points=query_points,
+                transform_mat_neutral_pose=transform_mat_neutral_pose,
+                betas=shape_param,
+            )
+        # a given or cached avatar keeps the betas it was reconstructed with
+
+        # frames are encoded batch by batch, the whole sequence is never held in memory
+        print(f"save video to {dump_video_path}")
+        with VideoWriter(dump_video_path, fps=render_fps, verbose=True) as video_writer:
+            self.animate(avatar, motion_seq, video_writer, self.render_batch_size)
+
+    def load_motion_seq(
+        self, motion_seqs_dir, motion_img_dir, motion_video_read_fps, dump_tmp_dir
+    ):
+        motion_seq = self.motion_cache.get(
+            motion_seqs_dir,
+            motion_img_dir,
+            save_root=dump_tmp_dir,
+            fps=motion_video_read_fps,
+            bg_color=1.0,
+            aspect_standard=5.0 / 3,
+            enlarge_ratio=[1.0, 1, 0],
+            render_image_res=self.cfg.render_size,
+            multiply=16,
+            need_mask=self.cfg.get("motion_img_need_mask", False),
+            vis_motion=self.cfg.get("vis_motion", False),
+        )
+        logger.debug(f"motion cache: {self.motion_cache.stats()}")
+        return motion_seq
+
+    def animate(self, avatar, motion_seq, video_writer, batch_size=None):
+        """render avatar (see reconstruct_batch) along motion_seq and write the frames to video_writer.
+        batch_size: frames rendered per animation_infer call, None sizes the chunks by the free memory (see RenderMemoryModel).
+        """
+        device = self.device
+        gs_model_list = avatar["gs_model_list"]
+        query_points = avatar["query_points"]
+        transform_mat_neutral_pose = avatar["transform_mat_neutral_pose"]
+        shape_param = avatar["betas"]
+        camera_size = len(motion_seq["motion_seqs"])
+
+        # optional render-time compaction: drop near-transparent gaussians and merge them
+        # within render_lod_voxel_size, so that skinning and rasterization only see the kept subset
+        point_index_list = None
+        render_prune_opacity = self.cfg.get("render_prune_opacity", 0.0)
+        render_lod_voxel_size = self.cfg.get("render_lod_voxel_size", 0.0)
+        if render_prune_opacity > 0 or render_lod_voxel_size > 0:
+            num_points = gs_model_list[0].offset_xyz.shape[0]
+            gs_model_list, query_points, point_index_list = self.model.compact_gs_model(
+                gs_model_list,
+                query_points,
+                opacity_threshold=render_prune_opacity,
+                min_scale=self.cfg.get("render_prune_min_scale", 0.0),
+                voxel_size=render_lod_voxel_size,
+            )
+            logger.info(
+                f"render {gs_model_list[0].offset_xyz.shape[0]} of {num_points} gaussians"
+            )
+
+        # pose-independent skinning is shared by every batch of the sequence
+        neutral_pose_cache_list = self.model.build_neutral_pose_cache(
+            gs_model_list,
+            query_points,
+            {
+                "betas": shape_param.to(device),
+                "transform_mat_neutral_pose": transform_mat_neutral_pose,
             },
+            point_index_list=point_index_list,
         )
+        assert (
+            point_index_list is None or neutral_pose_cache_list is not None
+        ), "gaussian compaction requires the neutral pose cache of the voxel skinning model"
 
-        batch_list = [] 
-        batch_size = 40  # avoid memeory out!
-        
 # 🎞️ 7. 执行动画合成（遍历每个动作帧）
         # 将 gs_model_list 和 SMPL 动作参数作为输入，执行可变形高斯体渲染，得到每一帧的合成图像；
         
         # 输出中含有 comp_rgb（RGB图）、comp_mask（alpha）等；
         
         # 多次 batch 推理避免显存溢出。
-        for batch_i in range(0, camera_size, batch_size):
-            with torch.no_grad():
-                # TODO check device and dtype
-                # dict_keys(['comp_rgb', 'comp_rgb_bg', 'comp_mask', 'comp_depth', '3dgs'])
-
-                print(f"batch: {batch_i}, total: {camera_size //batch_size +1} ")
-
-                keys = [
-                    "root_pose",
-                    "body_pose",
-                    "jaw_pose",
-                    "leye_pose",
-                    "reye_pose",
-                    "lhand_pose",
-                    "rhand_pose",
-                    "trans",
-                    "focal",
-                    "princpt",
-                    "img_size_wh",
-                    "expr",
-                ]
+        keys = [
+            "root_pose",
+            "body_pose",
+            "jaw_pose",
+            "leye_pose",
+            "reye_pose",
+            "lhand_pose",
+            "rhand_pose",
+            "trans",
+            "focal",
+            "princpt",
+            "img_size_wh",
+            "expr",
+        ]
+
+        @torch.no_grad()
+        def render(batch_i, batch_end):
+            # TODO check device and dtype
+            # dict_keys(['comp_rgb', 'comp_rgb_bg', 'comp_mask', 'comp_depth', '3dgs'])
+            batch_smplx_params = dict()
+            batch_smplx_params["betas"] = shape_param.to(device)
+            batch_smplx_params['transform_mat_neutral_pose'] = transform_mat_neutral_pose
+            for key in keys:
+                batch_smplx_params[key] = motion_seq["smplx_params"][key][
+                    :, batch_i:batch_end
+                ].to(device)
+
+            # def animation_infer(self, gs_model_list, query_points, smplx_params, render_c2ws, render_intrs, render_bg_colors, render_h, render_w):
+            return self.model.animation_infer(gs_model_list, query_points, batch_smplx_params,
+                render_c2ws=motion_seq["render_c2ws"][
+                    :, batch_i:batch_end
+                ].to(device),
+                render_intrs=motion_seq["render_intrs"][
+                    :, batch_i:batch_end
+                ].to(device),
+                render_bg_colors=motion_seq["render_bg_colors"][
+                    :, batch_i:batch_end
+                ].to(device),
+                neutral_pose_cache_list=neutral_pose_cache_list,
+                )
 
+        if batch_size is None:
+            render_intrs = motion_seq["render_intrs"]
+            chunks = self.render_memory.render(
+                camera_size,
+                render,
+                num_gaussians=gs_model_list[0].offset_xyz.shape[0],
+                height=int(render_intrs[0, 0, 1, 2] * 2),
+                width=int(render_intrs[0, 0, 0, 2] * 2),
+                dtype=gs_model_list[0].offset_xyz.dtype,
+            )
+        else:
+            chunks = (
+                (
+                    batch_i,
+                    min(batch_i + batch_size, camera_size),
+                    render(batch_i, min(batch_i + batch_size, camera_size)),
+                )
+                for batch_i in range(0, camera_size, batch_size)
+            )
 
-                batch_smplx_params = dict()
-                batch_smplx_params["betas"] = shape_param.to(device)
-                batch_smplx_params['transform_mat_neutral_pose'] = transform_mat_neutral_pose
-                for key in keys:
-                    batch_smplx_params[key] = motion_seq["smplx_params"][key][
-                        :, batch_i : batch_i + batch_size
-                    ].to(device)
-
-                # def animation_infer(self, gs_model_list, query_points, smplx_params, render_c2ws, render_intrs, render_bg_colors, render_h, render_w):
-                res = self.model.animation_infer(gs_model_list, query_points, batch_smplx_params,
-                    render_c2ws=motion_seq["render_c2ws"][
-                        :, batch_i : batch_i + batch_size
-                    ].to(device),
-                    render_intrs=motion_seq["render_intrs"][
-                        :, batch_i : batch_i + batch_size
-                    ].to(device),
-                    render_bg_colors=motion_seq["render_bg_colors"][
-                        :, batch_i : batch_i + batch_size
-                    ].to(device),
-                    )
+        for batch_i, batch_end, res in chunks:
+            print(f"batch: {batch_i}-{batch_end}, total: {camera_size}")
 
             comp_rgb = res["comp_rgb"] # [Nv, H, W, 3], 0-1
             comp_mask = res["comp_mask"] # [Nv, H, W, 3], 0-1
@@ -851,25 +1028,9 @@ class HumanLRMInferrer(Inferrer):
 
             batch_rgb = comp_rgb * comp_mask + (1 - comp_mask) * 1
             batch_rgb = (batch_rgb.clamp(0,1) * 255).to(torch.uint8).detach().cpu().numpy()
-            batch_list.append(batch_rgb)
+            video_writer.write(batch_rgb)
 
-            del res
-            torch.cuda.empty_cache()
-        
-        rgb = np.concatenate(batch_list, axis=0)
-
-        os.makedirs(os.path.dirname(dump_video_path), exist_ok=True)
-
-        print(f"save video to {dump_video_path}")
-
-
-        images_to_video(
-            rgb,
-            output_path=dump_video_path,
-            fps=render_fps,
-            gradio_codec=False,
-            verbose=True,
-        )
+            del res, comp_rgb, comp_mask
 
     def infer(self):
 
@@ -892,45 +1053,26 @@ class HumanLRMInferrer(Inferrer):
         ]
 
 
-        for image_path in tqdm(image_paths,
-            disable=not self.accelerator.is_local_main_process,
-        ):
+        # images are reconstructed reconstruct_batch_size at a time, then animated one by one
+        reconstruct_batch_size = self.cfg.get("reconstruct_batch_size", 1)
+        # depth of the queues between the pipeline stages, 0 runs the images one after another
+        pipeline_queue_size = self.cfg.get("pipeline_queue_size", 2)
 
-            # prepare dump paths
-            image_name = os.path.basename(image_path)
-            uid = image_name.split(".")[0]
-            subdir_path = os.path.dirname(image_path).replace(omit_prefix, "")
-            subdir_path = (
-                subdir_path[1:] if subdir_path.startswith("/") else subdir_path
+        if self.cfg.export_mesh is None and pipeline_queue_size > 0:
+            self.infer_pipelined(
+                image_paths, omit_prefix, reconstruct_batch_size, pipeline_queue_size
             )
-            print("subdir_path and uid:", subdir_path, uid)
+            return
 
-            # setting config
-            motion_seqs_dir = self.cfg.motion_seqs_dir
-            motion_name = os.path.dirname(
-                motion_seqs_dir[:-1] if motion_seqs_dir[-1] == "/" else motion_seqs_dir
-            )
-            motion_name = os.path.basename(motion_name)
-            dump_video_path = os.path.join(
-                self.cfg.video_dump,
-                subdir_path,
-                motion_name,
-                f"{uid}.mp4",
-            )
-            dump_image_dir = os.path.join(
-                self.cfg.image_dump,
-                subdir_path,
-            )
-            dump_mesh_dir = os.path.join(
-                self.cfg.mesh_dump,
-                subdir_path,
-            )
-            dump_tmp_dir = os.path.join(self.cfg.image_dump, subdir_path, "tmp_res")
-            os.makedirs(dump_image_dir, exist_ok=True)
-            os.makedirs(dump_tmp_dir, exist_ok=True)
-            os.makedirs(dump_mesh_dir, exist_ok=True)
+        pending = []
+        for image_path in tqdm(image_paths,
+            disable=not self.accelerator.is_local_main_process,
+        ):
+            dump_paths = self._dump_paths(image_path, omit_prefix)
 
-            shape_pose = self.pose_estimator(image_path)
+            # decoded once, shared by pose estimation and reconstruction
+            image_ctx = ImageContext(image_path)
+            shape_pose = self.pose_estimator(image_ctx.rgb)
 
             try:
                 assert shape_pose.ratio>0.4, f"body ratio is too small: {shape_pose.ratio}"
@@ -940,23 +1082,199 @@ class HumanLRMInferrer(Inferrer):
             if self.cfg.export_mesh is not None:
                 self.infer_mesh(
                     image_path,
-                    dump_tmp_dir=dump_tmp_dir,
-                    dump_mesh_dir=dump_mesh_dir,
+                    dump_tmp_dir=dump_paths["dump_tmp_dir"],
+                    dump_mesh_dir=dump_paths["dump_mesh_dir"],
                     shape_param=shape_pose.beta,
+                    image_ctx=image_ctx,
                 )
             else:
-                self.infer_single(
-                    image_path,
-                    motion_seqs_dir=self.cfg.motion_seqs_dir,
-                    motion_img_dir=self.cfg.motion_img_dir,
-                    motion_video_read_fps=self.cfg.motion_video_read_fps,
-                    export_video=self.cfg.export_video,
-                    export_mesh=self.cfg.export_mesh,
-                    dump_tmp_dir=dump_tmp_dir,
-                    dump_image_dir=dump_image_dir,
-                    dump_video_path=dump_video_path,
-                    shape_param=shape_pose.beta,
+                pending.append(
+                    dict(
+                        image_path=image_path,
+                        shape_param=shape_pose.beta,
+                        image_ctx=image_ctx,
+                        **dump_paths,
+                    )
                 )
+                if len(pending) >= reconstruct_batch_size:
+                    self.infer_group(pending)
+                    pending = []
+
+        if len(pending) > 0:
+            self.infer_group(pending)
+
+    def _dump_paths(self, image_path, omit_prefix):
+        # prepare dump paths
+        image_name = os.path.basename(image_path)
+        uid = image_name.split(".")[0]
+        subdir_path = os.path.dirname(image_path).replace(omit_prefix, "")
+        subdir_path = (
+            subdir_path[1:] if subdir_path.startswith("/") else subdir_path
+        )
+        print("subdir_path and uid:", subdir_path, uid)
+
+        # setting config
+        motion_seqs_dir = self.cfg.motion_seqs_dir
+        motion_name = os.path.dirname(
+            motion_seqs_dir[:-1] if motion_seqs_dir[-1] == "/" else motion_seqs_dir
+        )
+        motion_name = os.path.basename(motion_name)
+        dump_video_path = os.path.join(
+            self.cfg.video_dump,
+            subdir_path,
+            motion_name,
+            f"{uid}.mp4",
+        )
+        dump_image_dir = os.path.join(
+            self.cfg.image_dump,
+            subdir_path,
+        )
+        dump_mesh_dir = os.path.join(
+            self.cfg.mesh_dump,
+            subdir_path,
+        )
+        dump_tmp_dir = os.path.join(self.cfg.image_dump, subdir_path, "tmp_res")
+        os.makedirs(dump_image_dir, exist_ok=True)
+        os.makedirs(dump_tmp_dir, exist_ok=True)
+        os.makedirs(dump_mesh_dir, exist_ok=True)
+
+        return dict(
+            dump_video_path=dump_video_path,
+            dump_image_dir=dump_image_dir,
+            dump_mesh_dir=dump_mesh_dir,
+            dump_tmp_dir=dump_tmp_dir,
+        )
+
+    def infer_pipelined(
+        self, image_paths, omit_prefix, reconstruct_batch_size, queue_size
+    ):
+        """folder inference as a staged pipeline:
+            load -> pose -> preprocess -> reconstruct -> animate -> dump
+        decoding, motion loading, PNG dumps and video encoding run in worker threads and overlap
+        with the GPU stages of the neighbouring images. The GPU stages (pose estimation, parsing and
+        face detection, reconstruction, animation) hold gpu_lock, so they never run at the same time
+        and the activations peak as in the sequential loop. The reconstructed avatars waiting for
+        animation stay on the GPU, up to queue_size + reconstruct_batch_size of them.
+        """
+        io_workers = self.cfg.get("pipeline_io_workers", 2)
+        progress = tqdm(
+            total=len(image_paths),
+            disable=not self.accelerator.is_local_main_process,
+        )
+
+        def load(image_path):
+            job = dict(image_path=image_path, **self._dump_paths(image_path, omit_prefix))
+            job["image_ctx"] = ImageContext(image_path)
+            return job
+
+        def pose(job):
+            with self.gpu_lock:
+                shape_pose = self.pose_estimator(job["image_ctx"].rgb)
+            if shape_pose.ratio <= 0.4:
+                logger.info(f"body ratio is too small: {shape_pose.ratio}, skip {job['image_path']}")
+                progress.update(1)
+                return None
+            job["shape_param"] = shape_pose.beta
+            return job
+
+        def preprocess(job):
+            with self.gpu_lock:
+                job["avatar"] = self.load_cached_avatar(job["image_path"])
+                if job["avatar"] is None:
+                    job["reference"] = self.prepare_reference(job["image_ctx"])
+            job.pop("image_ctx")
+            return job
+
+        def reconstruct(jobs):
+            todo = [job for job in jobs if job["avatar"] is None]
+            if len(todo) > 0:
+                with self.gpu_lock:
+                    avatars = self.reconstruct_references(
+                        [job["image_path"] for job in todo],
+                        [job.pop("reference") for job in todo],
+                        [job["shape_param"] for job in todo],
+                    )
+                for job, avatar in zip(todo, avatars):
+                    job["avatar"] = avatar
+            return jobs
+
+        def animate(job):
+            motion_seq = self.load_motion_seq(
+                self.cfg.motion_seqs_dir,
+                self.cfg.motion_img_dir,
+                self.cfg.motion_video_read_fps,
+                job["dump_tmp_dir"],
+            )
+            # frames are encoded by the writer thread, the dump stage waits for it
+            video_writer = VideoWriter(
+                job["dump_video_path"],
+                fps=self.cfg.render_fps,
+                verbose=True,
+                queue_size=queue_size,
+            ).open()
+            try:
+                with self.gpu_lock:
+                    self.animate(
+                        job["avatar"], motion_seq, video_writer, self.render_batch_size
+                    )
+            except:
+                video_writer.abort()
+                raise
+            job["video_writer"] = video_writer
+            job["ref_image"] = job.pop("avatar")["ref_image"]
+            return job
+
+        def dump(job):
+            if job["ref_image"] is not None:
+                save_ref_img_path = os.path.join(
+                    job["dump_tmp_dir"], "refer_" + os.path.basename(job["image_path"])
+                )
+                Image.fromarray(job["ref_image"]).save(save_ref_img_path)
+            job["video_writer"].close()
+            progress.update(1)
+            return None
+
+        pipeline = StagedPipeline(
+            [
+                Stage("load", load, num_workers=io_workers),
+                Stage("pose", pose),
+                Stage("preprocess", preprocess),
+                Stage("reconstruct", reconstruct, batch_size=reconstruct_batch_size),
+                Stage("animate", animate),
+                Stage("dump", dump, num_workers=io_workers),
+            ],
+            queue_size=queue_size,
+        )
+        try:
+            pipeline.run(image_paths)
+        finally:
+            progress.close()
+
+    def infer_group(self, jobs):
+        """reconstruct the reference images of jobs in one batch, then animate each of them."""
+        avatars = [None] * len(jobs)
+        if len(jobs) > 1:
+            avatars = self.reconstruct_batch(
+                [job["image_path"] for job in jobs],
+                [job["image_ctx"] for job in jobs],
+                [job["shape_param"] for job in jobs],
+            )
+
+        for job, avatar in zip(jobs, avatars):
+            self.infer_single(
+                job["image_path"],
+                motion_seqs_dir=self.cfg.motion_seqs_dir,
+                motion_img_dir=self.cfg.motion_img_dir,
+                motion_video_read_fps=self.cfg.motion_video_read_fps,
+                export_video=self.cfg.export_video,
+                export_mesh=self.cfg.export_mesh,
+                dump_tmp_dir=job["dump_tmp_dir"],
+                dump_image_dir=job["dump_image_dir"],
+                dump_video_path=job["dump_video_path"],
+                shape_param=job["shape_param"],
+                image_ctx=job["image_ctx"],
+                avatar=avatar,
+            )
 
 
 @REGISTRY_RUNNERS.register("infer.human_lrm_video")
@@ -1004,7 +1322,8 @@ class HumanLRMVideoInferrer(HumanLRMInferrer):
         vis_motion = self.cfg.get("vis_motion", False)  # False
 
         # 🧍 2. 获取人体 Mask
-        parsing_mask = self.parsing(image_path)
+        image_ctx = ImageContext(image_path)
+        parsing_mask = self.parsing(image_ctx)
 
         save_dir = os.path.join(dump_image_dir, "rgb")
         if os.path.exists(save_dir):
@@ -1013,8 +1332,8 @@ class HumanLRMVideoInferrer(HumanLRMInferrer):
         
         # prepare reference image
         # 🖼️ 3. 图像预处理（遮罩裁剪、对齐、缩放）
-        image, _, _ = infer_preprocess_image(
-            image_path,
+        image, mask, _ = infer_preprocess_image(
+            image_ctx,
             mask=parsing_mask,
             intr=None,
             pad_ratio=0,
@@ -1026,7 +1345,7 @@ class HumanLRMVideoInferrer(HumanLRMInferrer):
             multiply=14,
             need_mask=True,
         )
-        src_head_rgb = self.crop_face_image(image_path)
+        src_head_rgb = self.crop_face_image(image_ctx)
 
 
         try:
@@ -1074,7 +1393,7 @@ class HumanLRMVideoInferrer(HumanLRMInferrer):
         )
         motion_seqs = motion_seq["motion_seqs"]
 
-        device = "cuda"
+        device = self.device
         dtype = torch.float32
         self.model.to(dtype)
 
@@ -1102,6 +1421,7 @@ class HumanLRMVideoInferrer(HumanLRMInferrer):
                 smplx_params={
                     k: v.to(device) for k, v in motion_seq["smplx_params"].items()
                 },
+                fg_mask=mask.to(device, dtype),
             )
 
         rgb = res["comp_rgb"].detach().cpu().numpy()  # [Nv, H, W, 3], 0-1
@@ -10,7 +10,8 @@ import json
 import math
 import os
 import pdb
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict
 
 import cv2
 import decord
@@ -20,6 +21,9 @@ from PIL import Image
 from pytorch3d.io import save_ply
 from pytorch3d.transforms import axis_angle_to_matrix, matrix_to_axis_angle
 
+from engine.pose_estimation.motion_pack import find_motion_pack, load_motion_pack
+from engine.SegmentAPI.base import Bbox
+
 
 def generate_rotation_matrix_y(degrees):
     theta = math.radians(degrees)
@@ -170,6 +174,170 @@ def center_crop_according_to_mask(img, mask, aspect_standard, enlarge_ratio):
     return new_img, new_mask, offset_x, offset_y
 
 
+def plan_reference_crop(
+    mask, aspect_standard, max_tgt_size, enlarge_ratio, render_tgt_size, multiply
+):
+    """
+    Geometry of the reference image preprocess computed on the mask only:
+    crop to the person bbox -> pad to aspect_standard -> resize to max_tgt_size
+    -> center_crop_according_to_mask -> resize to the render size.
+
+    Args:
+        mask: uint8 [H, W], foreground >= 128.
+    Returns:
+        dict with
+            bbox: (l, t, r, b) person crop in the raw image.
+            pad: (pad_top, pad_left) of the person crop in the padded canvas.
+            window: (x0, y0, x1, y1) final crop in canvas pixels.
+            offset: (offset_x, offset_y) final crop in the max_tgt_size canvas.
+            tgt_hw: final (H, W), ratio: (ratio_y, ratio_x) for the intrinsics.
+    """
+    fg = mask >= 128
+    rows = np.flatnonzero(fg.any(axis=1))
+    cols = np.flatnonzero(fg.any(axis=0))
+    if len(rows) == 0:
+        raise Exception("empty mask")
+
+    height, width = mask.shape
+    l, t, r, b = (
+        Bbox([cols[0], rows[0], cols[-1], rows[-1]])
+        .scale(1.1, width=width, height=height)
+        .get_box()
+    )
+
+    # pad to aspect_standard
+    h, w = b - t, r - l
+    assert w < h
+    scale_ratio = h / w / aspect_standard
+    target_w = int(min(w * scale_ratio, h))
+    if target_w - w > 0:
+        offset_w = (target_w - w) // 2
+        pad_top, pad_left = 0, offset_w
+        canvas_h, canvas_w = h, w + 2 * offset_w
+    else:
+        offset_h = int(w * aspect_standard - h)
+        pad_top, pad_left = offset_h, 0
+        canvas_h, canvas_w = h + offset_h, w
+
+    # the enlarged crop is searched at max_tgt_size as before, on the mask only
+    canvas_mask = np.zeros((canvas_h, canvas_w), dtype=np.float32)
+    canvas_mask[pad_top : pad_top + h, pad_left : pad_left + w] = fg[t:b, l:r]
+    small_mask = resize_image_keepaspect_np(canvas_mask, max_tgt_size)
+    small_crop, _, offset_x, offset_y = center_crop_according_to_mask(
+        small_mask, small_mask, aspect_standard, enlarge_ratio
+    )
+    crop_h, crop_w = small_crop.shape[:2]
+    tgt_hw, ratio_y, ratio_x = calc_new_tgt_size_by_aspect(
+        cur_hw=(crop_h, crop_w),
+        aspect_standard=aspect_standard,
+        tgt_size=render_tgt_size,
+        multiply=multiply,
+    )
+
+    # back to canvas pixels, so that the image itself is resized only once
+    scale_y = canvas_h / small_mask.shape[0]
+    scale_x = canvas_w / small_mask.shape[1]
+    window = (
+        max(0, round(offset_x * scale_x)),
+        max(0, round(offset_y * scale_y)),
+        min(canvas_w, round((offset_x + crop_w) * scale_x)),
+        min(canvas_h, round((offset_y + crop_h) * scale_y)),
+    )
+
+    return dict(
+        bbox=(l, t, r, b),
+        pad=(pad_top, pad_left),
+        window=window,
+        offset=(offset_x, offset_y),
+        tgt_hw=tuple(tgt_hw),
+        ratio=(ratio_y, ratio_x),
+    )
+
+
+def _reference_crop_slices(plan):
+    """(src, dst) slices of the person crop inside the final window, None if they do not overlap."""
+    x0, y0, x1, y1 = plan["window"]
+    l, t, r, b = plan["bbox"]
+    pad_top, pad_left = plan["pad"]
+
+    cy0, cy1 = max(y0, pad_top), min(y1, pad_top + b - t)
+    cx0, cx1 = max(x0, pad_left), min(x1, pad_left + r - l)
+    if cy1 <= cy0 or cx1 <= cx0:
+        return None
+
+    src = (
+        slice(cy0 - pad_top + t, cy1 - pad_top + t),
+        slice(cx0 - pad_left + l, cx1 - pad_left + l),
+    )
+    dst = (slice(cy0 - y0, cy1 - y0), slice(cx0 - x0, cx1 - x0))
+    return src, dst
+
+
+def preprocess_reference_image(
+    rgb,
+    mask,
+    intr,
+    bg_color,
+    max_tgt_size,
+    aspect_standard,
+    enlarge_ratio,
+    render_tgt_size,
+    multiply,
+):
+    """Fused reference image preprocess: crop, pad, mask compositing and a single
+    INTER_AREA resize, in float32 and only over the final window.
+
+    Args:
+        rgb: uint8 [H, W, 3|4].
+        mask: uint8 [H, W], foreground >= 128.
+    Returns:
+        rgb [1, 3, H', W'], mask [1, 1, H', W'], intr
+    """
+    plan = plan_reference_crop(
+        mask, aspect_standard, max_tgt_size, enlarge_ratio, render_tgt_size, multiply
+    )
+    x0, y0, x1, y1 = plan["window"]
+
+    bg = np.asarray(bg_color, dtype=np.float32)
+    win_rgb = np.empty((y1 - y0, x1 - x0, 3), dtype=np.float32)
+    win_rgb[...] = bg
+    win_mask = np.zeros((y1 - y0, x1 - x0), dtype=np.float32)
+
+    slices = _reference_crop_slices(plan)
+    if slices is not None:
+        src, dst = slices
+        fg = mask[src] >= 128
+        win_mask[dst] = fg
+        win_rgb[dst] = np.where(
+            fg[..., None], rgb[src][..., :3] * np.float32(1 / 255.0), bg
+        )
+
+    tgt_h, tgt_w = plan["tgt_hw"]
+    win_rgb = cv2.resize(win_rgb, dsize=(tgt_w, tgt_h), interpolation=cv2.INTER_AREA)
+    win_mask = cv2.resize(
+        win_mask, dsize=(tgt_w, tgt_h), interpolation=cv2.INTER_AREA
+    )
+
+    if intr is not None:
+        offset_x, offset_y = plan["offset"]
+        ratio_y, ratio_x = plan["ratio"]
+        intr[0, 2] -= offset_x
+        intr[1, 2] -= offset_y
+        intr = scale_intrs(intr, ratio_x=ratio_x, ratio_y=ratio_y)
+        assert (
+            abs(intr[0, 2] * 2 - tgt_w) < 2.5
+        ), f"{intr[0, 2] * 2}, {tgt_w}"
+        assert (
+            abs(intr[1, 2] * 2 - tgt_h) < 2.5
+        ), f"{intr[1, 2] * 2}, {tgt_h}"
+        intr[0, 2] = tgt_w // 2
+        intr[1, 2] = tgt_h // 2
+
+    rgb = torch.from_numpy(win_rgb).permute(2, 0, 1).unsqueeze(0)  # [1, 3, H, W]
+    mask = torch.from_numpy(win_mask)[None, None]  # [1, 1, H, W]
+    return rgb, mask, intr
+
+
 def preprocess_image(
     rgb_path,
     mask_path,
@@ -382,6 +550,80 @@ def render_smplx_mesh(
     return mesh_render
 
 
+def load_motion_seqs_from_json(motion_seqs_dir, motion_size):
+    """legacy format: one smplx json per frame."""
+    motion_seqs = sorted(glob.glob(os.path.join(motion_seqs_dir, "*.json")))
+    motion_seqs = motion_seqs[:motion_size]
+
+    c2ws, intrs = [], []
+    smplx_params = []
+    shape_param = None
+
+    for idx, smplx_path in enumerate(motion_seqs):
+        with open(smplx_path) as f:
+            smplx_raw_data = json.load(f)
+            smplx_param = {
+                k: torch.FloatTensor(v)
+                for k, v in smplx_raw_data.items()
+                if "pad_ratio" not in k
+            }
+
+        if idx == 0:
+            shape_param = smplx_param["betas"]
+
+        c2w, intrinsic = _load_pose(smplx_param)
+        smplx_param.pop("expr", None)
+        smplx_param["expr"] = torch.FloatTensor([0.0] * 100)
+
+        c2ws.append(c2w)
+        intrs.append(intrinsic)
+        smplx_params.append(smplx_param)
+
+    c2ws = torch.stack(c2ws, dim=0)  # [N, 4, 4]
+    intrs = torch.stack(intrs, dim=0)  # [N, 4, 4]
+
+    smplx_params_tmp = defaultdict(list)
+    for smplx in smplx_params:
+        for k, v in smplx.items():
+            smplx_params_tmp[k].append(v)
+    for k, v in smplx_params_tmp.items():
+        smplx_params_tmp[k] = torch.stack(v)  # [Nv, xx, xx]
+    smplx_params = smplx_params_tmp
+    # TODO check different betas for same person
+    smplx_params["betas"] = shape_param
+
+    return motion_seqs, c2ws, intrs, smplx_params
+
+
+def load_motion_seqs_from_pack(motion_pack_path, motion_size):
+    """packed format (see engine/pose_estimation/motion_pack.py), same outputs as load_motion_seqs_from_json."""
+    frame_names, arrays, _ = load_motion_pack(motion_pack_path)
+    frame_names = frame_names[:motion_size]
+    num_frames = len(frame_names)
+
+    # the memory-mapped float32 columns are wrapped without copy, frames are read on first use
+    smplx_params = {
+        k: torch.from_numpy(v[:num_frames]) for k, v in arrays.items() if k != "expr"
+    }
+    smplx_params["expr"] = torch.zeros((num_frames, 100), dtype=torch.float32)
+
+    c2ws = torch.eye(4).unsqueeze(0).repeat(num_frames, 1, 1)  # [N, 4, 4]
+    intrs = torch.eye(4).unsqueeze(0).repeat(num_frames, 1, 1)  # [N, 4, 4]
+    intrs[:, 0, 0] = smplx_params["focal"][:, 0]
+    intrs[:, 1, 1] = smplx_params["focal"][:, 1]
+    intrs[:, 0, 2] = smplx_params["princpt"][:, 0]
+    intrs[:, 1, 2] = smplx_params["princpt"][:, 1]
+
+    # TODO check different betas for same person
+    smplx_params["betas"] = smplx_params["betas"][0]
+
+    # keep the json-style names, downstream code parses the frame index from them
+    smplx_params_dir = os.path.dirname(motion_pack_path)
+    motion_seqs = [os.path.join(smplx_params_dir, f"{n}.json") for n in frame_names]
+
+    return motion_seqs, c2ws, intrs, smplx_params
+
+
 def prepare_motion_seqs(
     motion_seqs_dir,
     image_folder,
@@ -440,71 +682,18 @@ def prepare_motion_seqs(
             image_folder, save_root, fps
         )
 
-    motion_seqs = sorted(glob.glob(os.path.join(motion_seqs_dir, "*.json")))
-    motion_seqs = motion_seqs[:motion_size]
-
-    # source images
-    c2ws, intrs, rgbs, bg_colors, masks = [], [], [], [], []
-    smplx_params = []
-    shape_param = None
-
-    for idx, smplx_path in enumerate(motion_seqs):
-
-        if image_folder is not None:
-            file_name = os.path.splitext(os.path.basename(smplx_path))[0]
-            frame_path = os.path.join(image_folder, file_name + ".png")
-            if not os.path.exists(frame_path):
-                frame_path = os.path.join(image_folder, file_name + ".jpg")
-        with open(smplx_path) as f:
-            smplx_raw_data = json.load(f)
-            smplx_param = {
-                k: torch.FloatTensor(v)
-                for k, v in smplx_raw_data.items()
-                if "pad_ratio" not in k
-            }
-
-        if idx == 0:
-            shape_param = smplx_param["betas"]
-
-        c2w, intrinsic = _load_pose(smplx_param)
-        intrinsic_raw = intrinsic.clone()
-        if "expr" not in smplx_raw_data:
-            # supports v2.0 data format
-            max_tgt_size = int(max(smplx_param["img_size_wh"]))
-        else:
-            max_tgt_size = int(smplx_param["img_size_wh"][0])
-            smplx_param.pop("expr")
-
-        flame_path = smplx_path.replace("smplx_params", "flame_params")
-        smplx_param["expr"] = torch.FloatTensor([0.0] * 100)
-
-        smplx_param["expr"] = torch.FloatTensor([0.0] * 100)
-
-        c2ws.append(c2w)
-        bg_colors.append(bg_color)
-        intrs.append(intrinsic)
-        # intrs.append(intrinsic_raw)
-        smplx_params.append(smplx_param)
-
-    c2ws = torch.stack(c2ws, dim=0)  # [N, 4, 4]
-    intrs = torch.stack(intrs, dim=0)  # [N, 4, 4]
-    bg_colors = (
-        torch.tensor(bg_colors, dtype=torch.float32).unsqueeze(-1).repeat(1, 3)
-    )  # [N, 3]
-
-    if len(rgbs) > 0:
-        rgbs = torch.cat(rgbs, dim=0)  # [N, 3, H, W]
-        # masks = torch.cat(masks, dim=0)  # [N, 1, H, W]
+    motion_pack_path = find_motion_pack(motion_seqs_dir)
+    if motion_pack_path is not None:
+        motion_seqs, c2ws, intrs, smplx_params = load_motion_seqs_from_pack(
+            motion_pack_path, motion_size
+        )
+    else:
+        motion_seqs, c2ws, intrs, smplx_params = load_motion_seqs_from_json(
+            motion_seqs_dir, motion_size
+        )
 
-    smplx_params_tmp = defaultdict(list)
-    for smplx in smplx_params:
-        for k, v in smplx.items():
-            smplx_params_tmp[k].append(v)
-    for k, v in smplx_params_tmp.items():
-        smplx_params_tmp[k] = torch.stack(v)  # [Nv, xx, xx]
-    smplx_params = smplx_params_tmp
-    # TODO check different betas for same person
-    smplx_params["betas"] = shape_param
+    rgbs = []
+    bg_colors = torch.full((len(motion_seqs), 3), bg_color, dtype=torch.float32)  # [N, 3]
 
     if vis_motion:
         motion_render = render_smplx_mesh(smplx_params, intrs)
@@ -534,6 +723,115 @@ def prepare_motion_seqs(
     return motion_seqs_ret
 
 
+class MotionSeqCache:
+    """LRU cache of prepare_motion_seqs outputs with a byte budget.
+
+    Entries are keyed by the resolved motion path, its modification stamp (see
+    _motion_version) and the loading arguments, so edited or re-generated motions are reloaded and
+    same-named folders never collide. Least recently used entries are evicted
+    once the cached tensors exceed max_bytes.
+
+    Example:
+        motion_cache = MotionSeqCache(max_bytes=2 * 1024**3)
+        motion_seq = motion_cache.get(motion_seqs_dir, None, save_root=..., fps=30, ...)
+        print(motion_cache.stats())
+    """
+
+    def __init__(self, max_bytes=2 * 1024**3):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (motion_seq, nbytes)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _motion_version(motion_path):
+        """modification stamp of a motion: the mtime of a pack, for a directory of per-frame json
+        files their count and newest mtime, as editing a file in place keeps the directory mtime."""
+        if not os.path.isdir(motion_path):
+            return os.stat(motion_path).st_mtime_ns
+        json_files = glob.glob(os.path.join(motion_path, "*.json"))
+        return (
+            len(json_files),
+            max((os.stat(f).st_mtime_ns for f in json_files), default=0),
+        )
+
+    @staticmethod
+    def _motion_key(motion_seqs_dir, image_folder, kwargs):
+        motion_path = find_motion_pack(motion_seqs_dir) or motion_seqs_dir
+        motion_path = os.path.realpath(motion_path)
+        # save_root is only used when motions are predicted from images
+        loading_args = sorted((k, repr(v)) for k, v in kwargs.items() if k != "save_root")
+        return (
+            motion_path,
+            MotionSeqCache._motion_version(motion_path),
+            image_folder,
+            tuple(loading_args),
+        )
+
+    @staticmethod
+    def _nbytes(obj):
+        if isinstance(obj, torch.Tensor):
+            return obj.element_size() * obj.nelement()
+        if isinstance(obj, np.ndarray):
+            return obj.nbytes
+        if isinstance(obj, dict):
+            return sum(MotionSeqCache._nbytes(v) for v in obj.values())
+        if isinstance(obj, (list, tuple)):
+            return sum(MotionSeqCache._nbytes(v) for v in obj)
+        return 0
+
+    @staticmethod
+    def _shallow_copy(motion_seq):
+        # callers overwrite keys such as smplx_params["betas"], keep the cached dicts intact
+        motion_seq = dict(motion_seq)
+        motion_seq["smplx_params"] = dict(motion_seq["smplx_params"])
+        return motion_seq
+
+    def get(self, motion_seqs_dir, image_folder, **kwargs):
+        """same arguments as prepare_motion_seqs."""
+        if motion_seqs_dir is None:
+            # motions predicted from images on the fly are not cached
+            return prepare_motion_seqs(motion_seqs_dir, image_folder, **kwargs)
+
+        key = self._motion_key(motion_seqs_dir, image_folder, kwargs)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._shallow_copy(self._entries[key][0])
+            self.misses += 1
+
+        motion_seq = prepare_motion_seqs(motion_seqs_dir, image_folder, **kwargs)
+        nbytes = self._nbytes(motion_seq)
+
+        with self._lock:
+            if nbytes <= self.max_bytes and key not in self._entries:
+                self._entries[key] = (motion_seq, nbytes)
+                self.current_bytes += nbytes
+                while self.current_bytes > self.max_bytes:
+                    _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                    self.current_bytes -= evicted_bytes
+
+        return self._shallow_copy(motion_seq)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                entries=len(self._entries),
+                bytes=self.current_bytes,
+                max_bytes=self.max_bytes,
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
 def prepare_motion_single(
     motion_seqs_dir,
     image_name,
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# @Function      : content-addressed on-disk cache of reconstructed avatars
+
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+import torch
+from accelerate.logging import get_logger
+from omegaconf import DictConfig, ListConfig, OmegaConf
+
+from LHM.outputs.output import GaussianAppOutput
+
+logger = get_logger(__name__)
+
+__all__ = ["AvatarCache"]
+
+
+def hash_image(image):
+    """sha256 of the reference image. image: file path, np.ndarray or PIL.Image."""
+    hasher = hashlib.sha256()
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(chunk)
+    else:
+        image = np.ascontiguousarray(np.asarray(image))
+        hasher.update(f"{image.shape}-{image.dtype}".encode())
+        hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+
+class AvatarCache:
+    """Content-addressed cache of the infer_single_view outputs, so that re-animating
+    an avatar skips the image encoders and the transformer.
+
+    Each entry stores gs_model_list, query_points, transform_mat_neutral_pose and the betas
+    used for reconstruction, keyed on sha256(image, model name, config). Entries hold plain tensors
+    only and are loaded with weights_only, the cache directory may be shared.
+
+    Example:
+        cache = AvatarCache("./exps/avatar_cache")
+        key = cache.make_key(image_path, cfg.model_name, config)
+        avatar = cache.load(key, device)
+        if avatar is None:
+            ...  # infer_single_view
+            cache.save(key, gs_model_list, query_points, transform_mat_neutral_pose, betas)
+        model.animation_infer(avatar["gs_model_list"], avatar["query_points"], ...)
+    """
+
+    VERSION = 2
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, image, model_name, config=None):
+        if isinstance(config, (DictConfig, ListConfig)):
+            config = OmegaConf.to_container(config, resolve=True)
+        meta = json.dumps(
+            dict(version=self.VERSION, model_name=str(model_name), config=config),
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(
+            (hash_image(image) + meta).encode("utf-8")
+        ).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pt")
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def save(
+        self,
+        key,
+        gs_model_list,
+        query_points,
+        transform_mat_neutral_pose,
+        betas,
+        ref_image=None,
+    ):
+        """ref_image: optional uint8 [H, W, 3] preview of the preprocessed reference image."""
+        entry = dict(
+            gs_model_list=[
+                {k: v.detach().cpu() if torch.is_tensor(v) else v for k, v in gs.items()}
+                for gs in gs_model_list
+            ],
+            query_points=query_points.detach().cpu(),
+            transform_mat_neutral_pose=transform_mat_neutral_pose.detach().cpu(),
+            betas=betas.detach().cpu(),
+            ref_image=torch.from_numpy(ref_image) if ref_image is not None else None,
+        )
+
+        save_path = self.path(key)
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        # write then rename, so that concurrent readers never see a partial entry
+        tmp_path = f"{save_path}.{os.getpid()}.tmp"
+        torch.save(entry, tmp_path)
+        os.replace(tmp_path, save_path)
+
+    def load(self, key, device="cpu"):
+        """return None on cache miss, otherwise a dict which can be fed to animation_infer."""
+        load_path = self.path(key)
+        if not os.path.exists(load_path):
+            return None
+
+        try:
+            entry = torch.load(load_path, map_location=device, weights_only=True)
+        except (OSError, EOFError, RuntimeError, pickle.UnpicklingError) as e:
+            # truncated, corrupted or not a tensor-only entry
+            logger.warning(f"broken avatar cache {load_path}: {e}")
+            return None
+
+        if entry["ref_image"] is not None:
+            entry["ref_image"] = entry["ref_image"].cpu().numpy()
+        entry["gs_model_list"] = [
+            GaussianAppOutput(**gs) for gs in entry["gs_model_list"]
+        ]
+        logger.info(f"load avatar from cache: {load_path}")
+        return entry
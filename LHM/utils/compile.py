@@ -13,12 +13,24 @@
 # limitations under the License.
 
 
+import functools
+import os
+import time
+from collections import defaultdict
+
+import torch
 from accelerate.logging import get_logger
 
 
 logger = get_logger(__name__)
 
 
+# global switch, per hot path switches and torch.compile options, see configure_compile
+_compile_config = dict(enabled=True, modules={}, options={})
+_compile_stats = defaultdict(lambda: dict(calls=0, graphs=0, recompiles=0))
+_warmed_up = set()
+
+
 def configure_dynamo(config: dict):
     try:
         import torch._dynamo
@@ -33,3 +45,113 @@ def configure_dynamo(config: dict):
     except ImportError:
         logger.debug('torch._dynamo not found, skipping')
         pass
+
+
+def configure_compile(enabled=True, modules=None, cache_dir=None, options=None):
+    """
+    Args:
+        enabled (bool): global switch of the hot paths decorated by compile_hot_path.
+        modules (dict): hot path name -> bool, overrides enabled for that path.
+        cache_dir (str): persistent inductor / triton cache shared by the processes of a node,
+            so that a fresh replica loads the compiled kernels instead of recompiling them.
+        options (dict): keyword arguments of torch.compile, e.g. mode or dynamic.
+    Must be called before the first call of a hot path.
+    """
+    _compile_config["enabled"] = enabled
+    _compile_config["modules"] = dict(modules or {})
+    _compile_config["options"] = dict(options or {})
+
+    if cache_dir is not None:
+        cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+        os.environ["TRITON_CACHE_DIR"] = os.path.join(cache_dir, "triton")
+        try:
+            import torch._inductor.config
+
+            # also reuse the compiled FX graphs, not only the kernels
+            torch._inductor.config.fx_graph_cache = True
+        except (ImportError, AttributeError):
+            logger.debug('torch._inductor fx graph cache not available, skipping')
+        logger.info(f'torch.compile cache at {cache_dir}')
+
+
+def set_compile_enabled(name: str, enabled: bool):
+    _compile_config["modules"][name] = enabled
+
+
+def is_compile_enabled(name: str) -> bool:
+    return _compile_config["modules"].get(name, _compile_config["enabled"])
+
+
+def _dynamo_counters():
+    from torch._dynamo.utils import counters
+
+    return counters
+
+
+def compile_stats() -> dict:
+    """calls, compiled graphs and recompiles of every hot path, graph breaks of the process."""
+    counters = _dynamo_counters()
+    return dict(
+        hot_paths={name: dict(stats) for name, stats in _compile_stats.items()},
+        graph_breaks=sum(counters["graph_break"].values()),
+        graph_break_reasons=dict(counters["graph_break"]),
+    )
+
+
+def compile_hot_path(name: str):
+    """
+    Replacement of @torch.compile for the inference hot paths:
+    the function is compiled on its first call with the options of configure_compile, unless
+    the path is disabled, and the compiled graphs are counted per path. A graph compiled after
+    the first call is a recompile, e.g. a resolution not covered by the warmup.
+    """
+
+    def decorator(fn):
+        compiled = []
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # nested hot paths are traced as part of the outer graph
+            if torch._dynamo.is_compiling() or not is_compile_enabled(name):
+                return fn(*args, **kwargs)
+
+            if len(compiled) == 0:
+                compiled.append(torch.compile(fn, **_compile_config["options"]))
+
+            counters = _dynamo_counters()
+            graphs = counters["stats"]["unique_graphs"]
+            out = compiled[0](*args, **kwargs)
+            new_graphs = counters["stats"]["unique_graphs"] - graphs
+
+            stats = _compile_stats[name]
+            stats["graphs"] += new_graphs
+            if new_graphs > 0 and stats["calls"] > 0:
+                stats["recompiles"] += 1
+                if name in _warmed_up:
+                    logger.warning(
+                        f'{name} recompiled after warmup ({stats["recompiles"]} recompiles), '
+                        'add the input shape to the warmup shapes'
+                    )
+            stats["calls"] += 1
+            return out
+
+        return wrapper
+
+    return decorator
+
+
+def warmup(run_fn, shapes, names=()):
+    """
+    Compile ahead of the first request: run_fn(shape) is called once per shape, it should run the
+    model on dummy inputs of that shape. names: hot paths reported as warmed up, their later
+    recompiles are logged as warnings.
+    """
+    for shape in shapes:
+        start = time.time()
+        with torch.no_grad():
+            run_fn(shape)
+        logger.info(f'warmup {shape}: {time.time() - start:.1f}s')
+    _warmed_up.update(names)
+    logger.info(f'torch.compile stats after warmup: {compile_stats()["hot_paths"]}')
@@ -1,9 +1,12 @@
 import os
 import pdb
+import queue
 import subprocess
 import tempfile
+import threading
 
 import cv2
+import imageio
 import imageio.v3 as iio
 import numpy as np
 import torch
@@ -38,22 +41,139 @@ def encodeffmpeg(inputs, frame_rate, output, format="png"):
     os.system(cmd)
     print("video done!")
 
-def images_to_video(images, output_path, fps, gradio_codec: bool, verbose=False, bitrate="10M"):
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    frames = []
-    for i in range(images.shape[0]):
-        if isinstance(images, torch.Tensor):
-            frame = (images[i].permute(1, 2, 0).cpu().numpy() * 255).astype(np.uint8)
-            assert frame.shape[0] == images.shape[2] and frame.shape[1] == images.shape[3], \
-                f"Frame shape mismatch: {frame.shape} vs {images.shape}"
-            assert frame.min() >= 0 and frame.max() <= 255, \
-                f"Frame value out of range: {frame.min()} ~ {frame.max()}"
+def to_uint8_frame(frame):
+    """torch.tensor (C, H, W) 0-1 or numpy (H, W, 3) 0-255 -> numpy (H, W, 3) uint8"""
+    if isinstance(frame, torch.Tensor):
+        frame = (frame.permute(1, 2, 0).clamp(0, 1).cpu().numpy() * 255).astype(np.uint8)
+    return frame
+
+
+class VideoWriter:
+    """Streaming video encoder. Frames are piped to ffmpeg as soon as they are written,
+    so host memory stays flat whatever the sequence length.
+
+    With queue_size > 0, encoding runs in a background thread: write() only queues the frames
+    (blocking when queue_size batches are pending) and close() waits for the encoder.
+    Leaving the with block on an exception aborts the video, see abort().
+
+    Example:
+        with VideoWriter(output_path, fps=30) as writer:
+            for batch_rgb in render_loop():
+                writer.write(batch_rgb)  # [N, H, W, 3] uint8
+    """
+
+    def __init__(
+        self,
+        output_path,
+        fps,
+        bitrate="10M",
+        codec="libx264",
+        verbose=False,
+        queue_size=0,
+    ):
+        self.output_path = output_path
+        self.fps = fps
+        self.bitrate = bitrate
+        self.codec = codec
+        self.verbose = verbose
+        self.queue_size = queue_size
+        self.num_frames = 0
+        self._writer = None
+        self._queue = None
+        self._thread = None
+        self._error = None
+
+    def open(self):
+        output_dir = os.path.dirname(self.output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self._writer = imageio.get_writer(
+            self.output_path,
+            fps=self.fps,
+            codec=self.codec,
+            pixelformat="yuv420p",
+            bitrate=self.bitrate,
+            macro_block_size=16,
+        )
+        if self.queue_size > 0:
+            self._queue = queue.Queue(self.queue_size)
+            self._thread = threading.Thread(
+                target=self._encode_loop, name="video-writer", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def _append(self, frames):
+        for frame in frames:
+            self._writer.append_data(frame)
+            self.num_frames += 1
+
+    def _encode_loop(self):
+        while True:
+            frames = self._queue.get()
+            if frames is None:
+                break
+            if self._error is not None:
+                # keep draining, so that write() never blocks on a dead encoder
+                continue
+            try:
+                self._append(frames)
+            except Exception as e:
+                self._error = e
+
+    def write(self, frames):
+        """frames: a single frame or a batch, torch.tensor (T, C, H, W) 0-1 or numpy (T, H, W, 3) 0-255"""
+        if self._writer is None:
+            self.open()
+        if frames.ndim == 3:
+            frames = frames[None]
+        frames = [to_uint8_frame(frame) for frame in frames]
+        if self._thread is None:
+            self._append(frames)
         else:
-            frame = images[i]
-        frames.append(frame)
-    
-    frames = np.stack(frames)
-    iio.imwrite(output_path,frames,fps=fps,codec="libx264",pixelformat="yuv420p",bitrate=bitrate,macro_block_size=16)
+            if self._error is not None:
+                raise self._error
+            self._queue.put(frames)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._queue = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            if self.verbose:
+                print(f"Saved {self.num_frames} frames to {self.output_path}")
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def abort(self):
+        """stop encoding after a failure upstream: close without raising encoder errors, which
+        would mask the original one, and remove the truncated video."""
+        try:
+            self.close()
+        except Exception as e:
+            print(f"ignore encoder error of aborted video {self.output_path}: {e!r}")
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def images_to_video(images, output_path, fps, gradio_codec: bool, verbose=False, bitrate="10M"):
+    # images: torch.tensor (T, C, H, W), 0-1  or numpy: (T, H, W, 3) 0-255
+    with VideoWriter(output_path, fps, bitrate=bitrate, verbose=verbose) as writer:
+        writer.write(images)
 
 
 # def images_to_video(images, output_path, fps, gradio_codec: bool, verbose=False, bitrate="10M", batch_size=500):
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# @Function      : reference image decoded once per request
+
+import numpy as np
+import torch
+from PIL import Image
+
+__all__ = ["ImageContext"]
+
+
+class ImageContext:
+    """A reference image decoded once and shared by all the preprocessing stages
+    (pose estimation, segmentation, face detection, preprocess).
+
+    Every view is a zero-copy view of the decoded uint8 array, so the stages must not
+    modify them in place.
+
+    Example:
+        image_ctx = ImageContext(image_path)  # or an in-memory [H, W, 3|4] uint8 array
+        shape_pose = pose_estimator(image_ctx.rgb)
+        parsing_out = parsingnet(img_path=image_ctx.rgb, bbox=None)
+        bbox = facedetect(image_ctx.chw)
+    """
+
+    def __init__(self, image):
+        """image: file path, PIL.Image or uint8 np.ndarray [H, W, 3] (RGB) or [H, W, 4] (RGBA)."""
+        self.path = image if isinstance(image, str) else None
+
+        if isinstance(image, str):
+            with Image.open(image) as img:
+                raw = self._to_array(img)
+        elif isinstance(image, Image.Image):
+            raw = self._to_array(image)
+        else:
+            raw = np.asarray(image)
+
+        assert (
+            raw.dtype == np.uint8 and raw.ndim == 3 and raw.shape[2] in (3, 4)
+        ), f"expect an uint8 RGB(A) image, got {raw.dtype} {raw.shape}"
+        self.raw = raw
+
+    @staticmethod
+    def _to_array(img):
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+        return np.array(img)
+
+    @classmethod
+    def wrap(cls, image):
+        return image if isinstance(image, cls) else cls(image)
+
+    @property
+    def shape(self):
+        return self.raw.shape[:2]
+
+    @property
+    def rgb(self):
+        """uint8 [H, W, 3], alpha channel dropped."""
+        return self.raw[..., :3]
+
+    @property
+    def bgr(self):
+        """uint8 [H, W, 3] negative-stride view, for the cv2-style consumers."""
+        return self.rgb[..., ::-1]
+
+    @property
+    def chw(self):
+        """uint8 torch tensor [3, H, W] sharing memory with rgb."""
+        return torch.from_numpy(self.rgb).permute(2, 0, 1)
+
+    def __repr__(self):
+        return f"ImageContext(path={self.path}, shape={self.raw.shape})"
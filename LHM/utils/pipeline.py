@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# @Function      : multi-stage pipeline connected by bounded queues
+
+import queue
+import threading
+
+from accelerate.logging import get_logger
+
+__all__ = ["Stage", "StagedPipeline"]
+
+logger = get_logger(__name__)
+
+_STOP = object()
+_POLL_INTERVAL = 0.1
+
+
+class _Aborted(Exception):
+    pass
+
+
+class Stage:
+    """One step of a StagedPipeline.
+
+    Args:
+        name (str): stage name, used for the worker threads and error messages.
+        fn (callable): item -> item, returning None drops the item.
+            With batch_size > 1, fn gets a list of items and returns a list of the same length.
+        num_workers (int): number of threads running fn. Stages using the accelerator should keep 1.
+        batch_size (int): up to batch_size items are taken from the queue for one fn call.
+    """
+
+    def __init__(self, name, fn, num_workers=1, batch_size=1):
+        assert num_workers >= 1 and batch_size >= 1
+        self.name = name
+        self.fn = fn
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+
+
+class StagedPipeline:
+    """Run items through a list of stages. Every stage has its own worker threads and the stages
+    are connected by queues of queue_size items, so neighbouring items overlap,
+    e.g. the video of image i is encoded while image i + 1 is reconstructed.
+
+    Threads are enough here: torch, cv2, PIL and the ffmpeg pipe release the GIL in their heavy calls.
+
+    Example:
+        pipeline = StagedPipeline(
+            [
+                Stage("decode", decode, num_workers=2),
+                Stage("infer", infer),
+                Stage("save", save, num_workers=2),
+            ],
+            queue_size=2,
+        )
+        outputs = pipeline.run(image_paths)
+
+    The first exception raised by a stage stops all the workers and is re-raised by run().
+    Output order follows the input order only when every stage has a single worker.
+    """
+
+    def __init__(self, stages, queue_size=2):
+        assert len(stages) > 0
+        assert queue_size >= 1
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, items):
+        """feed items through all the stages, return the non-None outputs of the last stage."""
+        self._abort = threading.Event()
+        self._error = None
+        self._error_lock = threading.Lock()
+
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages))]
+        queues.append(queue.Queue(self.queue_size))
+
+        threads = [
+            threading.Thread(
+                target=self._feed, args=(items, queues[0]), name="pipeline-feed", daemon=True
+            )
+        ]
+        for stage_idx, stage in enumerate(self.stages):
+            live_workers = [stage.num_workers]
+            for worker_idx in range(stage.num_workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._work,
+                        args=(stage, queues[stage_idx], queues[stage_idx + 1], live_workers),
+                        name=f"pipeline-{stage.name}-{worker_idx}",
+                        daemon=True,
+                    )
+                )
+
+        for thread in threads:
+            thread.start()
+
+        outputs = []
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _STOP:
+                    break
+                outputs.append(item)
+        except _Aborted:
+            pass
+        except BaseException:
+            # e.g. KeyboardInterrupt, stop the workers before leaving
+            self._abort.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+        return outputs
+
+    def _fail(self, stage_name, error):
+        logger.error(f"pipeline stage {stage_name} failed: {error!r}")
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+        self._abort.set()
+
+    def _put(self, q, item):
+        while True:
+            if self._abort.is_set():
+                raise _Aborted
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while True:
+            if self._abort.is_set():
+                raise _Aborted
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+    def _feed(self, items, out_queue):
+        try:
+            for item in items:
+                self._put(out_queue, item)
+            self._put(out_queue, _STOP)
+        except _Aborted:
+            pass
+        except Exception as e:
+            self._fail("feed", e)
+
+    def _work(self, stage, in_queue, out_queue, live_workers):
+        try:
+            stopped = False
+            while not stopped:
+                batch = []
+                while len(batch) < stage.batch_size:
+                    item = self._get(in_queue)
+                    if item is _STOP:
+                        # leave the sentinel for the sibling workers
+                        self._put(in_queue, _STOP)
+                        stopped = True
+                        break
+                    batch.append(item)
+
+                if len(batch) == 0:
+                    break
+
+                if stage.batch_size == 1:
+                    outputs = [stage.fn(batch[0])]
+                else:
+                    outputs = stage.fn(batch)
+                    assert len(outputs) == len(
+                        batch
+                    ), f"{len(outputs)} outputs for {len(batch)} items"
+
+                for output in outputs:
+                    if output is not None:
+                        self._put(out_queue, output)
+
+            # the last worker of the stage closes the next queue
+            with self._error_lock:
+                live_workers[0] -= 1
+                is_last = live_workers[0] == 0
+            if is_last:
+                self._put(out_queue, _STOP)
+        except _Aborted:
+            pass
+        except Exception as e:
+            self._fail(stage.name, e)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# @Function      : per-device memory model of animation rendering, sizes the render chunks
+
+import contextlib
+import json
+import os
+import re
+
+import torch
+from accelerate.logging import get_logger
+
+logger = get_logger(__name__)
+
+__all__ = ["RENDER_MEMORY_DIR", "RenderMemoryModel"]
+
+RENDER_MEMORY_DIR = "./pretrained_models/render_memory"
+
+
+class RenderMemoryModel:
+    """Measures the peak memory of animation rendering per frame, and picks the largest render
+    chunk that fits into the free memory of the device.
+
+    Every rendered chunk is an observation of the peak allocation per frame, for its gaussian count,
+    render resolution and dtype. The peak grows linearly with each of them, so an observation scaled
+    by the largest ratio of the three bounds the cost of another configuration. The observations are
+    cached per device type under cache_dir, so that later runs start from the right chunk size.
+
+    An out-of-memory chunk is retried with half the frames, and recorded as an observation too.
+
+    The free memory and the peak allocation are device-wide: other threads allocating on the device
+    during a chunk would be counted as render cost. Threads sharing the device pass the lock they
+    hold around their GPU work, every measured chunk holds it too.
+
+    Example:
+        memory_model = RenderMemoryModel(device)
+        for start, end, res in memory_model.render(
+            num_frames, lambda start, end: model.animation_infer(...), num_gaussians, H, W, dtype
+        ):
+            ...
+    """
+
+    VERSION = 1
+
+    def __init__(
+        self,
+        device,
+        cache_dir=RENDER_MEMORY_DIR,
+        safety=0.8,
+        probe_chunk=8,
+        max_chunk=256,
+        default_chunk=40,
+        lock=None,
+    ):
+        """
+        Args:
+            device: render device.
+            cache_dir (str): where to cache the observations, None keeps them in memory.
+            safety (float): fraction of the free memory a chunk may use.
+            probe_chunk (int): chunk size of the first chunk, before any observation.
+            max_chunk (int): upper bound of the chunk size.
+            default_chunk (int): chunk size on devices without memory statistics, e.g. CPU.
+            lock: lock (re-entrant if held by the caller of render) of the other users of the device.
+        """
+        self.device = torch.device(device)
+        if self.device.type == "cuda" and self.device.index is None:
+            self.device = torch.device("cuda", torch.cuda.current_device())
+        self.safety = safety
+        self.probe_chunk = probe_chunk
+        self.max_chunk = max_chunk
+        self.default_chunk = default_chunk
+        self.lock = lock
+
+        # "num_gaussians,pixels,itemsize" -> {"frames": int, "bytes_per_frame": float}
+        self.observations = {}
+        self.cache_path = None
+        if cache_dir is not None and self.device.type == "cuda":
+            self.cache_path = os.path.join(cache_dir, f"{self.device_key()}.json")
+            self.load()
+
+    def device_key(self):
+        props = torch.cuda.get_device_properties(self.device)
+        name = re.sub(r"[^0-9A-Za-z]+", "_", props.name).strip("_")
+        return f"{name}_{props.total_memory >> 20}MB"
+
+    def load(self):
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"ignore unreadable render memory profile {self.cache_path}")
+            return
+        if state.get("version") == self.VERSION:
+            self.observations = state["observations"]
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        # write then rename, so that concurrent workers never read a partial file
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(dict(version=self.VERSION, observations=self.observations), f)
+        os.replace(tmp_path, self.cache_path)
+
+    @staticmethod
+    def _config(num_gaussians, height, width, dtype):
+        return int(num_gaussians), int(height) * int(width), torch.finfo(dtype).bits // 8
+
+    def _key(self, num_gaussians, height, width, dtype):
+        return ",".join(str(x) for x in self._config(num_gaussians, height, width, dtype))
+
+    def bytes_per_frame(self, num_gaussians, height, width, dtype):
+        """upper bound of the peak memory per rendered frame, None before any observation."""
+        observation = self.observations.get(self._key(num_gaussians, height, width, dtype))
+        if observation is not None:
+            return observation["bytes_per_frame"]
+
+        config = self._config(num_gaussians, height, width, dtype)
+        estimate = None
+        for key, observation in self.observations.items():
+            observed = [int(x) for x in key.split(",")]
+            scale = max(max(x / max(y, 1), 1.0) for x, y in zip(config, observed))
+            bound = observation["bytes_per_frame"] * scale
+            estimate = bound if estimate is None else min(estimate, bound)
+        return estimate
+
+    def free_bytes(self):
+        """free device memory, plus the memory held by the caching allocator that is not in use."""
+        free, _ = torch.cuda.mem_get_info(self.device)
+        cached = torch.cuda.memory_reserved(self.device) - torch.cuda.memory_allocated(
+            self.device
+        )
+        return free + cached
+
+    def chunk_size(self, num_gaussians, height, width, dtype):
+        """largest number of frames expected to fit into the free memory."""
+        if self.device.type != "cuda":
+            return self.default_chunk
+
+        bytes_per_frame = self.bytes_per_frame(num_gaussians, height, width, dtype)
+        if bytes_per_frame is None:
+            return self.probe_chunk
+
+        chunk = int(self.free_bytes() * self.safety / max(bytes_per_frame, 1))
+        return max(1, min(chunk, self.max_chunk))
+
+    def observe(self, num_frames, num_gaussians, height, width, dtype, peak_bytes):
+        """record the peak allocation of rendering num_frames frames.
+        Chunks with more frames amortize the fixed cost better, they replace smaller ones.
+        """
+        key = self._key(num_gaussians, height, width, dtype)
+        observation = self.observations.get(key)
+        if observation is None or num_frames >= observation["frames"]:
+            self.observations[key] = dict(
+                frames=num_frames, bytes_per_frame=peak_bytes / num_frames
+            )
+
+    def observe_oom(self, num_frames, num_gaussians, height, width, dtype, budget):
+        """record that num_frames frames did not fit into budget bytes.
+        A frame then costs more than budget / num_frames, twice that halves the next chunk.
+        It is a guess, the next measured chunk replaces it.
+        """
+        key = self._key(num_gaussians, height, width, dtype)
+        bytes_per_frame = 2 * budget / num_frames
+        observation = self.observations.get(key)
+        if observation is None or observation["bytes_per_frame"] < bytes_per_frame:
+            self.observations[key] = dict(frames=0, bytes_per_frame=bytes_per_frame)
+
+    def render(self, num_frames, render_fn, num_gaussians, height, width, dtype):
+        """
+        Args:
+            num_frames (int): frames of the sequence.
+            render_fn (callable): render_fn(start, end) renders frames [start, end).
+            num_gaussians, height, width, dtype: render configuration of the memory model.
+        Yields:
+            (start, end, render_fn(start, end)) chunk by chunk.
+        """
+        if self.device.type != "cuda":
+            for start in range(0, num_frames, self.default_chunk):
+                end = min(start + self.default_chunk, num_frames)
+                yield start, end, render_fn(start, end)
+            return
+
+        observed = False
+        # after an out-of-memory chunk, the rest of the sequence stays below half of it
+        limit = self.max_chunk
+        start = 0
+        try:
+            while start < num_frames:
+                # sized and measured while no other thread uses the device
+                with self.lock if self.lock is not None else contextlib.nullcontext():
+                    chunk = min(
+                        self.chunk_size(num_gaussians, height, width, dtype),
+                        limit,
+                        num_frames - start,
+                    )
+                    end = start + chunk
+
+                    budget = self.free_bytes() * self.safety
+                    base = torch.cuda.memory_allocated(self.device)
+                    torch.cuda.reset_peak_memory_stats(self.device)
+                    try:
+                        res = render_fn(start, end)
+                    except torch.cuda.OutOfMemoryError:
+                        if chunk == 1:
+                            raise
+                        torch.cuda.empty_cache()
+                        self.observe_oom(chunk, num_gaussians, height, width, dtype, budget)
+                        observed = True
+                        limit = chunk // 2
+                        logger.warning(
+                            f"render out of memory with {chunk} frames, retry with {limit}"
+                        )
+                        continue
+
+                    peak = torch.cuda.max_memory_allocated(self.device) - base
+
+                self.observe(chunk, num_gaussians, height, width, dtype, peak)
+                observed = True
+
+                yield start, end, res
+                del res
+                start = end
+        finally:
+            if observed:
+                self.save()
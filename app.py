@@ -36,7 +36,6 @@ from accelerate import Accelerator
 from omegaconf import OmegaConf
 
 from engine.pose_estimation.pose_estimator import PoseEstimator
-from engine.SegmentAPI.base import Bbox
 from LHM.utils.model_download_utils import AutoModelQuery
 
 try:
@@ -46,17 +45,17 @@ except:
     from rembg import remove
 
 from LHM.runners.infer.utils import (
-    calc_new_tgt_size_by_aspect,
-    center_crop_according_to_mask,
-    prepare_motion_seqs,
-    resize_image_keepaspect_np,
+    MotionSeqCache,
+    preprocess_reference_image,
 )
 from LHM.utils.download_utils import download_extract_tar_from_url, download_from_url
 from LHM.utils.face_detector import VGGHeadDetector
-from LHM.utils.ffmpeg_utils import images_to_video
+from LHM.utils.ffmpeg_utils import VideoWriter
 from LHM.utils.hf_hub import wrap_model_hub
+from LHM.utils.image_context import ImageContext
 from LHM.utils.model_card import MEMORY_MODEL_CARD, MODEL_CARD, MODEL_CONFIG
 from LHM.utils.model_query_utils import AutoModelSwitcher
+from LHM.utils.render_memory import RenderMemoryModel
 
 
 def download_geo_files():
@@ -77,29 +76,6 @@ def prior_check():
         prior_data = MODEL_CARD['prior_model']
         download_extract_tar_from_url(prior_data)
 
-def get_bbox(mask):
-    height, width = mask.shape
-    pha = mask / 255.0
-    pha[pha < 0.5] = 0.0
-    pha[pha >= 0.5] = 1.0
-
-    # obtain bbox
-    _h, _w = np.where(pha == 1)
-
-    whwh = [
-        _w.min().item(),
-        _h.min().item(),
-        _w.max().item(),
-        _h.max().item(),
-    ]
-
-    box = Bbox(whwh)
-
-    # scale box to 1.05
-    scale_box = box.scale(1.1, width=width, height=height)
-    return scale_box
-
-
 def infer_preprocess_image(
     rgb_path,
     mask,
@@ -120,112 +96,23 @@ def infer_preprocess_image(
 
     """
 
-    rgb = np.array(Image.open(rgb_path))
-    rgb_raw = rgb.copy()
-
-    bbox = get_bbox(mask)
-    bbox_list = bbox.get_box()
-
-    rgb = rgb[bbox_list[1] : bbox_list[3], bbox_list[0] : bbox_list[2]]
-    mask = mask[bbox_list[1] : bbox_list[3], bbox_list[0] : bbox_list[2]]
-
-
-    h, w, _ = rgb.shape
-    assert w < h
-    cur_ratio = h / w
-    scale_ratio = cur_ratio / aspect_standard
-
-
-    target_w = int(min(w * scale_ratio, h))
-    if target_w - w >0:
-        offset_w = (target_w - w) // 2
-
-        rgb = np.pad(
-            rgb,
-            ((0, 0), (offset_w, offset_w), (0, 0)),
-            mode="constant",
-            constant_values=255,
-        )
-
-        mask = np.pad(
-            mask,
-            ((0, 0), (offset_w, offset_w)),
-            mode="constant",
-            constant_values=0,
-        )
-    else:
-        target_h = w * aspect_standard
-        offset_h = int(target_h - h)
-
-        rgb = np.pad(
-            rgb,
-            ((offset_h, 0), (0, 0), (0, 0)),
-            mode="constant",
-            constant_values=255,
-        )
-
-        mask = np.pad(
-            mask,
-            ((offset_h, 0), (0, 0)),
-            mode="constant",
-            constant_values=0,
-        )
-
-    rgb = rgb / 255.0  # normalize to [0, 1]
-    mask = mask / 255.0
-
-    mask = (mask > 0.5).astype(np.float32)
-    rgb = rgb[:, :, :3] * mask[:, :, None] + bg_color * (1 - mask[:, :, None])
-
-    # resize to specific size require by preprocessor of smplx-estimator.
-    rgb = resize_image_keepaspect_np(rgb, max_tgt_size)
-    mask = resize_image_keepaspect_np(mask, max_tgt_size)
-
-    # crop image to enlarge human area.
-    rgb, mask, offset_x, offset_y = center_crop_according_to_mask(
-        rgb, mask, aspect_standard, enlarge_ratio
-    )
-    if intr is not None:
-        intr[0, 2] -= offset_x
-        intr[1, 2] -= offset_y
-
-    # resize to render_tgt_size for training
-
-    tgt_hw_size, ratio_y, ratio_x = calc_new_tgt_size_by_aspect(
-        cur_hw=rgb.shape[:2],
+    # rgb_path: image path, uint8 array or ImageContext, decoded once per request
+    rgb = ImageContext.wrap(rgb_path).raw
+
+    # crop, pad to aspect_standard, mask compositing and resize are fused into a single
+    # float32 pass over the final crop window, see preprocess_reference_image.
+    return preprocess_reference_image(
+        rgb,
+        mask,
+        intr,
+        bg_color=bg_color,
+        max_tgt_size=max_tgt_size,
         aspect_standard=aspect_standard,
-        tgt_size=render_tgt_size,
+        enlarge_ratio=enlarge_ratio,
+        render_tgt_size=render_tgt_size,
         multiply=multiply,
     )
 
-    rgb = cv2.resize(
-        rgb, dsize=(tgt_hw_size[1], tgt_hw_size[0]), interpolation=cv2.INTER_AREA
-    )
-    mask = cv2.resize(
-        mask, dsize=(tgt_hw_size[1], tgt_hw_size[0]), interpolation=cv2.INTER_AREA
-    )
-
-    if intr is not None:
-
-        # ******************** Merge *********************** #
-        intr = scale_intrs(intr, ratio_x=ratio_x, ratio_y=ratio_y)
-        assert (
-            abs(intr[0, 2] * 2 - rgb.shape[1]) < 2.5
-        ), f"{intr[0, 2] * 2}, {rgb.shape[1]}"
-        assert (
-            abs(intr[1, 2] * 2 - rgb.shape[0]) < 2.5
-        ), f"{intr[1, 2] * 2}, {rgb.shape[0]}"
-
-        # ******************** Merge *********************** #
-        intr[0, 2] = rgb.shape[1] // 2
-        intr[1, 2] = rgb.shape[0] // 2
-
-    rgb = torch.from_numpy(rgb).float().permute(2, 0, 1).unsqueeze(0)  # [1, 3, H, W]
-    mask = (
-        torch.from_numpy(mask[:, :, None]).float().permute(2, 0, 1).unsqueeze(0)
-    )  # [1, 1, H, W]
-    return rgb, mask, intr
-
 
 
 def parse_configs():
@@ -362,11 +249,15 @@ def get_image_base64(path):
 
 def demo_lhm(pose_estimator, face_detector, parsing_net, lhm, cfg):
 
+    # prepared motions are reused across requests, bounded by a byte budget
+    motion_cache = MotionSeqCache(
+        max_bytes=cfg.get("motion_cache_bytes", 2 * 1024**3)
+    )
+
     @spaces.GPU(duration=100)
     def core_fn(image: str, video_params, working_dir):
-        image_raw = os.path.join(working_dir.name, "raw.png")
-        with Image.fromarray(image) as img:
-            img.save(image_raw)
+        # decoded once and shared in memory by all the preprocessing stages
+        image_ctx = ImageContext(image)
         
         base_vid = os.path.basename(video_params).split(".")[0]
         smplx_params_dir = os.path.join("./train_data/motion_video/", base_vid, "smplx_params")
@@ -375,14 +266,6 @@ def demo_lhm(pose_estimator, face_detector, parsing_net, lhm, cfg):
         dump_image_path = os.path.join(working_dir.name, "output.png")
 
         # prepare dump paths
-        omit_prefix = os.path.dirname(image_raw)
-        image_name = os.path.basename(image_raw)
-        uid = image_name.split(".")[0]
-        subdir_path = os.path.dirname(image_raw).replace(omit_prefix, "")
-        subdir_path = (
-            subdir_path[1:] if subdir_path.startswith("/") else subdir_path
-        )
-        print("subdir_path and uid:", subdir_path, uid)
 
         motion_seqs_dir = smplx_params_dir
         
@@ -395,7 +278,7 @@ def demo_lhm(pose_estimator, face_detector, parsing_net, lhm, cfg):
         dump_image_dir = os.path.dirname(dump_image_path)
         os.makedirs(dump_image_dir, exist_ok=True)
 
-        print(image_raw, motion_seqs_dir, dump_image_dir, dump_video_path)
+        print(motion_seqs_dir, dump_image_dir, dump_video_path)
 
         dump_tmp_dir = dump_image_dir
 
@@ -410,19 +293,18 @@ def demo_lhm(pose_estimator, face_detector, parsing_net, lhm, cfg):
 
         with torch.no_grad():
             if parsing_net is not None:
-                parsing_out = parsing_net(img_path=image_raw, bbox=None)
+                parsing_out = parsing_net(img_path=image_ctx.rgb, bbox=None)
                 parsing_mask = (parsing_out.masks * 255).astype(np.uint8)
             else:
-                img_np = cv2.imread(image_raw)
-                remove_np = remove(img_np)
+                remove_np = remove(image_ctx.bgr)
                 parsing_mask = remove_np[...,3]
 
-            shape_pose = pose_estimator(image_raw)
+            shape_pose = pose_estimator(image_ctx.rgb)
         assert shape_pose.is_full_body, f"The input image is illegal, {shape_pose.msg}"
 
         # prepare reference image
-        image, _, _ = infer_preprocess_image(
-            image_raw,
+        image, mask, _ = infer_preprocess_image(
+            image_ctx,
             mask=parsing_mask,
             intr=None,
             pad_ratio=0,
@@ -436,8 +318,7 @@ def demo_lhm(pose_estimator, face_detector, parsing_net, lhm, cfg):
         )
 
         try:
-            rgb = np.array(Image.open(image_raw))[...,:3]  # RGBA input
-            rgb = torch.from_numpy(rgb).permute(2, 0, 1)
+            rgb = image_ctx.chw
             bbox = face_detector.detect_face(rgb)
             head_rgb = rgb[:, int(bbox[1]) : int(bbox[3]), int(bbox[0]) : int(bbox[2])]
             head_rgb = head_rgb.permute(1, 2, 0)
@@ -476,7 +357,7 @@ def demo_lhm(pose_estimator, face_detector, parsing_net, lhm, cfg):
         )
         motion_name = os.path.basename(motion_name)
 
-        motion_seq = prepare_motion_seqs(
+        motion_seq = motion_cache.get(
             motion_seqs_dir,
             None,
             save_root=dump_tmp_dir,
@@ -514,95 +395,109 @@ def demo_lhm(pose_estimator, face_detector, parsing_net, lhm, cfg):
             smplx_params={
                 k: v.to(device) for k, v in smplx_params.items()
             },
+            fg_mask=mask.to(device, dtype),
         )
 
         # rendering !!!!
         start_time = time.time()
 
-        batch_list = [] 
-
-        batch_size = 40  # avoid memeory out!
-
-        for batch_i in range(0, camera_size, batch_size):
-            with torch.no_grad():
-                # TODO check device and dtype
-                # dict_keys(['comp_rgb', 'comp_rgb_bg', 'comp_mask', 'comp_depth', '3dgs'])
-
-                print(f"batch: {batch_i}, total: {camera_size //batch_size +1} ")
-
-                keys = [
-                    "root_pose",
-                    "body_pose",
-                    "jaw_pose",
-                    "leye_pose",
-                    "reye_pose",
-                    "lhand_pose",
-                    "rhand_pose",
-                    "trans",
-                    "focal",
-                    "princpt",
-                    "img_size_wh",
-                    "expr",
-                ]
-
-
-                batch_smplx_params = dict()
-                batch_smplx_params["betas"] = shape_param.to(device)
-                batch_smplx_params['transform_mat_neutral_pose'] = transform_mat_neutral_pose
-                for key in keys:
-                    batch_smplx_params[key] = motion_seq["smplx_params"][key][
-                        :, batch_i : batch_i + batch_size
-                    ].to(device)
-
-                # def animation_infer(self, gs_model_list, query_points, smplx_params, render_c2ws, render_intrs, render_bg_colors, render_h, render_w):
-                res = lhm.animation_infer(gs_model_list, query_points, batch_smplx_params,
-                    render_c2ws=motion_seq["render_c2ws"][
-                        :, batch_i : batch_i + batch_size
-                    ].to(device),
-                    render_intrs=motion_seq["render_intrs"][
-                        :, batch_i : batch_i + batch_size
-                    ].to(device),
-                    render_bg_colors=motion_seq["render_bg_colors"][
-                        :, batch_i : batch_i + batch_size
-                    ].to(device),
-                    )
+        # pose-independent skinning is shared by every batch of the sequence
+        neutral_pose_cache_list = lhm.build_neutral_pose_cache(
+            gs_model_list,
+            query_points,
+            {
+                "betas": shape_param.to(device),
+                "transform_mat_neutral_pose": transform_mat_neutral_pose,
+            },
+        )
 
-            comp_rgb = res["comp_rgb"] # [Nv, H, W, 3], 0-1
-            comp_mask = res["comp_mask"] # [Nv, H, W, 3], 0-1
-            comp_mask[comp_mask < 0.5] = 0.0
 
-            batch_rgb = comp_rgb * comp_mask + (1 - comp_mask) * 1
-            batch_rgb = (batch_rgb.clamp(0,1) * 255).to(torch.uint8).detach().cpu().numpy()
-            batch_list.append(batch_rgb)
+        keys = [
+            "root_pose",
+            "body_pose",
+            "jaw_pose",
+            "leye_pose",
+            "reye_pose",
+            "lhand_pose",
+            "rhand_pose",
+            "trans",
+            "focal",
+            "princpt",
+            "img_size_wh",
+            "expr",
+        ]
+
+        @torch.no_grad()
+        def render(batch_i, batch_end):
+            # TODO check device and dtype
+            # dict_keys(['comp_rgb', 'comp_rgb_bg', 'comp_mask', 'comp_depth', '3dgs'])
+            batch_smplx_params = dict()
+            batch_smplx_params["betas"] = shape_param.to(device)
+            batch_smplx_params['transform_mat_neutral_pose'] = transform_mat_neutral_pose
+            for key in keys:
+                batch_smplx_params[key] = motion_seq["smplx_params"][key][
+                    :, batch_i:batch_end
+                ].to(device)
+
+            # def animation_infer(self, gs_model_list, query_points, smplx_params, render_c2ws, render_intrs, render_bg_colors, render_h, render_w):
+            return lhm.animation_infer(gs_model_list, query_points, batch_smplx_params,
+                render_c2ws=motion_seq["render_c2ws"][
+                    :, batch_i:batch_end
+                ].to(device),
+                render_intrs=motion_seq["render_intrs"][
+                    :, batch_i:batch_end
+                ].to(device),
+                render_bg_colors=motion_seq["render_bg_colors"][
+                    :, batch_i:batch_end
+                ].to(device),
+                neutral_pose_cache_list=neutral_pose_cache_list,
+                )
+
+        # the render chunk is sized by the free memory, instead of a fixed 40 frames
+        render_memory = RenderMemoryModel(device)
+        render_intrs = motion_seq["render_intrs"]
+
+        # frames are encoded batch by batch, the whole sequence is never held in memory
+        print(f"save video to {dump_video_path}")
+        with VideoWriter(dump_video_path, fps=render_fps, verbose=True) as video_writer:
+            for batch_i, batch_end, res in render_memory.render(
+                camera_size,
+                render,
+                num_gaussians=gs_model_list[0].offset_xyz.shape[0],
+                height=int(render_intrs[0, 0, 1, 2] * 2),
+                width=int(render_intrs[0, 0, 0, 2] * 2),
+                dtype=gs_model_list[0].offset_xyz.dtype,
+            ):
+                print(f"batch: {batch_i}-{batch_end}, total: {camera_size}")
+
+                comp_rgb = res["comp_rgb"] # [Nv, H, W, 3], 0-1
+                comp_mask = res["comp_mask"] # [Nv, H, W, 3], 0-1
+                comp_mask[comp_mask < 0.5] = 0.0
+
+                batch_rgb = comp_rgb * comp_mask + (1 - comp_mask) * 1
+                batch_rgb = (batch_rgb.clamp(0,1) * 255).to(torch.uint8).detach().cpu().numpy()
+                if vis_motion:
+                    batch_vis_ref_img = np.tile(
+                        cv2.resize(vis_ref_img, (batch_rgb.shape[2], batch_rgb.shape[1]))[
+                            None, :, :, :
+                        ],
+                        (batch_rgb.shape[0], 1, 1, 1),
+                    )
+                    batch_rgb = np.concatenate(
+                        [
+                            batch_rgb,
+                            motion_seq["vis_motion_render"][batch_i:batch_end],
+                            batch_vis_ref_img,
+                        ],
+                        axis=2,
+                    )
+
+                video_writer.write(batch_rgb)
 
-            del res
-            torch.cuda.empty_cache()
+                del res, comp_rgb, comp_mask
         
-        rgb = np.concatenate(batch_list, axis=0)
         print(f"time elapsed: {time.time() - start_time}")
 
-        if vis_motion:
-            # print(rgb.shape, motion_seq["vis_motion_render"].shape)
-
-            vis_ref_img = np.tile(
-                cv2.resize(vis_ref_img, (rgb[0].shape[1], rgb[0].shape[0]))[
-                    None, :, :, :
-                ],
-                (rgb.shape[0], 1, 1, 1),
-            )
-            rgb = np.concatenate(
-                [rgb, motion_seq["vis_motion_render"], vis_ref_img], axis=2
-            )
-
-        os.makedirs(os.path.dirname(dump_video_path), exist_ok=True)
-
-        images_to_video(
-            rgb,
-            output_path=dump_video_path,
-            fps=render_fps,
-            gradio_codec=False,
-            verbose=True,
-        )
 
 
         return dump_image_path, dump_video_path
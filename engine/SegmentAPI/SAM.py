@@ -391,6 +391,9 @@ class SAM2Seg(BaseSeg):
             return cur_ratio
 
     def get_img(self, img_path, sup_res=True):
+        # img_path: image path or an already decoded uint8 RGB array [H, W, 3]
+        if isinstance(img_path, np.ndarray):
+            return np.ascontiguousarray(img_path[..., :3])
 
         img = cv2.imread(img_path)
         img = img[..., ::-1].copy()  # bgr2rgb
@@ -102,12 +102,29 @@ class DetectionModel(object):
         all_bboxes = np.concatenate(all_bboxes)
         return all_poses, all_bboxes
         
-    def track(self, img, fps, length):
+    def detect_person(self, imgs, batch_size=16):
+        """YOLO person boxes of a list of images, batch_size images per forward.
+        Returns a list of xyxy arrays [N_i, 4]."""
+        all_bboxes = []
+        for i in range(0, len(imgs), batch_size):
+            results = self.bbox_model.predict(
+                imgs[i:i+batch_size], device=self.device, classes=0, conf=BBOX_CONF, save=False, verbose=False
+            )
+            all_bboxes.extend([result.boxes.xyxy.detach().cpu().numpy() for result in results])
+        return all_bboxes
+
+    def track(self, img, fps, length=None):
         # bbox detection
-        bboxes = self.bbox_model.predict(
-            img, device=self.device, classes=0, conf=BBOX_CONF, save=False, verbose=False
-        )[0].boxes.xyxy.detach().cpu().numpy()
+        bboxes = self.detect_person([img])[0]
+        self.associate(bboxes, fps)
+
+    def track_batch(self, imgs, fps, batch_size=16):
+        """same as calling track on each image in order, but the detection runs in batches."""
+        for bboxes in self.detect_person(imgs, batch_size):
+            self.associate(bboxes, fps)
 
+    def associate(self, bboxes, fps):
+        # the association depends on the previous frame, so it always runs sequentially
         pose_results = [{'bbox': bbox} for bbox in bboxes]
         
        
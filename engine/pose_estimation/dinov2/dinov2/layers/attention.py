@@ -10,7 +10,10 @@
 import logging
 import os
 import warnings
+from typing import Callable, Dict, Optional
 
+import torch
+import torch.nn.functional as F
 from torch import Tensor
 from torch import nn
 
@@ -33,6 +36,103 @@ except ImportError:
     warnings.warn("xFormers is not available (Attention)")
 
 
+# Attention backends: q, k, v are [B, N, H, D], returns [B, N, H, D].
+#   xformers: memory_efficient_attention, the only one supporting xFormers attn_bias objects (nested tensors)
+#   sdpa: torch.nn.functional.scaled_dot_product_attention (flash / memory-efficient kernels)
+#   chunked: softmax attention over blocks of DINOV2_ATTENTION_CHUNK_SIZE queries, bounded memory on CPU
+#   math: the reference q @ k.T softmax attention
+# DINOV2_ATTENTION_BACKEND forces one of them, otherwise xformers or sdpa on GPU and chunked on CPU.
+ATTENTION_BACKEND = os.environ.get("DINOV2_ATTENTION_BACKEND")
+ATTENTION_CHUNK_SIZE = int(os.environ.get("DINOV2_ATTENTION_CHUNK_SIZE", 1024))
+
+
+def _softmax_attention(q: Tensor, k: Tensor, v: Tensor, attn_bias, dropout_p: float, chunk_size: int) -> Tensor:
+    q, k, v = q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2)  # [B, H, N, D]
+    q = q * q.shape[-1] ** -0.5
+    k_t = k.transpose(-2, -1)
+
+    out = []
+    for start in range(0, q.shape[2], chunk_size):
+        attn = q[:, :, start : start + chunk_size] @ k_t
+        if attn_bias is not None:
+            bias = attn_bias[..., start : start + chunk_size, :]
+            if bias.dtype == torch.bool:
+                attn = attn.masked_fill(~bias, float("-inf"))
+            else:
+                attn = attn + bias
+        attn = attn.softmax(dim=-1)
+        if dropout_p > 0:
+            attn = F.dropout(attn, p=dropout_p)
+        out.append(attn @ v)
+    return torch.cat(out, dim=2).transpose(1, 2)
+
+
+def _attention_math(q: Tensor, k: Tensor, v: Tensor, attn_bias=None, dropout_p: float = 0.0) -> Tensor:
+    return _softmax_attention(q, k, v, attn_bias, dropout_p, chunk_size=q.shape[1])
+
+
+def _attention_chunked(q: Tensor, k: Tensor, v: Tensor, attn_bias=None, dropout_p: float = 0.0) -> Tensor:
+    return _softmax_attention(q, k, v, attn_bias, dropout_p, chunk_size=ATTENTION_CHUNK_SIZE)
+
+
+def _attention_sdpa(q: Tensor, k: Tensor, v: Tensor, attn_bias=None, dropout_p: float = 0.0) -> Tensor:
+    x = F.scaled_dot_product_attention(
+        q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2), attn_mask=attn_bias, dropout_p=dropout_p
+    )
+    return x.transpose(1, 2)
+
+
+def _attention_xformers(q: Tensor, k: Tensor, v: Tensor, attn_bias=None, dropout_p: float = 0.0) -> Tensor:
+    return memory_efficient_attention(q, k, v, attn_bias=attn_bias, p=dropout_p)
+
+
+ATTENTION_BACKENDS: Dict[str, Callable[..., Tensor]] = {
+    "math": _attention_math,
+    "chunked": _attention_chunked,
+}
+if hasattr(F, "scaled_dot_product_attention"):
+    ATTENTION_BACKENDS["sdpa"] = _attention_sdpa
+if XFORMERS_AVAILABLE:
+    ATTENTION_BACKENDS["xformers"] = _attention_xformers
+
+# device type -> backend name, filled on first use
+_selected_backends: Dict[str, str] = {}
+
+
+def register_attention_backend(name: str, fn: Callable[..., Tensor]) -> None:
+    ATTENTION_BACKENDS[name] = fn
+    _selected_backends.clear()
+
+
+def get_attention_backend(device_type: str) -> str:
+    """name of the backend used on device_type ("cuda", "cpu", ...), reported once."""
+    name = _selected_backends.get(device_type)
+    if name is None:
+        if device_type == "cuda":
+            candidates = ["xformers", "sdpa", "chunked"]
+        else:
+            candidates = ["chunked"]
+        if ATTENTION_BACKEND is not None:
+            if ATTENTION_BACKEND in ATTENTION_BACKENDS:
+                candidates = [ATTENTION_BACKEND]
+            else:
+                warnings.warn(f"attention backend {ATTENTION_BACKEND} is not available, using the default one")
+        name = next(c for c in candidates if c in ATTENTION_BACKENDS)
+        _selected_backends[device_type] = name
+        logger.info(f"using {name} attention on {device_type}")
+    return name
+
+
+def attention(q: Tensor, k: Tensor, v: Tensor, attn_bias=None, dropout_p: float = 0.0) -> Tensor:
+    """q, k, v: [B, N, H, D] -> [B, N, H, D]. attn_bias: additive / boolean mask tensor or xFormers bias."""
+    if attn_bias is not None and not isinstance(attn_bias, Tensor):
+        if not XFORMERS_AVAILABLE:
+            raise AssertionError("xFormers is required for using nested tensors")
+        return _attention_xformers(q, k, v, attn_bias=attn_bias, dropout_p=dropout_p)
+    backend = ATTENTION_BACKENDS[get_attention_backend(q.device.type)]
+    return backend(q, k, v, attn_bias=attn_bias, dropout_p=dropout_p)
+
+
 class Attention(nn.Module):
     def __init__(
         self,
@@ -53,17 +153,16 @@ class Attention(nn.Module):
         self.proj = nn.Linear(dim, dim, bias=proj_bias)
         self.proj_drop = nn.Dropout(proj_drop)
 
-    def forward(self, x: Tensor) -> Tensor:
+    def forward(self, x: Tensor, attn_bias: Optional[Tensor] = None) -> Tensor:
         B, N, C = x.shape
-        qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
+        qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads)
 
-        q, k, v = qkv[0] * self.scale, qkv[1], qkv[2]
-        attn = q @ k.transpose(-2, -1)
+        q, k, v = qkv.unbind(2)
 
-        attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
+        dropout_p = self.attn_drop.p if self.training else 0.0
+        x = attention(q, k, v, attn_bias=attn_bias, dropout_p=dropout_p)
+        x = x.reshape([B, N, C])
 
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -71,19 +170,4 @@ class Attention(nn.Module):
 
 class MemEffAttention(Attention):
     def forward(self, x: Tensor, attn_bias=None) -> Tensor:
-        if not XFORMERS_AVAILABLE:
-            if attn_bias is not None:
-                raise AssertionError("xFormers is required for using nested tensors")
-            return super().forward(x)
-
-        B, N, C = x.shape
-        qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads)
-
-        q, k, v = unbind(qkv, 2)
-
-        x = memory_efficient_attention(q, k, v, attn_bias=attn_bias)
-        x = x.reshape([B, N, C])
-
-        x = self.proj(x)
-        x = self.proj_drop(x)
-        return x
+        return super().forward(x, attn_bias=attn_bias)
@@ -71,6 +71,36 @@ def load_model(ckpt_path, model_path, device=torch.device("cuda")):
     return model
 
 
+def forward_model_batch(
+    model,
+    input_images,
+    camera_parameters,
+    det_thresh=0.3,
+    nms_kernel_size=1,
+    pseudo_idx_list=None,
+    max_dist_list=None,
+):
+    """forward_model on a batch of images [bs,3,H,W], returns the humans of each image."""
+    bs = input_images.shape[0]
+    if pseudo_idx_list is None:
+        pseudo_idx_list = [None] * bs
+    if max_dist_list is None:
+        max_dist_list = [None] * bs
+
+    with torch.no_grad():
+        with torch.cuda.amp.autocast(enabled=True):
+            humans_list = model.forward_batch(
+                input_images,
+                pseudo_idx_list,
+                max_dist_list,
+                nms_kernel_size=int(nms_kernel_size),
+                det_thresh=det_thresh,
+                K=camera_parameters,
+            )
+
+    return humans_list
+
+
 def forward_model(
     model,
     input_image,
@@ -407,7 +437,6 @@ class Model(nn.Module):
             - y: [bs,D,16,16]
         """
         persons = []
-        out = {}
 
         # Feature extraction
         z = self.backbone(x)
@@ -429,6 +458,75 @@ class Model(nn.Module):
             # no humans detected in the frame
             return persons
 
+        return self.regress(x, z, N, scores, scores_det, idx, K, is_training)
+
+    def forward_batch(
+        self,
+        x,
+        idx_list,
+        max_dist_list,
+        det_thresh=0.3,
+        nms_kernel_size=3,
+        K=None,
+    ):
+        """
+        Inference on a batch of images, each with its own search area of the primary keypoint.
+        Args:
+            - x: RGB images - [bs,3,H,W]
+            - idx_list: pseudo_idx of each image, see forward(idx=...), None for no search area
+            - max_dist_list: max_dist of each image
+            - K: cameras - [bs,3,3] or [1,3,3]
+        Return:
+            - list of bs lists of persons, same as forward() on each image
+        """
+        bs = x.shape[0]
+        if K.shape[0] == 1:
+            K = K.expand(bs, -1, -1)
+
+        # Feature extraction
+        z = self.backbone(x)
+        B, N, C = z.size()
+
+        # Detection, per image since the search area differs
+        keep, scores, scores_det, idx = [], [], [], []
+        for b in range(bs):
+            _scores, _scores_det, _idx = self.detection(
+                z[b : b + 1],
+                nms_kernel_size=nms_kernel_size,
+                det_thresh=det_thresh,
+                N=N,
+                idx=idx_list[b],
+                max_dist=max_dist_list[b],
+                is_training=False,
+            )
+            if torch.any(_scores_det < 0.1) or len(_idx[1]) == 0:
+                continue
+            # images without humans are dropped, so that the batch index stays dense
+            _idx = (torch.full_like(_idx[0], len(keep)),) + tuple(_idx[1:])
+            keep.append(b)
+            scores.append(_scores)
+            scores_det.append(_scores_det)
+            idx.append(_idx)
+
+        persons_list = [[] for _ in range(bs)]
+        if len(keep) == 0:
+            return persons_list
+
+        scores = torch.cat(scores)
+        scores_det = torch.cat(scores_det)
+        idx = tuple(torch.cat([_idx[i] for _idx in idx]) for i in range(4))
+        persons = self.regress(
+            x[keep], z[keep], N, scores, scores_det, idx, K[keep], is_training=False
+        )
+        for person, b in zip(persons, idx[0].tolist()):
+            persons_list[keep[b]].append(person)
+        return persons_list
+
+    def regress(self, x, z, N, scores, scores_det, idx, K, is_training=False):
+        """SMPL-X regression of the detected humans, idx: detections of the whole batch."""
+        persons = []
+        out = {}
+
         # Map of Dense Feature
         z = unpatch(
             z, patch_size=1, c=z.shape[2], img_size=int(np.sqrt(N))
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# @Function      : single-file columnar storage of SMPL-X motion sequences
+
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+
+MOTION_PACK_NAME = "motion.npy"
+MOTION_PACK_VERSION = 2
+
+# per-frame float32 arrays, frame axis first
+MOTION_KEYS = [
+    "betas",
+    "root_pose",
+    "body_pose",
+    "jaw_pose",
+    "leye_pose",
+    "reye_pose",
+    "lhand_pose",
+    "rhand_pose",
+    "trans",
+    "focal",
+    "princpt",
+    "img_size_wh",
+    "expr",
+]
+
+
+def motion_pack_header_path(pack_path):
+    """json header next to the flat array, e.g. motion.npy -> motion.header"""
+    return os.path.splitext(pack_path)[0] + ".header"
+
+
+def find_motion_pack(motion_path):
+    """return the packed motion of a smplx_params directory (or a .npy path), None if absent."""
+    if motion_path is None:
+        return None
+    if os.path.isfile(motion_path) and motion_path.endswith(".npy"):
+        return motion_path
+    pack_path = os.path.join(motion_path, MOTION_PACK_NAME)
+    if os.path.isfile(pack_path) and os.path.isfile(motion_pack_header_path(pack_path)):
+        return pack_path
+    return None
+
+
+def save_motion_pack(pack_path, frame_names, smplx_params, meta=None):
+    """
+    The columns are stored back to back in one flat float32 .npy, each column contiguous, and
+    their offsets and shapes in a json header (see motion_pack_header_path).
+
+    Args:
+        pack_path (str): output .npy file.
+        frame_names (list[str]): frame name of each row, e.g. "00001".
+        smplx_params (dict): key -> array [N, ...], see MOTION_KEYS.
+        meta (dict, optional): small json-serializable header, e.g. pad_ratio, fps.
+    """
+    arrays = {
+        k: np.ascontiguousarray(np.asarray(v, dtype=np.float32))
+        for k, v in smplx_params.items()
+        if k in MOTION_KEYS
+    }
+    num_frames = len(frame_names)
+    for k, v in arrays.items():
+        assert v.shape[0] == num_frames, f"{k}: {v.shape[0]} rows, {num_frames} frames"
+
+    columns = {}
+    offset = 0
+    for k, v in arrays.items():
+        columns[k] = dict(offset=offset, shape=list(v.shape))
+        offset += v.size
+
+    header = dict(meta or {})
+    header["version"] = MOTION_PACK_VERSION
+    header["num_frames"] = num_frames
+    header["size"] = offset
+    header["frame_names"] = list(frame_names)
+    header["columns"] = columns
+
+    os.makedirs(os.path.dirname(os.path.abspath(pack_path)), exist_ok=True)
+    flat = (
+        np.concatenate([v.reshape(-1) for v in arrays.values()])
+        if len(arrays) > 0
+        else np.zeros(0, dtype=np.float32)
+    )
+    # write then rename, the loader checks the array size against the header
+    tmp_path = f"{pack_path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, flat)
+    header_path = motion_pack_header_path(pack_path)
+    tmp_header_path = f"{header_path}.{os.getpid()}.tmp"
+    with open(tmp_header_path, "w") as f:
+        json.dump(header, f)
+    os.replace(tmp_path, pack_path)
+    os.replace(tmp_header_path, header_path)
+
+
+def load_motion_pack(pack_path):
+    """
+    The flat array is memory-mapped copy-on-write, every column is a view of it: nothing is
+    read or copied until a frame is used.
+    Returns:
+        frame_names (list[str]), smplx_params (dict key -> float32 array [N, ...]), header (dict)
+    """
+    with open(motion_pack_header_path(pack_path)) as f:
+        header = json.load(f)
+    assert (
+        header["version"] == MOTION_PACK_VERSION
+    ), f"unsupported motion pack version {header['version']}, re-pack the motion"
+
+    flat = np.load(pack_path, mmap_mode="c", allow_pickle=False)
+    assert flat.dtype == np.float32 and flat.shape == (
+        header["size"],
+    ), f"motion pack {pack_path} does not match its header"
+
+    smplx_params = {}
+    for k, column in header["columns"].items():
+        shape = column["shape"]
+        size = int(np.prod(shape))
+        smplx_params[k] = flat[column["offset"] : column["offset"] + size].reshape(shape)
+    return header["frame_names"], smplx_params, header
+
+
+def pack_smplx_params_dir(smplx_params_dir, pack_path=None):
+    """convert a directory of per-frame SMPL-X json files into a motion pack."""
+    if pack_path is None:
+        pack_path = os.path.join(smplx_params_dir, MOTION_PACK_NAME)
+
+    json_files = sorted(glob.glob(os.path.join(smplx_params_dir, "*.json")))
+    assert len(json_files) > 0, f"no smplx json found in {smplx_params_dir}"
+
+    frame_names = []
+    columns = {}
+    meta = {}
+    for json_file in json_files:
+        with open(json_file) as f:
+            smplx_param = json.load(f)
+        frame_names.append(os.path.splitext(os.path.basename(json_file))[0])
+        if "pad_ratio" in smplx_param:
+            meta["pad_ratio"] = smplx_param["pad_ratio"]
+        for k in MOTION_KEYS:
+            if k in smplx_param:
+                columns.setdefault(k, []).append(smplx_param[k])
+
+    for k, v in columns.items():
+        assert len(v) == len(frame_names), f"{k} is missing in some frames"
+
+    save_motion_pack(pack_path, frame_names, columns, meta)
+    return pack_path
+
+
+def get_parse():
+    parser = argparse.ArgumentParser(
+        description="pack per-frame smplx_params json files into a single motion file"
+    )
+    parser.add_argument(
+        "smplx_params_dirs", nargs="+", type=str, help="smplx_params directories"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = get_parse()
+    for smplx_params_dir in opt.smplx_params_dirs:
+        print(f"{smplx_params_dir} -> {pack_smplx_params_dir(smplx_params_dir)}")
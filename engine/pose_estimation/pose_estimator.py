@@ -127,9 +127,13 @@ class PoseEstimator:
 
     @torch.no_grad()
     def __call__(self, img_path):
+        # img_path: image path or an already decoded uint8 RGB array [H, W, 3]
         # image_tensor H W C
 
-        img_np = np.asarray(Image.open(img_path).convert("RGB"))
+        if isinstance(img_path, np.ndarray):
+            img_np = img_path[..., :3]
+        else:
+            img_np = np.asarray(Image.open(img_path).convert("RGB"))
 
         raw_h, raw_w, _ = img_np.shape
 
@@ -22,18 +22,20 @@ import sys
 import time
 
 import cv2
+import imageio
 import numpy as np
 import torch
 import torch.nn.functional as F
 from blocks import SMPL_Layer
 from blocks.detector import DetectionModel
-from model import forward_model, load_model
+from model import forward_model_batch, load_model
 from pose_utils.constants import KEYPOINT_THR
 from pose_utils.image import img_center_padding, normalize_rgb_tensor
 from pose_utils.inference_utils import get_camera_parameters
 from pose_utils.postprocess import OneEuroFilter, smplx_gs_smooth
-from pose_utils.render import render_video
+from pose_utils.render import Renderer, render_frame
 from pose_utils.tracker import bbox_xyxy_to_cxcywh, track_by_area
+from motion_pack import MOTION_PACK_NAME, save_motion_pack
 from smplify import TemporalSMPLify
 
 torch.cuda.empty_cache()
@@ -42,90 +44,156 @@ np.random.seed(seed=0)
 random.seed(0)
 
 
-def load_video(video_path, pad_ratio, max_resolution):
-    frames = []
-    for i in range(2):
-        cap = cv2.VideoCapture(video_path)
-        assert cap.isOpened(), f"fail to load video file {video_path}"
-        fps = cap.get(cv2.CAP_PROP_FPS)
-    
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        downsample_factor = -1
-        if (height * width) > max_resolution:
-            downsample_factor = sqrt(max_resolution / (height * width))
-            height = int(height * downsample_factor)
-            width = int(width * downsample_factor)
-
-        
-        offset_w, offset_h = 0, 0
+VIDEO_CHUNK_SIZE = 128
+
+
+def _open_video(video_path, max_resolution):
+    cap = cv2.VideoCapture(video_path)
+    assert cap.isOpened(), f"fail to load video file {video_path}"
+
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    resize_wh = None
+    if (height * width) > max_resolution:
+        downsample_factor = sqrt(max_resolution / (height * width))
+        resize_wh = (int(width * downsample_factor), int(height * downsample_factor))
+    return cap, resize_wh
+
+
+def _transform_frame(frame, pad_ratio, resize_wh):
+    # since the tracker and detector receive BGR images as inputs
+    # frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    if resize_wh is not None:
+        frame = cv2.resize(frame, resize_wh, interpolation=cv2.INTER_AREA)
+    offset_w, offset_h = 0, 0
+    if pad_ratio > 0:
+        frame, offset_w, offset_h = img_center_padding(frame, pad_ratio)
+    return frame, offset_w, offset_h
+
+
+def probe_video(video_path, pad_ratio, max_resolution):
+    """height, width (after resizing and padding), fps, offset_w, offset_h of a video,
+    computed from its first frame only."""
+    cap, resize_wh = _open_video(video_path, max_resolution)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    flag, frame = cap.read()
+    cap.release()
+    assert flag, f"empty video file {video_path}"
+
+    frame, offset_w, offset_h = _transform_frame(frame, pad_ratio, resize_wh)
+    height, width, _ = frame.shape
+    return height, width, fps, offset_w, offset_h
+
+
+def iter_video_chunks(video_path, pad_ratio, max_resolution, chunk_size=VIDEO_CHUNK_SIZE):
+    """decode a video lazily.
+
+    Yields:
+        start (int): frame id of the first frame in the chunk.
+        frames (list[np.ndarray]): at most chunk_size resized and padded BGR frames.
+    """
+    cap, resize_wh = _open_video(video_path, max_resolution)
+    start, frames = 0, []
+    try:
         while cap.isOpened():
             flag, frame = cap.read()
             if not flag:
                 break
+            frames.append(_transform_frame(frame, pad_ratio, resize_wh)[0])
+            if len(frames) == chunk_size:
+                yield start, frames
+                start += len(frames)
+                frames = []
+        if len(frames) > 0:
+            yield start, frames
+    finally:
+        cap.release()
 
-            # since the tracker and detector receive BGR images as inputs
-            # frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            if downsample_factor > 0:
-                frame = cv2.resize(
-                    frame,
-                    (width, height),
-                    interpolation=cv2.INTER_AREA,
-                )
-            if pad_ratio > 0:
-                frame, offset_w, offset_h = img_center_padding(frame, pad_ratio)
-            frames.append(frame)
-        height, width, _ = frames[0].shape
+
+def load_video(video_path, pad_ratio, max_resolution):
+    """decode the whole video into memory, prefer iter_video_chunks for long videos."""
+    height, width, fps, offset_w, offset_h = probe_video(
+        video_path, pad_ratio, max_resolution
+    )
+    frames = []
+    for _, chunk in iter_video_chunks(video_path, pad_ratio, max_resolution):
+        frames.extend(chunk)
     return frames, height, width, fps, offset_w, offset_h
 
 
 def images_crop(images, bboxes, target_size, device=torch.device("cuda")):
-    # bboxes: cx, cy, w, h
-    crop_img_list = []
-    crop_annotations = []
-    i = 0
-    raw_img_size = max(images[0].shape[:2])
-    for img, bbox in zip(images, bboxes):
-
-        left = max(0, int(bbox[0] - bbox[2] // 2))
-        right = min(img.shape[1] - 1, int(bbox[0] + bbox[2] // 2))
-        top = max(0, int(bbox[1] - bbox[3] // 2))
-        bottom = min(img.shape[0] - 1, int(bbox[1] + bbox[3] // 2))
-        crop_img = img[top:bottom, left:right]
-        crop_img = torch.Tensor(crop_img).to(device).unsqueeze(0).permute(0, 3, 1, 2)
-
-        _, _, h, w = crop_img.shape
-        scale_factor = min(target_size / w, target_size / h)
-        crop_img = F.interpolate(crop_img, scale_factor=scale_factor, mode="bilinear")
-
-        _, _, h, w = crop_img.shape
-        pad_left = (target_size - w) // 2
-        pad_top = (target_size - h) // 2
-        pad_right = target_size - w - pad_left
-        pad_bottom = target_size - h - pad_top
-        crop_img = F.pad(
-            crop_img,
-            (pad_left, pad_right, pad_top, pad_bottom),
-            mode="constant",
-            value=0,
-        )
+    """crop, resize (bilinear) and center pad a batch of same-sized frames with one grid_sample.
+
+    Args:
+        images (list[np.ndarray]): [H, W, 3] frames.
+        bboxes: [B, 4] cx, cy, w, h.
+    Returns:
+        crop_imgs (torch.Tensor): normalized [B, 3, target_size, target_size].
+        crop_annotations (list[tuple]): left, top, pad_left, pad_top, scale_factor,
+            crop_size, raw_img_size of each crop.
+    """
+    img_h, img_w = images[0].shape[:2]
+    raw_img_size = max(img_h, img_w)
+
+    bboxes = torch.as_tensor(bboxes).detach().float().cpu().numpy()
+    half_w, half_h = bboxes[:, 2] // 2, bboxes[:, 3] // 2
+    left = np.maximum(0, np.trunc(bboxes[:, 0] - half_w).astype(np.int64))
+    right = np.minimum(img_w - 1, np.trunc(bboxes[:, 0] + half_w).astype(np.int64))
+    top = np.maximum(0, np.trunc(bboxes[:, 1] - half_h).astype(np.int64))
+    bottom = np.minimum(img_h - 1, np.trunc(bboxes[:, 1] + half_h).astype(np.int64))
+    crop_w, crop_h = right - left, bottom - top
+
+    scale_factor = np.minimum(target_size / crop_w, target_size / crop_h)
+    resize_w = np.floor(crop_w * scale_factor).astype(np.int64)
+    resize_h = np.floor(crop_h * scale_factor).astype(np.int64)
+    pad_left = (target_size - resize_w) // 2
+    pad_top = (target_size - resize_h) // 2
+
+    def _source_coords(start, size, pad, resize):
+        # F.interpolate(mode="bilinear", align_corners=False) source pixel of each output pixel
+        dst = np.arange(target_size)[None] - pad[:, None]
+        src = (dst + 0.5) / scale_factor[:, None] - 0.5
+        src = np.clip(src, 0, (size - 1)[:, None]) + start[:, None]
+        valid = (dst >= 0) & (dst < resize[:, None])
+        return src, valid
+
+    src_x, valid_x = _source_coords(left, crop_w, pad_left, resize_w)
+    src_y, valid_y = _source_coords(top, crop_h, pad_top, resize_h)
+
+    # pixel -> [-1, 1], align_corners=False
+    grid_x = torch.tensor(2 * (src_x + 0.5) / img_w - 1, dtype=torch.float32)
+    grid_y = torch.tensor(2 * (src_y + 0.5) / img_h - 1, dtype=torch.float32)
+    grid = torch.stack(
+        [
+            grid_x[:, None, :].expand(-1, target_size, -1),
+            grid_y[:, :, None].expand(-1, -1, target_size),
+        ],
+        dim=-1,
+    ).to(device)
+    valid = torch.tensor(valid_y[:, :, None] & valid_x[:, None, :], device=device)
 
-        resize_img = normalize_rgb_tensor(crop_img)
-
-        crop_img_list.append(resize_img)
-        crop_annotations.append(
-            (
-                left,
-                top,
-                pad_left,
-                pad_top,
-                scale_factor,
-                target_size / scale_factor,
-                raw_img_size,
-            )
+    imgs = torch.from_numpy(np.stack(images)).to(device)
+    imgs = imgs.permute(0, 3, 1, 2).float()
+    crop_imgs = F.grid_sample(
+        imgs, grid, mode="bilinear", padding_mode="border", align_corners=False
+    )
+    crop_imgs = crop_imgs * valid[:, None]
+    crop_imgs = normalize_rgb_tensor(crop_imgs)
+
+    crop_annotations = [
+        (
+            int(left[i]),
+            int(top[i]),
+            int(pad_left[i]),
+            int(pad_top[i]),
+            float(scale_factor[i]),
+            target_size / float(scale_factor[i]),
+            raw_img_size,
         )
+        for i in range(len(images))
+    ]
 
-    return crop_img_list, crop_annotations
+    return crop_imgs, crop_annotations
 
 
 def generate_pseudo_idx(keypoints, patch_size, n_patch, crop_annotation):
@@ -304,6 +372,10 @@ class Video2MotionPipeline:
         visualize=True,  #是否保存可视化视频；
         pad_ratio=0.2, #图像padding比例，保证人体居中；
         fov=60,  # 相机视角（60度）；
+        save_json=False,  # 额外保存逐帧 smplx json（旧格式）
+        chunk_size=VIDEO_CHUNK_SIZE,  # 每次解码的帧数，决定峰值内存
+        detection_batch_size=16,  # YOLO 人体检测的 batch 大小
+        hmr_batch_size=8,  # Multi-HMR 的 batch 大小
     ):
         # self.pose_model        # 姿态回归模型（如 Multi-HMR）
         # self.keypoint_detector # ViTPose 检测器（2D全身关键点）
@@ -315,6 +387,10 @@ class Video2MotionPipeline:
         self.kp_mode = kp_mode
         self.pad_ratio = pad_ratio
         self.fov = fov
+        self.save_json = save_json
+        self.chunk_size = chunk_size
+        self.detection_batch_size = detection_batch_size
+        self.hmr_batch_size = hmr_batch_size
         self.fps = None
         self.pose_model, self.keypoint_detector, self.smplx_model = load_models(
             model_path, self.device
@@ -324,10 +400,14 @@ class Video2MotionPipeline:
             smpl=self.smplx_model, device=self.device, num_steps=fitting_steps
         )
 
-    def track(self, all_frames):
+    def track(self, video_chunks):
         self.keypoint_detector.initialize_tracking()
-        for frame in all_frames:
-            self.keypoint_detector.track(frame, self.fps, len(all_frames))
+        video_length = 0
+        for _, frames in video_chunks:
+            self.keypoint_detector.track_batch(
+                frames, self.fps, batch_size=self.detection_batch_size
+            )
+            video_length += len(frames)
         tracking_results = self.keypoint_detector.process(self.fps)
         # note: only surpport pose estimation for one character
         main_character = None
@@ -339,10 +419,21 @@ class Video2MotionPipeline:
 
         bboxes = tracking_results[main_character]["bbox"]
         frame_ids = tracking_results[main_character]["frame_id"]
-        frames = [all_frames[i] for i in frame_ids]
         assert not (bboxes[0][0] == 0 and bboxes[0][2] == 0)
 
-        return bboxes, frame_ids, frames
+        return bboxes, frame_ids, video_length
+
+    def select_frames(self, video_chunks, frame_ids):
+        """
+        Yields:
+            rows (np.ndarray): indices into frame_ids of the frames in the chunk.
+            frames (list[np.ndarray]): the corresponding frames.
+        """
+        frame_ids = np.asarray(frame_ids)
+        for start, frames in video_chunks:
+            lo, hi = np.searchsorted(frame_ids, [start, start + len(frames)])
+            if hi > lo:
+                yield np.arange(lo, hi), [frames[i - start] for i in frame_ids[lo:hi]]
 
     def detect_keypoint2d(self, bboxes, frames):
         if self.kp_mode == "vitpose":
@@ -351,7 +442,8 @@ class Video2MotionPipeline:
             raise NotImplementedError
         return bboxes, keypoints
 
-    def estimate_pose(self, frame_ids, frames, keypoints, bboxes, raw_K, video_length):
+    def regress_pose(self, frames, keypoints, bboxes):
+        """Multi-HMR on the crops of a chunk of frames, return the target human of each frame."""
         target_img_size = self.pose_model.img_size
         patch_size = self.pose_model.patch_size
 
@@ -364,33 +456,56 @@ class Video2MotionPipeline:
         bboxes = torch.tensor(bboxes, device=self.device)
         bboxes = bbox_xyxy_to_cxcywh(bboxes, scale=1.5)
 
-        # - 图像裁剪与归一化
-        crop_images, crop_annotations = images_crop(
-            frames, bboxes, target_size=target_img_size, device=self.device
-        )
+        frame_results = []
+        for i in range(0, len(frames), self.hmr_batch_size):
+            batch = slice(i, i + self.hmr_batch_size)
 
-        all_frame_results = []
-        # model inference
-        for i, image in enumerate(crop_images):
+            # - 图像裁剪与归一化
+            crop_images, crop_annotations = images_crop(
+                frames[batch],
+                bboxes[batch],
+                target_size=target_img_size,
+                device=self.device,
+            )
 
             # Calculate the possible search area for the primary joint (head) based on 2D keypoints
             # pseudo_idx: The index of the search area center after patching
             # max_dist: The maximum radius of the search area
             # - 推理与关键区域注意力（pseudo_idx）
-            pseudo_idx, max_dist = generate_pseudo_idx(
-                keypoints[i],
-                patch_size,
-                int(target_img_size / patch_size),
-                crop_annotations[i],
+            pseudo_idx_list, max_dist_list = zip(
+                *[
+                    generate_pseudo_idx(
+                        keypoint,
+                        patch_size,
+                        int(target_img_size / patch_size),
+                        crop_annotation,
+                    )
+                    for keypoint, crop_annotation in zip(
+                        keypoints[batch], crop_annotations
+                    )
+                ]
             )
-            humans = forward_model(
-                self.pose_model, image, K, pseudo_idx=pseudo_idx, max_dist=max_dist
+            humans_list = forward_model_batch(
+                self.pose_model,
+                crop_images,
+                K,
+                pseudo_idx_list=pseudo_idx_list,
+                max_dist_list=max_dist_list,
             )
             # - 选取主人体 & 还原位姿
-            target_human = track_by_area(humans, target_img_size)
-            target_human = project2origin_img(target_human, crop_annotations[i])
+            for humans, crop_annotation in zip(humans_list, crop_annotations):
+                target_human = track_by_area(humans, target_img_size)
+                target_human = project2origin_img(target_human, crop_annotation)
+                frame_results.append(target_human)
+
+        return frame_results
 
-            all_frame_results.append(target_human)
+    def estimate_pose(
+        self, frame_ids, all_frame_results, keypoints, bboxes, raw_K, video_length
+    ):
+        keypoints = torch.tensor(keypoints, device=self.device)
+        bboxes = torch.tensor(bboxes, device=self.device)
+        bboxes = bbox_xyxy_to_cxcywh(bboxes, scale=1.5)
 
         # parse chunk & missed frame padding
         data_chunks = parse_chunks(
@@ -404,7 +519,8 @@ class Video2MotionPipeline:
         trans_cam_fill = np.zeros((video_length, 3))
         smpl_poses_cam_fill = np.zeros((video_length, 55, 3))
         smpl_shapes_fill = np.zeros((video_length, 10))
-        all_verts = [None] * video_length
+        # meshes are only kept for visualization
+        all_verts = [None] * video_length if self.visualize else None
         for data_chunk in data_chunks:
             # one_euro filter on 2d keypoints
 
@@ -451,6 +567,8 @@ class Video2MotionPipeline:
                 smpl_shapes_fill[data_chunk["frame_id"]] = betas.cpu().numpy()
                 trans_cam_fill[data_chunk["frame_id"]] = transl.cpu().numpy()
 
+            if all_verts is None:
+                continue
             for i, frame_id in enumerate(data_chunk["frame_id"]):
                 try:
                     if all_verts[frame_id] is None:
@@ -462,51 +580,84 @@ class Video2MotionPipeline:
         return smpl_poses_cam_fill, smpl_shapes_fill, trans_cam_fill, all_verts
 
     def save_video(
-        self, all_frames, frame_ids, bboxes, keypoints, verts, K, out_folder
+        self, video_chunks, frame_ids, bboxes, keypoints, verts, K, img_wh, out_folder
     ):
-        all_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in all_frames]
         save_name = os.path.join(out_folder, "pose_visualized.mp4")
-
-        # 2d keypoints visualization
-        for i, frame_id in enumerate(frame_ids):
-            keypoint_results = [{"bbox": bboxes[i], "keypoints": keypoints[i]}]
-
-            all_frames[frame_id] = self.keypoint_detector.visualize(
-                all_frames[frame_id], keypoint_results
-            )
-
-        render_video(
-            verts,
-            self.pose_model.smpl_layer["neutral_10"].bm_x.faces,
-            K,
-            all_frames,
-            self.fps,
-            save_name,
+        renderer = Renderer(
+            img_wh[0],
+            img_wh[1],
+            K[0],
             self.device,
-            True,
+            self.pose_model.smpl_layer["neutral_10"].bm_x.faces,
+        )
+        default_R, default_T = torch.eye(3), torch.zeros(3)
+        rows = {frame_id: i for i, frame_id in enumerate(frame_ids)}
+
+        writer = imageio.get_writer(
+            save_name, fps=self.fps, mode="I", format="FFMPEG", macro_block_size=1
         )
+        for start, frames in video_chunks:
+            for frame_id, frame in enumerate(frames, start):
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+                # 2d keypoints visualization
+                if frame_id in rows:
+                    i = rows[frame_id]
+                    keypoint_results = [{"bbox": bboxes[i], "keypoints": keypoints[i]}]
+                    frame = self.keypoint_detector.visualize(frame, keypoint_results)
+
+                writer.append_data(
+                    render_frame(
+                        renderer,
+                        verts[frame_id],
+                        frame,
+                        default_R,
+                        default_T,
+                        self.device,
+                        True,
+                    )
+                )
+        writer.close()
 
     def save_results(self, out_path, frame_ids, poses, betas, transl, K, img_wh):
         K = K[0].cpu().numpy()
-        for i in frame_ids:
-
-            smplx_param = {}
-            smplx_param["betas"] = betas[i].tolist()
-            smplx_param["root_pose"] = poses[i, 0].tolist()
-            smplx_param["body_pose"] = poses[i, 1:22].tolist()
-            smplx_param["jaw_pose"] = poses[i, 22].tolist()
-            smplx_param["leye_pose"] = [0.0, 0.0, 0.0]
-            smplx_param["reye_pose"] = [0.0, 0.0, 0.0]
-            smplx_param["lhand_pose"] = poses[i, 25:40].tolist()
-            smplx_param["rhand_pose"] = poses[i, 40:55].tolist()
-
-            smplx_param["trans"] = transl[i].tolist()
-            smplx_param["focal"] = [float(K[0, 0]), float(K[1, 1])]
-            smplx_param["princpt"] = [float(K[0, 2]), float(K[1, 2])]
-            smplx_param["img_size_wh"] = [img_wh[0], img_wh[1]]
-            smplx_param["pad_ratio"] = self.pad_ratio
-            with open(os.path.join(out_path, f"{(i+1):05}.json"), "w") as fp:
-                json.dump(smplx_param, fp)
+        frame_ids = list(frame_ids)
+        num_frames = len(frame_ids)
+
+        def _rows(x, index=None):
+            x = x[frame_ids] if index is None else x[frame_ids][:, index]
+            return x.detach().cpu().numpy() if torch.is_tensor(x) else np.asarray(x)
+
+        smplx_params = dict(
+            betas=_rows(betas),
+            root_pose=_rows(poses, 0),
+            body_pose=_rows(poses, slice(1, 22)),
+            jaw_pose=_rows(poses, 22),
+            leye_pose=np.zeros((num_frames, 3)),
+            reye_pose=np.zeros((num_frames, 3)),
+            lhand_pose=_rows(poses, slice(25, 40)),
+            rhand_pose=_rows(poses, slice(40, 55)),
+            trans=_rows(transl),
+            focal=np.tile([[K[0, 0], K[1, 1]]], (num_frames, 1)),
+            princpt=np.tile([[K[0, 2], K[1, 2]]], (num_frames, 1)),
+            img_size_wh=np.tile([[img_wh[0], img_wh[1]]], (num_frames, 1)),
+        )
+        frame_names = [f"{(i+1):05}" for i in frame_ids]
+
+        # one columnar file instead of a json per frame, see motion_pack.py
+        save_motion_pack(
+            os.path.join(out_path, MOTION_PACK_NAME),
+            frame_names,
+            smplx_params,
+            meta=dict(pad_ratio=self.pad_ratio, fps=self.fps),
+        )
+
+        if self.save_json:
+            for row, frame_name in enumerate(frame_names):
+                smplx_param = {k: v[row].tolist() for k, v in smplx_params.items()}
+                smplx_param["pad_ratio"] = self.pad_ratio
+                with open(os.path.join(out_path, f"{frame_name}.json"), "w") as fp:
+                    json.dump(smplx_param, fp)
 
     def __call__(self, video_path, output_path, is_file_only=False):
         start = time.time()
@@ -514,11 +665,19 @@ class Video2MotionPipeline:
         # Step 1：读取视频帧
             # 支持视频缩放、padding；
             # 提取帧率（fps）、分辨率；
-        all_frames, raw_H, raw_W, fps, offset_w, offset_h = load_video(
+            # 逐块解码，峰值内存只与 chunk_size 有关；
+        raw_H, raw_W, fps, offset_w, offset_h = probe_video(
             video_path, pad_ratio=self.pad_ratio, max_resolution=self.MAX_RESOLUTION
         )
         self.fps = fps
-        video_length = len(all_frames)
+
+        def video_chunks():
+            return iter_video_chunks(
+                video_path,
+                pad_ratio=self.pad_ratio,
+                max_resolution=self.MAX_RESOLUTION,
+                chunk_size=self.chunk_size,
+            )
 
         # Step 2：构建相机参数
             # 创建模拟相机内参矩阵 K；
@@ -539,12 +698,22 @@ class Video2MotionPipeline:
         #     每一项为 [cx, cy, w, h]（中心点坐标 + 宽高）
         # 2. frame_ids：List[int]
         #     主角色在视频中出现的帧编号（frame index）
-        #     表示这些 bbox 对应的是 all_frames 中的哪些帧
-        bboxes, frame_ids, frames = self.track(all_frames)
+        #     表示这些 bbox 对应的是 视频中的哪些帧
+        bboxes, frame_ids, video_length = self.track(video_chunks())
 
-        # Step 4：2D 关键点检测
+        # Step 4：2D 关键点检测 + 逐帧 Multi-HMR 回归
             # 支持全身/手/脸关键点输出（wholebody）；
-        bboxes, keypoints = self.detect_keypoint2d(bboxes, frames)
+            # 重新逐块解码，只处理主角出现的帧；
+        all_bboxes, all_keypoints, all_frame_results = [], [], []
+        for rows, frames in self.select_frames(video_chunks(), frame_ids):
+            chunk_bboxes, chunk_keypoints = self.detect_keypoint2d(bboxes[rows], frames)
+            all_frame_results.extend(
+                self.regress_pose(frames, chunk_keypoints, chunk_bboxes)
+            )
+            all_bboxes.append(chunk_bboxes)
+            all_keypoints.append(chunk_keypoints)
+        bboxes = np.concatenate(all_bboxes)
+        keypoints = np.concatenate(all_keypoints)
         gc.collect()
         torch.cuda.empty_cache()
 
@@ -562,7 +731,7 @@ class Video2MotionPipeline:
         #     表示 每一帧重建出的 SMPL-X 网格顶点（mesh）
         #     每一项是一个 Tensor (6890, 3)，即 SMPL-X mesh 顶点坐标
         poses, betas, transl, verts = self.estimate_pose(
-            frame_ids, frames, keypoints, bboxes, raw_K, video_length
+            frame_ids, all_frame_results, keypoints, bboxes, raw_K, video_length
         )
 
         if is_file_only:
@@ -576,7 +745,14 @@ class Video2MotionPipeline:
         # Step 6：结果可视化
         if self.visualize:
             self.save_video(
-                all_frames, frame_ids, bboxes, keypoints, verts, raw_K, output_folder
+                video_chunks(),
+                frame_ids,
+                bboxes,
+                keypoints,
+                verts,
+                raw_K,
+                (raw_W, raw_H),
+                output_folder,
             )
 
         # Step 7：保存 SMPL-X 参数文件
@@ -623,6 +799,29 @@ def get_parse():
     )
 
     parser.add_argument("--visualize", action="store_true")
+    parser.add_argument(
+        "--save_json",
+        action="store_true",
+        help="also dump the legacy per-frame smplx json files",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=VIDEO_CHUNK_SIZE,
+        help="number of frames decoded at a time, bounds the peak memory",
+    )
+    parser.add_argument(
+        "--detection_batch_size",
+        type=int,
+        default=16,
+        help="number of frames per YOLO person detection forward",
+    )
+    parser.add_argument(
+        "--hmr_batch_size",
+        type=int,
+        default=8,
+        help="number of crops per Multi-HMR forward",
+    )
     args = parser.parse_args()
     return args
 
@@ -646,5 +845,9 @@ if __name__ == "__main__":
         visualize=opt.visualize,
         pad_ratio=opt.pad_ratio,
         fov=FOV,
+        save_json=opt.save_json,
+        chunk_size=opt.chunk_size,
+        detection_batch_size=opt.detection_batch_size,
+        hmr_batch_size=opt.hmr_batch_size,
     )
     pipeline(opt.video_path, opt.output_path)
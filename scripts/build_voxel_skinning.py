@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# @Function      : build the voxel skinning field and the SMPL-X bundle ahead of time, e.g. while provisioning a node
+#
+# python scripts/build_voxel_skinning.py --config configs/inference/human-lrm-1B.yaml
+
+import argparse
+import sys
+
+from omegaconf import OmegaConf
+
+sys.path.append(".")
+
+from LHM.models.rendering.smpl_x_voxel_dense_sampling import (
+    SMPLX_BUNDLE_DIR,
+    SMPLXVoxelMeshModel,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="build and cache the voxel skinning field and the SMPL-X bundle of a model config"
+    )
+    parser.add_argument("--config", type=str, required=True, help="inference config")
+    parser.add_argument("--gender", type=str, default="neutral")
+    parser.add_argument(
+        "--bundle_dir",
+        type=str,
+        default=SMPLX_BUNDLE_DIR,
+        help="where to write the SMPL-X bundle, empty to only build the voxel skinning field",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    model_cfg = OmegaConf.load(args.config).model
+    assert (
+        model_cfg.get("smplx_type", "smplx_2") == "smplx_2"
+    ), "only the voxel skinning model (smplx_2) uses a skinning field"
+
+    # building the model loads the skinning field, or builds and caches it.
+    # always rebuild from the SMPL-X files here, so that the bundle reflects them
+    smplx_model = SMPLXVoxelMeshModel(
+        model_cfg.human_model_path,
+        gender=args.gender,
+        subdivide_num=model_cfg.smplx_subdivide_num,
+        shape_param_dim=model_cfg.shape_param_dim,
+        expr_param_dim=model_cfg.expr_param_dim,
+        cano_pose_type=model_cfg.cano_pose_type,
+        dense_sample_points=model_cfg.dense_sample_pts,
+        apply_pose_blendshape=model_cfg.get("apply_pose_blendshape", False),
+        bundle_dir=None,
+    )
+    if args.bundle_dir:
+        print(f"save smplx bundle {smplx_model.save_bundle(args.bundle_dir)}")
+
+
+if __name__ == "__main__":
+    main()
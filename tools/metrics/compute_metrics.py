@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+# @Function      : unified metric engine: PSNR, SSIM, LPIPS and face similarity in one pass
+#
+# Every (pred, gt[, mask]) frame pair is decoded once, by a pool of loader workers, resized in memory
+# and shared by all the requested metrics. Predictions and ground truth are folders of images or videos.
+#
+# python tools/metrics/compute_metrics.py --gt ./benchmark/gt --pred ./exps/results/lhm --metrics psnr ssim lpips
+# python tools/metrics/compute_metrics.py --gt ./benchmark/gt --pred ./exps/anigs --layout anigs --frame_stride 4
+import argparse
+import json
+import os
+import sys
+
+sys.path.append("./")
+
+from collections import defaultdict
+from itertools import zip_longest
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+from tqdm import tqdm
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp", ".jfif"}
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
+METRICS = ("psnr", "ssim", "lpips", "face_similarity")
+
+
+def write_json(path, x):
+    """write a json file.
+
+    Args:
+        path (str): path to write json file.
+        x (dict): dict to write.
+    """
+    with open(path, "w") as f:
+        json.dump(x, f, indent=2)
+
+
+def img_center_padding(img_np, pad_ratio=0.2, background=255):
+    ori_h, ori_w = img_np.shape[:2]
+
+    h = round((1 + pad_ratio) * ori_h)
+    w = round((1 + pad_ratio) * ori_w)
+
+    img_pad_np = np.full((h, w) + img_np.shape[2:], background, dtype=img_np.dtype)
+    offset_h, offset_w = (h - ori_h) // 2, (w - ori_w) // 2
+    img_pad_np[offset_h : offset_h + ori_h, offset_w : offset_w + ori_w] = img_np
+
+    return img_pad_np
+
+
+def resolve_source(*candidates):
+    """first candidate that is a folder of frames or a video, with or without its extension."""
+    for path in candidates:
+        if os.path.isdir(path):
+            return path
+        if os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS):
+            return path
+        for ext in VIDEO_EXTENSIONS:
+            if os.path.isfile(path + ext):
+                return path + ext
+    return None
+
+
+def iter_frames(source, frame_stride=1):
+    """decode the frames of a folder of images or of a video.
+    Yields:
+        uint8 [H, W, C] RGB(A) frames, one every frame_stride.
+    """
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(source, f)
+            for f in os.listdir(source)
+            if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS
+            and "visualization" not in f
+        )
+        for path in paths[::frame_stride]:
+            frame = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+            elif frame.shape[2] == 4:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2RGBA)
+            else:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            yield frame
+    else:
+        cap = cv2.VideoCapture(source)
+        frame_idx = 0
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if frame_idx % frame_stride == 0:
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frame_idx += 1
+        cap.release()
+
+
+class FramePairStream(IterableDataset):
+    """Streams the frame pairs of a list of items, each worker decodes a shard of the items.
+
+    Yields per item batches of up to batch_size frames, resized to the prediction in memory:
+        dict(item, pred uint8 [B, 3, H, W], gt uint8 [B, 3, H, W], mask float [B, 1, H, W] or None)
+    and dict(item, mismatch=True) if the pred, gt and mask frame counts differ.
+    """
+
+    def __init__(self, items, batch_size=16, frame_stride=1, pad_gt=False):
+        """
+        Args:
+            items (list): (name, pred source, gt source, mask source or None).
+            batch_size (int): frames per batch.
+            frame_stride (int): evaluate one frame every frame_stride.
+            pad_gt (bool): center pad the ground truth by 20% with white, as the predictions are.
+        """
+        self.items = items
+        self.batch_size = batch_size
+        self.frame_stride = frame_stride
+        self.pad_gt = pad_gt
+
+    def __iter__(self):
+        worker = get_worker_info()
+        items = (
+            self.items
+            if worker is None
+            else self.items[worker.id :: worker.num_workers]
+        )
+        for item in items:
+            yield from self.iter_item(*item)
+
+    def make_batch(self, name, frames):
+        pred, gt, mask = zip(*frames)
+        return dict(
+            item=name,
+            pred=torch.from_numpy(np.stack(pred)).permute(0, 3, 1, 2),
+            gt=torch.from_numpy(np.stack(gt)).permute(0, 3, 1, 2),
+            mask=None if mask[0] is None else torch.from_numpy(np.stack(mask))[:, None],
+        )
+
+    def iter_item(self, name, pred_source, gt_source, mask_source):
+        pred_frames = iter_frames(pred_source, self.frame_stride)
+        gt_frames = iter_frames(gt_source, self.frame_stride)
+        mask_frames = (
+            iter_frames(mask_source, self.frame_stride) if mask_source is not None else None
+        )
+
+        frames = []
+        for pred, gt in zip_longest(pred_frames, gt_frames):
+            if pred is None or gt is None:
+                yield dict(item=name, mismatch=True)
+                return
+
+            pred = pred[..., :3]
+            gt = gt[..., :3]
+            if self.pad_gt:
+                gt = img_center_padding(gt)
+
+            h, w = pred.shape[:2]
+            if gt.shape[:2] != (h, w):
+                gt = cv2.resize(gt, (w, h), interpolation=cv2.INTER_AREA)
+
+            mask = None
+            if mask_frames is not None:
+                # masks are the alpha of the unpadded ground truth
+                mask = next(mask_frames, None)
+                if mask is None:
+                    yield dict(item=name, mismatch=True)
+                    return
+                mask = mask[..., -1].astype(np.float32) / 255.0
+                mask = img_center_padding(mask, background=0)
+                mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_AREA)
+
+            frames.append((pred, gt, mask))
+            if len(frames) == self.batch_size:
+                yield self.make_batch(name, frames)
+                frames = []
+
+        if len(frames) > 0:
+            yield self.make_batch(name, frames)
+
+
+class MetricEngine:
+    """batched metrics of a pair batch, see FramePairStream. Every metric returns one score per frame."""
+
+    def __init__(self, metrics, device="cuda", psnr_width=512):
+        self.metrics = metrics
+        self.device = device
+        self.psnr_width = psnr_width
+
+        if "ssim" in metrics:
+            from torchmetrics.functional.image import (
+                structural_similarity_index_measure,
+            )
+
+            self.ssim_fn = structural_similarity_index_measure
+        if "lpips" in metrics:
+            from torchmetrics.image.lpip import LearnedPerceptualImagePatchSimilarity
+
+            self.lpips_fn = LearnedPerceptualImagePatchSimilarity(net_type="squeeze").to(
+                device
+            )
+        if "face_similarity" in metrics:
+            from LHM.models.arcface_utils import ResNetArcFace
+            from LHM.utils.face_detector import FaceDetector
+
+            self.face_detector = FaceDetector(
+                model_path="./pretrained_models/gagatracker/vgghead/vgg_heads_l.trcd",
+                device=device,
+            )
+            self.id_face_net = ResNetArcFace().to(device).eval()
+
+    @staticmethod
+    def resize_width(x, width):
+        h, w = x.shape[-2:]
+        return F.interpolate(x, size=(int(h * width / w), width), mode="area")
+
+    def psnr(self, pred, gt, mask):
+        if self.psnr_width is not None:
+            pred = self.resize_width(pred, self.psnr_width)
+            gt = self.resize_width(gt, self.psnr_width)
+            if mask is not None:
+                mask = self.resize_width(mask, self.psnr_width)
+
+        if mask is None:
+            mse = ((pred - gt) ** 2).flatten(1).mean(dim=1)
+        else:
+            # composite on white, then only the foreground pixels
+            pred = pred * mask + 1 - mask
+            gt = gt * mask + 1 - mask
+            fg = (mask > 0.5).expand_as(pred).flatten(1).float()
+            mse = (((pred - gt) ** 2).flatten(1) * fg).sum(dim=1) / fg.sum(dim=1).clamp(min=1)
+        return 10 * torch.log10(1.0 / mse.clamp(min=1e-10))
+
+    def ssim(self, pred, gt):
+        return self.ssim_fn(pred, gt, data_range=1.0, reduction="none")
+
+    def lpips(self, pred, gt):
+        # LPIPS needs the images to be in the [-1, 1] range. the network itself keeps one score per frame
+        return self.lpips_fn.net(gt * 2 - 1, pred * 2 - 1).flatten()
+
+    @torch.no_grad()
+    def face_feature(self, frames):
+        """arcface features of the faces in uint8 [B, 3, H, W] frames, None where no face is found."""
+        heads, found = [], []
+        for frame in frames:
+            try:
+                bbox = self.face_detector(frame)
+            except Exception:
+                found.append(False)
+                continue
+            head = frame[:, int(bbox[1]) : int(bbox[3]), int(bbox[0]) : int(bbox[2])]
+            if head.numel() == 0:
+                found.append(False)
+                continue
+            head = head[None].float() / 255.0
+            gray = 0.2989 * head[:, 0] + 0.5870 * head[:, 1] + 0.1140 * head[:, 2]
+            heads.append(
+                F.interpolate(gray[:, None], (128, 128), mode="bilinear", align_corners=False)
+            )
+            found.append(True)
+
+        features = [None] * len(found)
+        if len(heads) > 0:
+            head_features = self.id_face_net(torch.cat(heads)).detach()
+            for i, idx in enumerate(np.nonzero(found)[0]):
+                features[idx] = head_features[i : i + 1]
+        return features
+
+    def face_similarity(self, pred_u8, gt_u8, reference=None):
+        """L1 distance of the arcface features, to reference or to the gt frame. NaN without a face."""
+        pred_features = self.face_feature(pred_u8)
+        gt_features = (
+            [reference] * len(pred_features)
+            if reference is not None
+            else self.face_feature(gt_u8)
+        )
+        scores = [
+            F.l1_loss(p, g).item() if p is not None and g is not None else float("nan")
+            for p, g in zip(pred_features, gt_features)
+        ]
+        return torch.tensor(scores)
+
+    @torch.no_grad()
+    def __call__(self, batch, reference=None):
+        pred_u8 = batch["pred"].to(self.device)
+        gt_u8 = batch["gt"].to(self.device)
+        pred = pred_u8.float() / 255.0
+        gt = gt_u8.float() / 255.0
+        mask = batch["mask"].to(self.device) if batch["mask"] is not None else None
+
+        scores = dict()
+        if "psnr" in self.metrics:
+            scores["psnr"] = self.psnr(pred, gt, mask)
+        if "ssim" in self.metrics:
+            scores["ssim"] = self.ssim(pred, gt)
+        if "lpips" in self.metrics:
+            scores["lpips"] = self.lpips(pred, gt)
+        if "face_similarity" in self.metrics:
+            scores["face_similarity"] = self.face_similarity(pred_u8, gt_u8, reference)
+        return {k: v.float().cpu() for k, v in scores.items()}
+
+
+def collect_items(opt):
+    """(name, pred source, gt source, mask source) of the benchmark, and the front view of each item.
+
+    front_view: items listed in gt/front_view.txt as "name [front_view_idx]", predictions in pred/name/rgb.
+    anigs: every sub folder (or video) of pred, predictions in pred/name/rgb, ground truth in gt/name.
+    """
+    front_views = dict()
+    if opt.layout == "front_view":
+        with open(os.path.join(opt.gt, "front_view.txt")) as f:
+            lines = [line.split(" ") for line in f.read().splitlines() if line.strip()]
+        names = [line[0] for line in lines]
+        front_views = {line[0]: int(line[1]) for line in lines if len(line) > 1}
+    else:
+        names = sorted(
+            os.path.splitext(f)[0]
+            for f in os.listdir(opt.pred)
+            if os.path.isdir(os.path.join(opt.pred, f)) or f.lower().endswith(VIDEO_EXTENSIONS)
+        )
+
+    items = []
+    for name in names:
+        pred_source = resolve_source(
+            os.path.join(opt.pred, name, "rgb"), os.path.join(opt.pred, name)
+        )
+        gt_source = resolve_source(os.path.join(opt.gt, name))
+        mask_source = (
+            resolve_source(os.path.join(opt.mask, name)) if opt.mask is not None else None
+        )
+        if pred_source is None or gt_source is None:
+            continue
+        if opt.mask is not None and mask_source is None:
+            continue
+        items.append((name, pred_source, gt_source, mask_source))
+    return items, front_views
+
+
+def reference_face_features(engine, items, front_views):
+    """arcface feature of the front view ground truth frame of each item, the legacy face similarity."""
+    references = dict()
+    for name, _, gt_source, _ in items:
+        if name not in front_views or not os.path.isdir(gt_source):
+            continue
+        path = os.path.join(gt_source, f"{front_views[name]:05d}.png")
+        if not os.path.exists(path):
+            continue
+        frame = cv2.cvtColor(cv2.imread(path, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+        feature = engine.face_feature(
+            torch.from_numpy(frame).permute(2, 0, 1)[None].to(engine.device)
+        )[0]
+        if feature is not None:
+            references[name] = feature
+    return references
+
+
+def get_parse():
+    parser = argparse.ArgumentParser(description="unified PSNR / SSIM / LPIPS / face similarity evaluation")
+    parser.add_argument("--gt", type=str, required=True, help="ground truth root")
+    parser.add_argument("--pred", type=str, required=True, help="prediction root, folders of frames or videos")
+    parser.add_argument("-m", "--mask", type=str, default=None, help="ground truth mask root, PSNR on foreground")
+    parser.add_argument("--metrics", nargs="+", default=["psnr", "ssim", "lpips"], choices=METRICS)
+    parser.add_argument("--layout", type=str, default="front_view", choices=["front_view", "anigs"])
+    parser.add_argument("--face_mode", type=str, default=None, choices=["front_view", "per_frame"],
+                        help="front_view: min distance to the front view gt frame, per_frame: mean distance to each gt frame")
+    parser.add_argument("--frame_stride", type=int, default=1)
+    parser.add_argument("--psnr_width", type=int, default=512, help="PSNR resolution, 0 keeps the prediction size")
+    parser.add_argument("--pad", action="store_true", help="if the gt pad?")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--num_workers", type=int, default=8)
+    parser.add_argument("--pre", type=str, default="")
+    parser.add_argument("--output", type=str, default=None, help="json report, defaults to ./exps/metrics{pre}/...")
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    opt = get_parse()
+    opt.pred = opt.pred.rstrip("/")
+    face_mode = opt.face_mode or ("front_view" if opt.layout == "front_view" else "per_frame")
+
+    items, front_views = collect_items(opt)
+    if opt.debug:
+        items = items[:1]
+
+    engine = MetricEngine(
+        opt.metrics, psnr_width=opt.psnr_width if opt.psnr_width > 0 else None
+    )
+    references = None
+    if "face_similarity" in opt.metrics and face_mode == "front_view":
+        references = reference_face_features(engine, items, front_views)
+
+    loader = DataLoader(
+        FramePairStream(items, opt.batch_size, opt.frame_stride, opt.pad),
+        batch_size=None,
+        num_workers=min(opt.num_workers, len(items)),
+        pin_memory=True,
+    )
+
+    scores = defaultdict(lambda: defaultdict(list))
+    skipped = set()
+    for batch in tqdm(loader, desc="Evaluating"):
+        name = batch["item"]
+        if batch.get("mismatch", False):
+            print(f"frame count of pred and gt differ, skip {name}")
+            skipped.add(name)
+            continue
+        if references is not None and name not in references:
+            skipped.add(name)
+            continue
+
+        reference = references[name] if references is not None else None
+        for metric, value in engine(batch, reference).items():
+            scores[name][metric].append(value)
+
+    results_dict = defaultdict(dict)
+    for name, *_ in items:
+        if name in skipped or name not in scores:
+            continue
+        for metric, values in scores[name].items():
+            values = torch.cat(values)
+            values = values[~torch.isnan(values)]
+            if len(values) == 0:
+                continue
+            if metric == "face_similarity" and face_mode == "front_view":
+                # the most similar view
+                results_dict[name][metric] = values.min().item()
+            else:
+                results_dict[name][metric] = values.mean().item()
+
+    for metric in opt.metrics:
+        values = [r[metric] for r in results_dict.values() if metric in r]
+        if len(values) > 0:
+            results_dict["all_mean"][metric] = float(np.mean(values))
+    results_dict["skipped"] = sorted(skipped)
+
+    output = opt.output
+    if output is None:
+        save_folder = os.path.join(
+            f"./exps/metrics{opt.pre}", "psnr_results", *opt.pred.split("/")[-2:]
+        )
+        os.makedirs(save_folder, exist_ok=True)
+        output = os.path.join(save_folder, "metrics.json")
+
+    print(json.dumps(results_dict["all_mean"], indent=2))
+    write_json(output, results_dict)
+    print(f"save metrics to {output}")
+
+
+if __name__ == "__main__":
+    main()